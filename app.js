@@ -4,14 +4,16 @@
 const MODE_CONFIG = {
   "1p": {
     DATA_PATH: "./vacancy_price_cache.json",
-    PREV_PATH: "./vacancy_price_cache_previous.json",
     HIST_PATH: "./historical_data.json",
+    HIST_MANIFEST_PATH: "./data/history_1p_manifest.json",
+    CUBE_PATH: "./data/cube_1p.json",
     ARCHIVE_PATH: "./finalized_daily_data.json",
   },
   "2p": {
     DATA_PATH: "./vacancy_price_cache_2p.json",
-    PREV_PATH: "./vacancy_price_cache_2p_previous.json",
     HIST_PATH: "./historical_data_2p.json",
+    HIST_MANIFEST_PATH: "./data/history_2p_manifest.json",
+    CUBE_PATH: "./data/cube_2p.json",
     ARCHIVE_PATH: "./finalized_daily_data_2p.json",
   }
 };
@@ -38,14 +40,22 @@ function modeLabel() {
 
 // グローバル状態
 let calendarData    = {},
-    prevData        = {},
     eventData       = {},
     historicalData  = {},
     spikeData       = {},
     finalArchiveData = {};
 let currentYM = [], selectedDate = null;
+
+// 履歴は月別シャード（manifest に載った内容ハッシュ付きファイル）を、表示する月の分だけ読む
+let historyManifest = null,   // { shards: { "YYYY-MM": { file, dates: [...] } } }
+    historyDates    = [],     // 前日/翌日ナビ用の全宿泊日
+    historyShardLoaded = {};  // "YYYY-MM" → Promise（読み込み中） / true（済）
 let demandBase1pData = {}; // ★追加：🔥判定は常に1名データを使う
 
+// 予約ペースキューブ（宿泊日 × 到着までの日数）。推移グラフはここから直接描く
+let bookingCube = null;   // { meta, cols: { 列名: TypedArray }, stayIndex: { "YYYY-MM-DD": 行 } }
+const CUBE_TYPES = { int16: Int16Array, int32: Int32Array, uint8: Uint8Array };
+
 
 // ========== 祝日判定（ローカルjs方式） ==========
 function isHoliday(date) {
@@ -84,9 +94,9 @@ async function loadJson(path) {
 async function loadAll() {
   const conf = getModeConf();
   calendarData    = await loadJson(conf.DATA_PATH);
-  prevData        = await loadJson(conf.PREV_PATH);
   eventData       = await loadJson(EVENT_PATH);
-  historicalData  = await loadJson(conf.HIST_PATH);
+  await loadHistoryIndex(conf);
+  await loadBookingCube(conf);
   spikeData       = await loadJson(SPIKE_PATH);   // 当面は1名（後回し）
   finalArchiveData = await loadJson(conf.ARCHIVE_PATH);
 
@@ -101,6 +111,102 @@ async function loadAll() {
   }
 }
 
+// ========== 履歴シャード ==========
+async function loadHistoryIndex(conf) {
+  historicalData = {};
+  historyShardLoaded = {};
+  const manifest = await loadJson(conf.HIST_MANIFEST_PATH);
+  if (manifest && manifest.shards) {
+    historyManifest = manifest;
+    historyDates = Object.values(manifest.shards).flatMap(s => s.dates || []).sort();
+  } else {
+    // シャード未生成時は従来どおり単一ファイル
+    historyManifest = null;
+    historicalData = await loadJson(conf.HIST_PATH);
+    historyDates = Object.keys(historicalData).sort();
+  }
+}
+
+function isHistoryReady(dateStr) {
+  if (!historyManifest) return true;
+  const ym = String(dateStr).slice(0, 7);
+  return !historyManifest.shards[ym] || historyShardLoaded[ym] === true;
+}
+
+function ensureHistoryShard(dateStr) {
+  const ym = String(dateStr).slice(0, 7);
+  const shard = historyManifest && historyManifest.shards[ym];
+  if (!shard || historyShardLoaded[ym] === true) return Promise.resolve();
+  if (!historyShardLoaded[ym]) {
+    // モード切替で入れ替わっても古い読み込みが混ざらないよう、その時点の参照に書き込む
+    const target = historicalData, loaded = historyShardLoaded;
+    loaded[ym] = (async () => {
+      try {
+        const res = await fetch("./data/" + shard.file);  // ファイル名が内容ハッシュなのでキャッシュ可（cb不要）
+        if (res.ok) Object.assign(target, await res.json());
+      } catch {}
+      loaded[ym] = true;
+    })();
+  }
+  return historyShardLoaded[ym];
+}
+
+// ========== 予約ペースキューブ ==========
+async function loadBookingCube(conf) {
+  bookingCube = null;
+  const meta = await loadJson(conf.CUBE_PATH);
+  if (!meta || !meta.file || !meta.columns) return;
+  try {
+    const res = await fetch("./data/" + meta.file);  // ファイル名が内容ハッシュなのでキャッシュ可（cb不要）
+    if (!res.ok) return;
+    const buf = await res.arrayBuffer();
+    const cols = {};
+    for (const [name, c] of Object.entries(meta.columns)) {
+      const T = CUBE_TYPES[c.dtype];
+      if (T) cols[name] = new T(buf, c.offset, c.shape.reduce((a, b) => a * b, 1));
+    }
+    const stayIndex = {};
+    meta.stays.forEach((d, i) => { stayIndex[d] = i; });
+    bookingCube = { meta, cols, stayIndex };
+  } catch {
+    bookingCube = null;
+  }
+}
+
+function cubeValue(name, row, lead) {
+  const c = bookingCube.cols[name];
+  if (!c || row < 0) return null;
+  const v = c[row * bookingCube.meta.leads + lead];
+  return v === bookingCube.meta.columns[name].missing ? null : v;
+}
+
+// 宿泊日の推移（取得日ラベル・在庫・価格）と、同じリードタイムの参照曲線（同曜日・同名イベント）
+function getCubeSeries(dateStr) {
+  if (!bookingCube || !(dateStr in bookingCube.stayIndex)) return null;
+  const row = bookingCube.stayIndex[dateStr];
+  const stay = new Date(dateStr + "T00:00:00Z");
+  const wdRow = (stay.getUTCDay() + 6) % 7;   // 参照曲線 weekday:0 = 月曜
+  const evRow = bookingCube.cols.ref_event ? bookingCube.cols.ref_event[row] : -1;
+  const out = {
+    labels: [], sv: [], pv: [], pct: [],
+    refV: [], refP: [], evV: [], evP: [],
+    evLabel: evRow >= 0 ? bookingCube.meta.ref_labels[evRow].replace(/^event:/, "") : null,
+  };
+  for (let lead = bookingCube.meta.leads - 1; lead >= 0; lead--) {
+    const v = cubeValue("vacancy", row, lead), p = cubeValue("price", row, lead);
+    if (v == null && p == null) continue;   // この日のスナップショットなし
+    out.labels.push(new Date(stay.getTime() - lead * 86400000).toISOString().slice(0, 10));
+    out.sv.push(v);
+    out.pv.push(p);
+    out.pct.push(cubeValue("my_pct", row, lead));
+    out.refV.push(cubeValue("ref_vacancy", wdRow, lead));
+    out.refP.push(cubeValue("ref_price", wdRow, lead));
+    out.evV.push(evRow >= 0 ? cubeValue("ref_vacancy", evRow, lead) : null);
+    out.evP.push(evRow >= 0 ? cubeValue("ref_price", evRow, lead) : null);
+  }
+  return out.labels.length ? out : null;
+}
+
 // ========== 1名/2名 タブ（DOMへ自動挿入） ==========
 function ensureAvgModeTabs() {
   // すでにあるなら何もしない
@@ -449,22 +555,17 @@ function renderMonth(y,m) {
     // 過去日付グレーアウト
     if (iso < todayIso()) cell.classList.add("past-date");
 
-    // データ取得＆差分
+    // データ取得＆差分（キャッシュの *_diff。無い日は ±0）
     const cur = getDisplayData(iso);
-    const prv = prevData[iso] || {};
     const isArchiveOnly = !calendarData[iso] && !!finalArchiveData[iso];
 
     const dv = isArchiveOnly
       ? 0
-      : (typeof cur.vacancy_diff === "number"
-          ? cur.vacancy_diff
-          : (cur.vacancy || 0) - (prv.vacancy || 0));
+      : (typeof cur.vacancy_diff === "number" ? cur.vacancy_diff : 0);
 
     const dp = isArchiveOnly
       ? 0
-      : (typeof cur.avg_price_diff === "number"
-          ? cur.avg_price_diff
-          : Math.round((cur.avg_price || 0) - (prv.avg_price || 0)));
+      : (typeof cur.avg_price_diff === "number" ? cur.avg_price_diff : 0);
 
     const stock = cur.vacancy != null ? `${cur.vacancy}件` : "-";
     const price = cur.avg_price != null ? Number(cur.avg_price).toLocaleString() : "-";
@@ -485,7 +586,7 @@ function renderMonth(y,m) {
     const badge = lvl ? `<div class="cell-demand-badge lv${lvl}">🔥${lvl}</div>` : "";
 
     // イベント
-    const evs = (eventData[iso] || [])
+    const evs = ((calendarData[iso] && calendarData[iso].events) || eventData[iso] || [])
       .map(ev => `<a href="https://www.google.com/search?q=${encodeURIComponent(ev.name)}" target="_blank" title="「${ev.name}」について調べる" class="event-link">
                     ${ev.icon}${ev.name}
                   </a>`)
@@ -523,6 +624,14 @@ function renderGraph(dateStr){
 
   if (!dateStr) { gc.innerHTML = ""; return; }
 
+  // キューブに無い日だけ、該当月のシャードを読み込んでから描き直す
+  const cubeSeries = getCubeSeries(dateStr);
+  if (!cubeSeries && !isHistoryReady(dateStr)) {
+    gc.innerHTML = '<div class="archive-summary-note">推移データを読み込み中…</div>';
+    ensureHistoryShard(dateStr).then(() => { if (selectedDate === dateStr) renderPage(); });
+    return;
+  }
+
   // 前年同月・同曜日・第N週の比較対象日を計算
   function getComparisonDate(src) {
     try {
@@ -626,7 +735,7 @@ function renderGraph(dateStr){
   }
 
   // 全日付リストとインデックス
-  const allDates = Object.keys(historicalData).sort();
+  const allDates = historyDates;
   const idx = allDates.indexOf(dateStr);
 
   // HTML描画
@@ -654,16 +763,34 @@ function renderGraph(dateStr){
     renderPage();
   };
 
-  // 履歴データ取得
-  const hist = historicalData[dateStr] || {};
-  const labels = [];
-  const sv = [];
-  const pv = [];
-  Object.keys(hist).sort().forEach(d => {
-    labels.push(d);
-    sv.push(hist[d].vacancy);
-    pv.push(hist[d].avg_price);
-  });
+  // 履歴データ取得（キューブ優先、無ければ履歴JSON）
+  let labels = [], sv = [], pv = [];
+  if (cubeSeries) {
+    ({ labels, sv, pv } = cubeSeries);
+  } else {
+    const hist = historicalData[dateStr] || {};
+    Object.keys(hist).sort().forEach(d => {
+      labels.push(d);
+      sv.push(hist[d].vacancy);
+      pv.push(hist[d].avg_price);
+    });
+  }
+  // 参照曲線（同じリードタイムでの同曜日・同名イベントの中央値）
+  const refSets = (kind) => {
+    if (!cubeSeries) return [];
+    const sets = [];
+    const ref = kind === "v" ? cubeSeries.refV : cubeSeries.refP;
+    if (ref.some(v => v != null)) {
+      sets.push({ label: "同曜日（直近8週）", data: ref, fill: false, borderColor: "#9e9e9e", borderDash: [4, 4], pointRadius: 0, hitRadius: 12, hoverRadius: 4, spanGaps: true });
+    }
+    const ev = kind === "v" ? cubeSeries.evV : cubeSeries.evP;
+    if (cubeSeries.evLabel && ev.some(v => v != null)) {
+      sets.push({ label: `過去の${cubeSeries.evLabel}`, data: ev, fill: false, borderColor: "#7e57c2", borderDash: [2, 3], pointRadius: 0, hitRadius: 12, hoverRadius: 4, spanGaps: true });
+    }
+    return sets;
+  };
+  const stockRefs = refSets("v");
+  const priceRefs = refSets("p");
 
   // 履歴がない場合の表示
   if (!labels.length) {
@@ -692,7 +819,7 @@ function renderGraph(dateStr){
 
   // 在庫グラフ
 // 在庫グラフ用の縦軸レンジを動的計算
-const stockNums = sv.filter(v => typeof v === "number" && isFinite(v));
+const stockNums = sv.concat(...stockRefs.map(d => d.data)).filter(v => typeof v === "number" && isFinite(v));
 let stockMin = 50;
 let stockMax = 350;
 if (stockNums.length) {
@@ -717,7 +844,7 @@ window.sc = new Chart(
     type: "line",
     data: {
       labels,
-      datasets: [{ data: sv, fill: false, borderColor: "#2196f3", pointRadius: 2, hitRadius: 12, hoverRadius: 6 }]
+      datasets: [{ label: "在庫数", data: sv, fill: false, borderColor: "#2196f3", pointRadius: 2, hitRadius: 12, hoverRadius: 6 }].concat(stockRefs)
     },
     options: {
       interaction: {
@@ -725,7 +852,7 @@ window.sc = new Chart(
         intersect: false
       },
       plugins: {
-        legend: { display: false },
+        legend: { display: stockRefs.length > 0 },
         tooltip: {
           displayColors: false,
           padding: 14,
@@ -734,7 +861,7 @@ window.sc = new Chart(
           bodyFont: { size: 14 },
           callbacks: {
             title: (ctx) => ctx[0]?.label || "",
-            label: (ctx) => `在庫数：${Number(ctx.parsed.y).toLocaleString()}`
+            label: (ctx) => `${ctx.dataset.label || "在庫数"}：${Number(ctx.parsed.y).toLocaleString()}`
           }
         }
       },
@@ -770,7 +897,7 @@ window.sc = new Chart(
   const myPriceVal = Number((calendarData[dateStr] || {}).my_price || 0);
   const showMine = isCompareModeOn() && myPriceVal > 0;
   const mySeries = showMine ? Array(labels.length).fill(myPriceVal) : [];
-  const yVals = pv.concat(showMine ? [myPriceVal] : []);
+  const yVals = pv.concat(showMine ? [myPriceVal] : [], ...priceRefs.map(d => d.data));
   let ymin = 10000, ymax = 40000;
   if (yVals.length) {
     const nums = yVals.filter(v => typeof v === "number" && isFinite(v));
@@ -784,7 +911,7 @@ window.sc = new Chart(
   }
   const priceDatasets = [
     { label: "市場平均", data: pv, fill: false, borderColor: "#e91e63", pointRadius: 2, hitRadius: 12, hoverRadius: 6 }
-  ];
+  ].concat(priceRefs);
   if (showMine) {
     priceDatasets.push({
       label: "自社",
@@ -820,7 +947,10 @@ window.sc = new Chart(
               title: (ctx) => ctx[0]?.label || "",
               label: (ctx) => {
                 const datasetLabel = ctx.dataset.label || "";
-                return `${datasetLabel}：￥${Number(ctx.parsed.y).toLocaleString()}`;
+                const line = `${datasetLabel}：￥${Number(ctx.parsed.y).toLocaleString()}`;
+                // 自社ラインには取得日時点の市場内パーセンタイルも出す
+                const pct = cubeSeries && ctx.dataset.label === "自社" ? cubeSeries.pct[ctx.dataIndex] : null;
+                return pct != null ? `${line}（安い順 ${pct}%）` : line;
               }
             }
           }
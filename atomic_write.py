@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+atomic_write.py
+– 中身が変わったファイルだけを書き換える書き込み層
+
+  ・シリアライズは1回。ディスク上のファイルとサイズ → SHA-256 の順に比べ、同じなら触らない
+    （mtime も変わらないので git add -A やデプロイに差分として出ない）
+  ・書くときは同じディレクトリの一意な一時ファイル → fsync → os.replace
+    （途中で落ちても壊れたファイルも一時ファイルも残さない。同じファイルへの同時書き込みでも一時ファイルを取り合わない）
+  ・実行中に書いた / 飛ばしたファイル数とバイト数を集計（summary()）
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+_lock  = threading.Lock()
+_stats = {"written": 0, "skipped": 0, "bytes_written": 0, "bytes_skipped": 0}
+
+
+def _file_digest(p: Path) -> bytes:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def unchanged(path, data: bytes) -> bool:
+    """path の中身が data と同じか（サイズが違えば読まずに False）"""
+    p = Path(path)
+    try:
+        if p.stat().st_size != len(data):
+            return False
+    except FileNotFoundError:
+        return False
+    return _file_digest(p) == hashlib.sha256(data).digest()
+
+
+def write_bytes(path, data: bytes) -> bool:
+    """中身が変わっていれば一時ファイル経由で書いて True、同じなら何もせず False。"""
+    p = Path(path)
+    if unchanged(p, data):
+        with _lock:
+            _stats["skipped"] += 1
+            _stats["bytes_skipped"] += len(data)
+        return False
+    p.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        mode = p.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=p.parent, prefix=p.name + ".", suffix=".tmp", delete=False) as f:
+            tmp = f.name
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)   # NamedTemporaryFile は 0600 で作られる
+        os.replace(tmp, p)
+        tmp = None
+    finally:
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+    with _lock:
+        _stats["written"] += 1
+        _stats["bytes_written"] += len(data)
+    return True
+
+
+def dumps_json(obj, compact: bool = True) -> bytes:
+    """compact=True: 区切りの空白なし（データファイル向け） / False: indent=2（人が読む小さなファイル向け）"""
+    if compact:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = json.dumps(obj, ensure_ascii=False, indent=2)
+    return text.encode("utf-8")
+
+
+def write_json(path, obj, compact: bool = True) -> bool:
+    return write_bytes(path, dumps_json(obj, compact))
+
+
+def summary() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def reset():
+    with _lock:
+        for k in _stats:
+            _stats[k] = 0
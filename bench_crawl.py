@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+bench_crawl.py
+– update_cache.py を1回まるごとオフラインで走らせ、クロール性能を計測する
+
+  既定   : fake_rakuten_server をスレッドで立て、RAKUTEN_API_URL をそこへ向ける
+  --replay DIR : RAKUTEN_HTTP_MODE=record で保存した応答を再生（CRAWL_TODAY は記録日に固定）
+
+  実データを壊さないよう、作業用の一時ディレクトリに JSON 一式をコピーして実行する。
+  結果（経過時間・req/sec・リトライ・ステータス別件数・レイテンシ・段階別時間）を JSON で標準出力 / --out に書き出す。
+  クライアント側の値は update_cache.py の実行レポート（run_report.json）から読む。
+
+使い方:
+  python bench_crawl.py --latency 0.15 --limit-rps 3 --workers 1 4 8
+  python bench_crawl.py --replay .http_fixtures
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+from fake_rakuten_server import FakeRakuten, make_server
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _prepare_workdir() -> Path:
+    work = Path(tempfile.mkdtemp(prefix="bench_crawl_"))
+    for pattern in ("*.json", "*.sqlite3"):
+        for p in ROOT.glob(pattern):
+            shutil.copy2(p, work / p.name)
+    return work
+
+
+def run_once(workers: int, env_extra: dict, fake: FakeRakuten = None) -> dict:
+    work = _prepare_workdir()
+    report_file = work / "run_report.json"
+    env = dict(os.environ)
+    env.update({
+        "RAKUTEN_CRAWL_WORKERS": str(workers),
+        "CRAWL_RUN_ID":          f"bench-{int(time.time())}-{workers}",
+        "CRAWL_CHECKPOINT_DIR":  str(work / ".crawl_checkpoint"),
+        "RUN_REPORT_FILE":       str(report_file),
+    })
+    env.update(env_extra)
+
+    if fake:
+        fake.reset()
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, str(ROOT / "update_cache.py")], cwd=work, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - t0
+    server_stats = fake.snapshot() if fake else None
+
+    run_report = json.loads(report_file.read_text(encoding="utf-8")) if report_file.exists() else {}
+    client = run_report.get("crawl", {})
+    counts = client.get("counts", {})
+    latency = run_report.get("latency", {}).get("request:market", {})
+    parse = run_report.get("latency", {}).get("parse:market", {})
+    result = {
+        "workers":      workers,
+        "ok":           proc.returncode == 0,
+        "wall_clock_s": round(elapsed, 2),
+        "tasks":        client.get("tasks"),
+        "final_rate":   client.get("rate"),
+        "client":       counts,
+        "markets":      client.get("markets"),
+        "latency_ms":   {k: latency.get(k) for k in ("p50_ms", "p90_ms", "p99_ms")},
+        "bytes":        run_report.get("requests", {}).get("total", {}).get("bytes"),
+        "wire_bytes":   run_report.get("requests", {}).get("total", {}).get("wire_bytes"),
+        "parse_ms":     {k: parse.get(k) for k in ("p50_ms", "p90_ms")},
+        "stages":       {k: v["seconds"] for k, v in run_report.get("stage", {}).items()},
+    }
+    if server_stats is not None:
+        requests_n = server_stats["requests"]
+        result.update({
+            "requests":  requests_n,
+            "req_per_s": round(requests_n / elapsed, 2) if elapsed else None,
+            "retries":   server_stats["retries"],
+            "by_status": server_stats["by_status"],
+        })
+    else:
+        requests_n = sum(counts.get(k, 0) for k in ("success", "throttled", "server_error", "http_error"))
+        result.update({
+            "requests":  requests_n,
+            "req_per_s": round(requests_n / elapsed, 2) if elapsed else None,
+            "retries":   counts.get("throttled", 0) + counts.get("server_error", 0) + counts.get("exception", 0),
+        })
+    if proc.returncode != 0:
+        result["stderr_tail"] = proc.stderr[-2000:]
+    shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline crawl benchmark for update_cache.py")
+    ap.add_argument("--workers", type=int, nargs="+", default=[4], help="RAKUTEN_CRAWL_WORKERS（複数指定で順に計測）")
+    ap.add_argument("--replay", help="record モードで保存した応答ディレクトリ")
+    ap.add_argument("--latency", type=float, default=0.15)
+    ap.add_argument("--limit-rps", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--hotels", type=int, default=250)
+    ap.add_argument("--out", help="結果JSONの書き出し先")
+    args = ap.parse_args()
+
+    server, fake = None, None
+    if args.replay:
+        fixtures = Path(args.replay).resolve()
+        meta = json.loads((fixtures / "_meta.json").read_text(encoding="utf-8")) if (fixtures / "_meta.json").exists() else {}
+        env_extra = {"RAKUTEN_HTTP_MODE": "replay", "RAKUTEN_HTTP_FIXTURES": str(fixtures)}
+        if meta.get("recorded_on"):
+            env_extra["CRAWL_TODAY"] = meta["recorded_on"]
+    else:
+        fake = FakeRakuten(hotels=args.hotels, latency=args.latency, limit_rps=args.limit_rps, error_rate=args.error_rate)
+        server = make_server(fake)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        env_extra = {"RAKUTEN_API_URL": base + "/", "RAKUTEN_MY_HOTEL_NO": str(fake.my_hotel_no), "RAKUTEN_HTTP_MODE": "live"}
+
+    results = []
+    for w in args.workers:
+        print(f"⏱ bench workers={w} ...", file=sys.stderr)
+        res = run_once(w, env_extra, fake)
+        print(f"   → {res['wall_clock_s']}s, {res.get('requests')} req ({res.get('req_per_s')}/s), retries={res.get('retries')}", file=sys.stderr)
+        results.append(res)
+
+    if server:
+        server.shutdown()
+
+    report = {"mode": "replay" if args.replay else "fake-server", "args": vars(args), "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
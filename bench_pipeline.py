@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+bench_pipeline.py
+– クロール後の処理（取り込み・アーカイブ・履歴・キューブ・急騰・再計算）の規模別ベンチマーク
+
+  合成データ : 保持年数（--years）× 市場数（--markets）× adultNum（--adults）ぶんの
+               キャッシュ・履歴（historical_data*.json）・アーカイブ・急騰履歴を一時ディレクトリに生成
+               （取得日ごとに翌日〜270日先の宿泊日をスナップショット。実データと同じ形式）
+  実行       : 規模ごとに別プロセスで、各段階をネットワーク・認証情報なしで直列に実行
+               段階ごとの経過時間と tracemalloc のピークメモリ（MB）を記録（tracemalloc 込みの時間）
+  伸び方     : 規模（履歴の行数）に対する時間・メモリの伸び率（両対数の傾き）を段階ごとに出し、
+               時間の傾きが QUADRATIC_EXPONENT 以上の段階を「二乗的」として警告
+  保存・比較 : 結果を bench_results/pipeline-<日時>.json に保存し、同じディレクトリの前回結果と比べて
+               REGRESSION_RATIO 倍以上遅くなった (規模, 段階) を警告（--compare で比較先を指定）
+
+使い方:
+  python bench_pipeline.py                          … 0.25 / 1 / 2 年 × 1市場 × 1・2名
+  python bench_pipeline.py --years 1 4 --markets 1 3
+  python bench_pipeline.py --years 0.5 1 --compare bench_results/pipeline-20260101-000000.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import datetime as dt
+from pathlib import Path
+from contextlib import contextmanager
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent
+RESULTS_DIR = ROOT / "bench_results"
+BENCH_TODAY = "2026-06-01"     # 合成データの基準日（CRAWL_TODAY）
+HORIZON_DAYS = 270             # 取得日ごとに何日先の宿泊日までスナップショットを持つか（≒9か月）
+QUADRATIC_EXPONENT = 1.5       # 時間の伸び率（両対数の傾き）がこれ以上なら二乗的とみなす
+MIN_FLAG_SECONDS = 0.05        # これより短い段階は伸び率を判定しない（計測誤差）
+REGRESSION_RATIO = 1.5         # 前回結果よりこの倍率以上遅い (規模, 段階) を警告
+EVENT_RATE = 0.05              # イベントのある宿泊日の割合
+
+
+# ------------------------------------------------------------
+# 合成データ
+# ------------------------------------------------------------
+def _synthetic_history(rng, today: dt.date, years: float):
+    """(stay, snap, vacancy, avg_price) の配列。リードタイムが縮むほど在庫↓・単価↑、宿泊日ごとに水準が違う。"""
+    t0 = today - dt.timedelta(days=int(round(years * 365)))
+    n_snaps = (today - t0).days + 1
+    snap = np.repeat(np.arange(n_snaps), HORIZON_DAYS + 1)
+    lead = np.tile(np.arange(HORIZON_DAYS + 1), n_snaps)
+    stay = snap + lead
+    stay_span = n_snaps + HORIZON_DAYS
+    base_vac = rng.integers(150, 450, stay_span)
+    base_price = rng.uniform(8000, 20000, stay_span)
+    vac = np.maximum(0, base_vac[stay] * (0.3 + 0.7 * lead / HORIZON_DAYS) + rng.normal(0, 5, len(stay))).astype(np.int64)
+    price = np.round(base_price[stay] * (1.4 - 0.4 * lead / HORIZON_DAYS) + rng.normal(0, 150, len(stay)))
+    return t0, stay, snap, vac, price
+
+
+def _iso(t0: dt.date, days: np.ndarray) -> list:
+    return [(t0 + dt.timedelta(days=int(d))).isoformat() for d in days]
+
+
+def generate_market(out_dir: Path, adults: list, years: float, seed: int) -> int:
+    """市場1つぶんの JSON 一式を out_dir に書き、履歴の行数（adultNum 合計）を返す"""
+    from vacancy_pipeline.settings import mode_files
+    today = dt.date.fromisoformat(BENCH_TODAY)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    for n in adults:
+        rng = np.random.default_rng(seed * 10 + n)
+        t0, stay, snap, vac, price = _synthetic_history(rng, today, years)
+        stay_iso = _iso(t0, np.arange(stay.max() + 1))
+        hist = {}
+        for s, d, v, p in zip(stay.tolist(), snap.tolist(), vac.tolist(), price.tolist()):
+            hist.setdefault(stay_iso[s], {})[stay_iso[d]] = {"vacancy": v, "avg_price": p}
+        rows += len(stay)
+
+        # キャッシュ：最新スナップショットと1つ前の差分（過去3か月〜9か月先）
+        cache, archive, cutoff = {}, {}, (today - dt.timedelta(days=92)).isoformat()
+        today_iso = today.isoformat()
+        for iso, snaps in hist.items():
+            keys = sorted(snaps)
+            cur, prev = snaps[keys[-1]], snaps[keys[-2]] if len(keys) > 1 else snaps[keys[-1]]
+            if iso < today_iso:
+                archive[iso] = {"vacancy": cur["vacancy"], "avg_price": int(cur["avg_price"])}
+            if iso >= cutoff:
+                my = round(cur["avg_price"] * 1.1, -2)
+                cache[iso] = {
+                    "vacancy": cur["vacancy"], "avg_price": cur["avg_price"],
+                    "last_vacancy": prev["vacancy"], "last_avg_price": prev["avg_price"],
+                    "vacancy_diff": cur["vacancy"] - prev["vacancy"], "avg_price_diff": cur["avg_price"] - prev["avg_price"],
+                    "my_price": my, "my_vs_avg_pct": round((my - cur["avg_price"]) / cur["avg_price"] * 100, 1),
+                    "updated_at": keys[-1],
+                }
+        # 急騰履歴：90日分 × 1日あたり数件（save_demand_spike_history の掃除対象）
+        spikes = {
+            (today - dt.timedelta(days=k)).isoformat(): [
+                {"spike_date": (today + dt.timedelta(days=int(x))).isoformat(), "price_diff": 500.0, "vacancy_diff": -20}
+                for x in rng.integers(-30, HORIZON_DAYS, 8)
+            ]
+            for k in range(90, 0, -1)
+        }
+        files = mode_files(n)
+        for name, data in ((files["history"], hist), (files["cache"], cache), (files["archive"], archive), (files["spikes"], spikes)):
+            (out_dir / name).write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+    rng = np.random.default_rng(seed)
+    t0 = today - dt.timedelta(days=int(round(years * 365)))
+    span = (today - t0).days + HORIZON_DAYS + 1
+    events = {iso: [{"icon": "🔴", "name": f"event-{i % 40}"}] for i, iso in enumerate(_iso(t0, np.nonzero(rng.random(span) < EVENT_RATE)[0]))}
+    (out_dir / "event_data.json").write_text(json.dumps(events, ensure_ascii=False), encoding="utf-8")
+    return rows
+
+
+# ------------------------------------------------------------
+# 比較用：従来の急騰検知（前回値との単純比較。キャッシュ1件ごと）。パイプラインでは使わない
+# ------------------------------------------------------------
+def detect_spikes_legacy(cache_data: dict, today: dt.date, price_up_pct=0.05, vac_down_pct=0.05) -> list:
+    results = []
+    for d in sorted(cache_data):
+        try:
+            if dt.date.fromisoformat(d) < today:
+                continue
+        except ValueError:
+            continue
+
+        rec = cache_data[d]
+        last_price = rec.get("last_avg_price", 0)
+        last_vac   = rec.get("last_vacancy", 0)
+        cur_price  = rec.get("avg_price", 0)
+        cur_vac    = rec.get("vacancy", 0)
+        if not (last_price and last_vac):
+            continue
+
+        price_ratio = (cur_price - last_price) / last_price
+        vac_ratio   = (cur_vac - last_vac) / last_vac
+        if (vac_ratio <= -vac_down_pct) and (price_ratio >= price_up_pct):
+            results.append({
+                "spike_date": d,
+                "price": cur_price,
+                "last_price": last_price,
+                "price_diff": cur_price - last_price,
+                "price_ratio": round(float(price_ratio), 4),
+                "vacancy": cur_vac,
+                "last_vac": last_vac,
+                "vacancy_diff": cur_vac - last_vac,
+                "vacancy_ratio": round(float(vac_ratio), 4),
+            })
+    return results
+
+
+# ------------------------------------------------------------
+# 1規模ぶんの実行（子プロセス側）
+# ------------------------------------------------------------
+@contextmanager
+def _measure(results: dict, name: str):
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] - base
+        r = results.setdefault(name, {"seconds": 0.0, "peak_mb": 0.0, "calls": 0})
+        r["seconds"] = round(r["seconds"] + seconds, 4)
+        r["peak_mb"] = round(max(r["peak_mb"], peak / 1e6), 2)
+        r["calls"] += 1
+
+
+def run_scale(years: float, markets: int, adults: list) -> dict:
+    """作業ディレクトリに合成データを作り、各段階を計測して結果を返す（このプロセスの cwd・環境を変える）"""
+    work = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    try:
+        os.chdir(work)
+        os.environ.update({"CRAWL_TODAY": BENCH_TODAY, "MARKETS_FILE": "markets.json", "PIPELINE_WORKERS": "1"})
+        conf = []
+        rows = 0
+        for i in range(markets):
+            mid = f"bench-{i}"
+            out = "." if i == 0 else f"markets/{mid}"
+            rows += generate_market(work / out, adults, years, seed=i)
+            conf.append({"id": mid, "adults": adults, "my_hotels": ["1001"], "output_dir": out,
+                         "event_file": str(Path(out) / "event_data.json")})
+        Path("markets.json").write_text(json.dumps({"markets": conf}), encoding="utf-8")
+        history_mb = sum(p.stat().st_size for p in work.rglob("historical_data*.json")) / 1e6
+
+        from vacancy_pipeline.markets import load_markets
+        from vacancy_pipeline import stages, recompute
+        today = dt.date.fromisoformat(BENCH_TODAY)
+        targets = [(m, list(m.adults)) for m in load_markets().values()]
+
+        results = {}
+        tracemalloc.start()
+        for m, ns in targets:
+            with _measure(results, "bootstrap"):
+                m.store()
+            for n in ns:
+                files = m.files(n)
+                cache = m.store().load_cache(n)
+                with _measure(results, "archive"):
+                    stages.archive_finalized_past_data(cache, files["archive"], today, n, m)
+                with _measure(results, "history"):
+                    stages.update_history_mode(cache, files["history"], adult_num=n, market=m)
+                with _measure(results, "cube"):
+                    stages.update_booking_cube(adult_num=n, market=m)
+                with _measure(results, "detect_legacy"):
+                    detect_spikes_legacy(cache, today)
+                with _measure(results, "recompute_cache"):
+                    recompute.recompute_cache(cache, m.store().load_history_arrays(n, per_run=True))
+            with _measure(results, "spikes"):
+                spikes = stages.detect_demand_spikes_all(today, market=m)
+            for n in ns:
+                with _measure(results, "spike_history"):
+                    stages.save_demand_spike_history(spikes.get(n, []), m.files(n)["spikes"])
+            with _measure(results, "recompute_spikes"):
+                recompute.recompute_spikes(m, today)
+        tracemalloc.stop()
+        return {"years": years, "markets": markets, "adults": adults, "rows": rows,
+                "history_json_mb": round(history_mb, 1), "stages": results}
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# ------------------------------------------------------------
+# 伸び率・前回比
+# ------------------------------------------------------------
+def growth(scales: list) -> dict:
+    """段階ごとに、行数が最も小さい規模と最も大きい規模の間の伸び率（両対数の傾き）"""
+    ordered = sorted(scales, key=lambda s: s["rows"])
+    small, large = ordered[0], ordered[-1]
+    out = {}
+    if len(ordered) < 2 or large["rows"] <= small["rows"]:
+        return out
+    log_n = math.log(large["rows"] / small["rows"])
+    for name, r in large["stages"].items():
+        s = small["stages"].get(name)
+        if not s:
+            continue
+        t_exp = math.log(max(r["seconds"], 1e-6) / max(s["seconds"], 1e-6)) / log_n
+        m_exp = math.log(max(r["peak_mb"], 0.01) / max(s["peak_mb"], 0.01)) / log_n
+        out[name] = {
+            "time_exponent": round(t_exp, 2),
+            "mem_exponent":  round(m_exp, 2),
+            "quadratic":     r["seconds"] >= MIN_FLAG_SECONDS and t_exp >= QUADRATIC_EXPONENT,
+        }
+    return out
+
+
+def compare(current: list, previous: list) -> list:
+    """同じ (years, markets, adults) の段階ごとの時間比。REGRESSION_RATIO 以上のものを返す"""
+    prev = {(s["years"], s["markets"], tuple(s["adults"])): s for s in previous}
+    slow = []
+    for s in current:
+        p = prev.get((s["years"], s["markets"], tuple(s["adults"])))
+        if not p:
+            continue
+        for name, r in s["stages"].items():
+            before = p["stages"].get(name, {}).get("seconds")
+            if before and r["seconds"] >= MIN_FLAG_SECONDS and r["seconds"] / before >= REGRESSION_RATIO:
+                slow.append({"years": s["years"], "markets": s["markets"], "stage": name,
+                             "seconds": r["seconds"], "previous": before, "ratio": round(r["seconds"] / before, 2)})
+    return slow
+
+
+def _latest_result(exclude: Path = None):
+    files = sorted(p for p in RESULTS_DIR.glob("pipeline-*.json") if p != exclude)
+    return files[-1] if files else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Scaling benchmark for the post-crawl pipeline on synthetic histories")
+    ap.add_argument("--years", type=float, nargs="+", default=[0.25, 1, 2], help="保持年数（複数指定で順に計測）")
+    ap.add_argument("--markets", type=int, nargs="+", default=[1], help="市場数（複数指定で順に計測）")
+    ap.add_argument("--adults", type=int, nargs="+", default=[1, 2])
+    ap.add_argument("--out", help=f"結果の保存先（既定 {RESULTS_DIR.name}/pipeline-<日時>.json）")
+    ap.add_argument("--compare", help="比較する前回結果（既定：保存先ディレクトリの最新）")
+    ap.add_argument("--_scale", nargs=2, help=argparse.SUPPRESS)   # 子プロセス用：years markets
+    args = ap.parse_args()
+
+    if args._scale:
+        print(json.dumps(run_scale(float(args._scale[0]), int(args._scale[1]), args.adults)))
+        return 0
+
+    previous = Path(args.compare) if args.compare else _latest_result()
+    scales = []
+    for markets in args.markets:
+        for years in args.years:
+            print(f"⏱ bench years={years} markets={markets} adults={args.adults} ...", file=sys.stderr)
+            proc = subprocess.run(
+                [sys.executable, str(Path(__file__).resolve()), "--_scale", str(years), str(markets), "--adults", *map(str, args.adults)],
+                cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr[-2000:], file=sys.stderr)
+                return 1
+            res = json.loads(proc.stdout)
+            top = sorted(res["stages"].items(), key=lambda kv: -kv[1]["seconds"])[:3]
+            print(f"   → {res['rows']:,} rows ({res['history_json_mb']} MB JSON): "
+                  + ", ".join(f"{k} {v['seconds']:.2f}s/{v['peak_mb']:.0f}MB" for k, v in top), file=sys.stderr)
+            scales.append(res)
+
+    report = {
+        "generated_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "args": {k: v for k, v in vars(args).items() if not k.startswith("_")},
+        "scales": scales,
+        "growth": {},
+        "regressions": [],
+    }
+    for markets in args.markets:
+        g = growth([s for s in scales if s["markets"] == markets])
+        if g:
+            report["growth"][f"markets={markets}"] = g
+    if len(args.markets) > 1:
+        for years in args.years:
+            g = growth([s for s in scales if s["years"] == years])
+            if g:
+                report["growth"][f"years={years}"] = g
+    for axis, stages in report["growth"].items():
+        for name, g in stages.items():
+            if g["quadratic"]:
+                print(f"⚠️ {name}: time grows ~n^{g['time_exponent']} ({axis})", file=sys.stderr)
+
+    if previous and previous.exists():
+        report["compared_with"] = str(previous)
+        report["regressions"] = compare(scales, json.loads(previous.read_text(encoding="utf-8")).get("scales", []))
+        for r in report["regressions"]:
+            print(f"⚠️ slower than {previous.name}: years={r['years']} markets={r['markets']} {r['stage']} "
+                  f"{r['previous']:.2f}s → {r['seconds']:.2f}s (×{r['ratio']})", file=sys.stderr)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"pipeline-{dt.datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    out.write_text(text, encoding="utf-8")
+    print(f"🧾 {out}", file=sys.stderr)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
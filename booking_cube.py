@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+booking_cube.py
+– 予約ペース（リードタイム別推移）のキューブを作り、型付きの列形式で書き出す
+
+  cube[宿泊日, 到着までの日数] → vacancy / avg_price / 自社価格パーセンタイル
+  ref [参照曲線, 到着までの日数] → vacancy / avg_price
+      参照曲線 = 同曜日（直近 REF_WEEKS 週の過去日）の中央値・同名イベントの過去日の中央値
+                 到着日（リードタイム0）の値は finalized_daily_data*.json の最終値で補う
+
+  書き出し : <name>.<sha256先頭12桁>.bin（リトルエンディアンの生配列を連結）＋ <name>.json（レイアウト）
+             ブラウザは bin を arrayBuffer で読み、レイアウトの offset/dtype/shape で TypedArray を被せるだけ。
+"""
+
+import warnings
+import numpy as np
+
+from history_arrays import HistoryArrays, iso_to_days, days_to_iso
+
+REF_WEEKS = 8   # 同曜日の参照に使う過去週数
+
+# 欠損値（dtype ごと）
+MISSING = {"int16": -1, "int32": -1, "uint8": 255}
+
+
+def _weekday(days: np.ndarray) -> np.ndarray:
+    """1970-01-01（木）からの日数 → 月曜0〜日曜6（datetime.weekday と同じ）"""
+    return (np.asarray(days) + 3) % 7
+
+
+def _dense(arrays: HistoryArrays, stays: np.ndarray, leads: int):
+    """(宿泊日 × リードタイム) の float 行列 2つ（vacancy, price）。無い所は NaN。"""
+    vac = np.full((len(stays), leads), np.nan)
+    price = np.full((len(stays), leads), np.nan)
+    if len(arrays) and len(stays):
+        row = np.searchsorted(stays, arrays.stay)
+        lead = arrays.stay - arrays.snap
+        ok = (row < len(stays)) & (lead >= 0) & (lead < leads)
+        ok[ok] &= stays[row[ok]] == arrays.stay[ok]
+        vac[row[ok], lead[ok]] = arrays.vacancy[ok]
+        price[row[ok], lead[ok]] = arrays.price[ok]
+    return vac, price
+
+
+def _nanmedian_rows(m: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 全て NaN の列
+        return np.nanmedian(m[mask], axis=0) if mask.any() else np.full(m.shape[1], np.nan)
+
+
+def _encode(m: np.ndarray, dtype: str) -> np.ndarray:
+    out = np.where(np.isnan(m), MISSING[dtype], np.round(m))
+    return out.astype(dtype)
+
+
+def build_cube(arrays: HistoryArrays, positions: list, finalized: dict, events: dict,
+               today_day: int, leads: int, stay_from_day: int = None) -> dict:
+    """
+    arrays    : 宿泊日ごとの履歴（過去日も含める。過去日は参照曲線に使う）
+    positions : [(stay_iso, snap_iso, my_price, my_pct), ...]
+    finalized : {stay_iso: {"vacancy", "avg_price"}}（到着日の最終値）
+    events    : event_data.json（{iso: [{"name", ...}, ...]}）
+    stay_from_day : キューブに載せる最初の宿泊日（省略時は today_day）
+    戻り値    : 列名 → NumPy 配列 と、stays / ref_labels
+    """
+    all_stays = np.unique(arrays.stay)
+    stays = all_stays[all_stays >= (today_day if stay_from_day is None else stay_from_day)]
+    vac, price = _dense(arrays, stays, leads)
+
+    pct = np.full((len(stays), leads), np.nan)
+    if positions and len(stays):
+        p_stay, p_snap, _, p_pct = zip(*positions)
+        p_stay, p_snap = iso_to_days(p_stay), iso_to_days(p_snap)
+        p_pct = np.asarray(p_pct, dtype=float)
+        row = np.searchsorted(stays, p_stay)
+        lead = p_stay - p_snap
+        ok = (row < len(stays)) & (lead >= 0) & (lead < leads)
+        ok[ok] &= stays[row[ok]] == p_stay[ok]
+        pct[row[ok], lead[ok]] = p_pct[ok]
+
+    # ---- 参照曲線（過去日） ----
+    fin_iso = [k for k in finalized if k < days_to_iso([today_day])[0]]
+    past = np.union1d(all_stays[all_stays < today_day], iso_to_days(fin_iso) if fin_iso else [])
+    past = past.astype(np.int32)
+    p_vac, p_price = _dense(arrays, past, leads)
+    if fin_iso:
+        f_days = iso_to_days(fin_iso)
+        f_row = np.searchsorted(past, f_days)
+        f_vac = np.array([finalized[k].get("vacancy", np.nan) or np.nan for k in fin_iso], dtype=float)
+        f_price = np.array([finalized[k].get("avg_price", np.nan) or np.nan for k in fin_iso], dtype=float)
+        p_vac[f_row, 0] = np.where(np.isnan(p_vac[f_row, 0]), f_vac, p_vac[f_row, 0])
+        p_price[f_row, 0] = np.where(np.isnan(p_price[f_row, 0]), f_price, p_price[f_row, 0])
+
+    labels, ref_v, ref_p = [], [], []
+    recent = past >= today_day - REF_WEEKS * 7
+    past_wd = _weekday(past)
+    for w in range(7):
+        mask = recent & (past_wd == w)
+        labels.append(f"weekday:{w}")
+        ref_v.append(_nanmedian_rows(p_vac, mask))
+        ref_p.append(_nanmedian_rows(p_price, mask))
+
+    # 同名イベント：未来の宿泊日に付いているイベント名のうち、過去日にも同じ名前があるもの
+    def _names(iso):
+        return [e.get("name") for e in (events.get(iso) or []) if isinstance(e, dict) and e.get("name")]
+
+    past_iso = days_to_iso(past).tolist()
+    past_by_name = {}
+    for i, iso in enumerate(past_iso):
+        for name in _names(iso):
+            past_by_name.setdefault(name, []).append(i)
+
+    ref_event = np.full(len(stays), -1, dtype=np.int16)
+    name_index = {}
+    for s_i, iso in enumerate(days_to_iso(stays).tolist()):
+        for name in _names(iso):
+            if name not in past_by_name:
+                continue
+            if name not in name_index:
+                mask = np.zeros(len(past), bool)
+                mask[past_by_name[name]] = True
+                name_index[name] = len(labels)
+                labels.append(f"event:{name}")
+                ref_v.append(_nanmedian_rows(p_vac, mask))
+                ref_p.append(_nanmedian_rows(p_price, mask))
+            ref_event[s_i] = name_index[name]
+            break
+
+    return {
+        "stays":      days_to_iso(stays).tolist(),
+        "ref_labels": labels,
+        "columns": {
+            "price":         _encode(price, "int32"),
+            "ref_price":     _encode(np.array(ref_p).reshape(len(labels), leads), "int32"),
+            "vacancy":       _encode(vac, "int16"),
+            "ref_vacancy":   _encode(np.array(ref_v).reshape(len(labels), leads), "int16"),
+            "ref_event":     ref_event,
+            "my_pct":        _encode(pct, "uint8"),
+        },
+    }
+
+
+def pack_columns(columns: dict) -> tuple:
+    """
+    列を1つのバイト列に連結（各列の先頭は8バイト境界）。
+    戻り値: (bytes, {列名: {"dtype", "offset", "shape", "missing"}})
+    """
+    buf, layout, offset = bytearray(), {}, 0
+    for name, arr in columns.items():
+        arr = np.ascontiguousarray(arr)
+        raw = arr.astype(arr.dtype.newbyteorder("<"), copy=False).tobytes()
+        layout[name] = {"dtype": arr.dtype.name, "offset": offset, "shape": list(arr.shape),
+                        "missing": MISSING.get(arr.dtype.name)}
+        pad = (-len(raw)) % 8
+        buf += raw + b"\0" * pad
+        offset += len(raw) + pad
+    return bytes(buf), layout
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+competitor_matrix.py
+– ホテル別 × 宿泊日の最安値マトリクス（NumPy）
+
+  市場ページの各ホテル最安値（_extract_hotel_min_price）を捨てずに
+    price[ホテル, 宿泊日]  … 最安値（空室なし・未観測は NaN）
+  として持ち、競合セットの集計（中央値・パーセンタイル・自社順位）をまとめて計算する。
+  行は hotelNo（int64）、列は宿泊日（1970-01-01 からの日数）で昇順。
+"""
+
+import warnings
+import numpy as np
+
+from history_arrays import iso_to_days, days_to_iso
+
+
+class PriceMatrix:
+
+    __slots__ = ("hotels", "stays", "price")
+
+    def __init__(self, hotels, stays, price):
+        self.hotels = np.asarray(hotels, dtype=np.int64)
+        self.stays  = np.asarray(stays, dtype=np.int32)
+        self.price  = np.asarray(price, dtype=np.float64).reshape(len(self.hotels), len(self.stays))
+
+    @property
+    def shape(self):
+        return self.price.shape
+
+    # ---------- 生成 ----------
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.empty((0, 0)))
+
+    @classmethod
+    def from_rows(cls, rows) -> "PriceMatrix":
+        """rows: [(hotel_no, stay_iso, min_price or None), ...]"""
+        rows = list(rows)
+        if not rows:
+            return cls.empty()
+        hotel, stay, price = zip(*rows)
+        hotels, h_idx = np.unique(np.asarray(hotel, dtype=np.int64), return_inverse=True)
+        stays, s_idx = np.unique(iso_to_days(stay), return_inverse=True)
+        m = np.full((len(hotels), len(stays)), np.nan)
+        m[h_idx, s_idx] = np.array([np.nan if p is None else p for p in price], dtype=float)
+        return cls(hotels, stays, m)
+
+    @classmethod
+    def from_snapshot(cls, by_stay: dict) -> "PriceMatrix":
+        """by_stay: {stay_iso: {hotel_no: min_price}}（1回のクロール結果）"""
+        return cls.from_rows(
+            (int(h), stay, p) for stay, hotels in by_stay.items() for h, p in (hotels or {}).items()
+        )
+
+    # ---------- 参照 ----------
+    def stay_labels(self) -> list:
+        return days_to_iso(self.stays).tolist()
+
+    def row(self, hotel_no) -> np.ndarray:
+        """hotel_no の宿泊日ごとの最安値（載っていなければ全て NaN）"""
+        i = np.searchsorted(self.hotels, int(hotel_no))
+        if i < len(self.hotels) and self.hotels[i] == int(hotel_no):
+            return self.price[i]
+        return np.full(len(self.stays), np.nan)
+
+    # ---------- 競合セット集計（宿泊日ごと） ----------
+    def count(self) -> np.ndarray:
+        return np.sum(~np.isnan(self.price), axis=0)
+
+    def percentile(self, q) -> np.ndarray:
+        """q（0〜100、スカラーまたは配列）のパーセンタイル。q が配列なら shape = (len(q), 宿泊日数)。"""
+        if not len(self.hotels):
+            return np.full(np.shape(q) + (len(self.stays),), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # 全て NaN の宿泊日
+            return np.nanpercentile(self.price, q, axis=0)
+
+    def median(self) -> np.ndarray:
+        """外れ値に強い市場価格（各ホテル最安値の中央値）"""
+        return self.percentile(50)
+
+    def rank_of(self, prices) -> np.ndarray:
+        """宿泊日ごとの prices が安い順で何位か（1始まり。価格が無い日は 0）"""
+        prices = np.broadcast_to(np.asarray(prices, dtype=float), self.stays.shape)
+        cheaper = np.sum(self.price < prices[None, :], axis=0)
+        return np.where(np.isnan(prices) | (prices <= 0), 0, cheaper + 1)
+
+    def percentile_of(self, prices) -> np.ndarray:
+        """宿泊日ごとの prices の市場内パーセンタイル（0=最安, 100=最高、同額は半分ずつ数える）"""
+        prices = np.broadcast_to(np.asarray(prices, dtype=float), self.stays.shape)
+        n = self.count()
+        below = np.sum(self.price < prices[None, :], axis=0)
+        equal = np.sum(self.price == prices[None, :], axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct = (below + 0.5 * equal) / n * 100
+        return np.where((n > 0) & (prices > 0), pct, np.nan)
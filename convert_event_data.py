@@ -1,20 +1,200 @@
-import pandas as pd
-import json
+#!/usr/bin/env python
+"""
+convert_event_data.py
+– イベント表（event_data.xlsx ＋ 追加ソース）から event_data.json（{iso: [{"icon", "name"}, ...]}）を作る
+
+  ソース : event_data.xlsx（列 date / icon / name。openpyxl の read_only で1行ずつ読む）
+           events/*.csv（同じ列。icon は省略可）
+           events/*.ics（VEVENT の DTSTART〜DTEND・SUMMARY。終日の複数日イベントは日ごとに展開。
+                         アイコンは X-EVENT-ICON、無ければ DEFAULT_ICON）
+           引数でソースを指定するとそれだけを読む（python convert_event_data.py a.xlsx b.ics）
+  増分   : ソースの内容ハッシュを event_data.sha256 に残し、同じなら何も読まずに終わる
+           （openpyxl の読み込みもしない）。出力も中身が変わった時だけ書き換える（atomic_write）
+  同じ日付のイベントはソースの並び順（xlsx → events/ のファイル名順）・行順のまま。
+"""
+
+import sys
+import csv
+import hashlib
+import datetime as dt
+from pathlib import Path
+
+from atomic_write import write_json, write_bytes
 
 # ファイルパス
-EXCEL_PATH = "event_data.xlsx"
-JSON_PATH = "event_data.json"
+EXCEL_PATH  = "event_data.xlsx"
+EXTRA_DIR   = "events"                 # 追加ソース（*.csv / *.ics）
+JSON_PATH   = "event_data.json"
+HASH_PATH   = "event_data.sha256"      # 最後に変換したソースの内容ハッシュ
+DEFAULT_ICON = "📅"
+FORMAT_VERSION = "1"                   # 変換規則を変えたら上げる（ハッシュが変わり作り直される）
+
+
+def default_sources() -> list:
+    extra = sorted(p for p in Path(EXTRA_DIR).glob("*") if p.suffix.lower() in (".csv", ".ics")) if Path(EXTRA_DIR).is_dir() else []
+    return [p for p in [Path(EXCEL_PATH)] + extra if p.exists()]
+
+
+def sources_digest(paths: list) -> str:
+    h = hashlib.sha256(FORMAT_VERSION.encode())
+    for p in paths:
+        h.update(p.name.encode() + b"\0")
+        h.update(hashlib.sha256(p.read_bytes()).digest())
+    return h.hexdigest()
+
+
+# ---------- 日付 ----------
+def _to_date(value):
+    """セル・CSV の日付（date / datetime / Excel シリアル値 / 'YYYY-MM-DD' / 'YYYY/MM/DD'）→ date（読めなければ None）"""
+    if isinstance(value, dt.datetime):
+        return value.date()
+    if isinstance(value, dt.date):
+        return value
+    if isinstance(value, (int, float)):
+        return dt.date(1899, 12, 30) + dt.timedelta(days=int(value))
+    s = str(value or "").strip().replace("/", "-")
+    try:
+        return dt.datetime.fromisoformat(s[:19]).date() if len(s) > 10 else dt.date.fromisoformat(s)
+    except ValueError:
+        parts = s.split("-")
+        if len(parts) == 3 and all(x.isdigit() for x in parts):
+            return dt.date(int(parts[0]), int(parts[1]), int(parts[2]))
+        return None
+
+
+def _blank(v) -> bool:
+    return v is None or (isinstance(v, str) and not v.strip())
+
+
+def _rows_to_events(rows, header) -> list:
+    """(date, icon, name) の行 → [(date, icon, name)]（date / icon / name のどれかが空の行は捨てる）"""
+    cols = {str(h).strip().lower(): i for i, h in enumerate(header) if h is not None}
+    if "date" not in cols or "name" not in cols:
+        raise ValueError(f"❌ 列 date / name が見つかりません: {list(cols)}")
+    out = []
+    for row in rows:
+        get = lambda k: row[cols[k]] if k in cols and cols[k] < len(row) else None
+        date, icon, name = get("date"), get("icon"), get("name")
+        if "icon" not in cols:
+            icon = DEFAULT_ICON
+        if _blank(date) or _blank(icon) or _blank(name):
+            continue
+        d = _to_date(date)
+        if d is None:
+            print(f"⚠️ skip row (bad date): {date!r} {name!r}", file=sys.stderr)
+            continue
+        out.append((d, str(icon), str(name)))
+    return out
+
+
+# ---------- ソースごとの読み込み ----------
+def read_xlsx(path: Path) -> list:
+    from openpyxl import load_workbook  # 変換が必要な時だけ読み込む
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        return _rows_to_events(rows, header)
+    finally:
+        wb.close()
+
 
-def main():
-    df = pd.read_excel(EXCEL_PATH).dropna(subset=["date", "icon", "name"])
+def read_csv(path: Path) -> list:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = csv.reader(f)
+        header = next(rows, [])
+        return _rows_to_events(rows, header)
+
+
+def _ics_unescape(s: str) -> str:
+    return s.replace("\\n", " ").replace("\\N", " ").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _ics_date(value: str):
+    v = value.strip()
+    try:
+        return dt.date(int(v[0:4]), int(v[4:6]), int(v[6:8]))
+    except (ValueError, IndexError):
+        return None
+
+
+def read_ics(path: Path) -> list:
+    """VEVENT ごとに DTSTART〜DTEND（終日イベントの DTEND は翌日扱いで含まない）の各日を1件ずつ"""
+    lines = []
+    for raw in path.read_text(encoding="utf-8-sig").splitlines():
+        if raw[:1] in (" ", "\t") and lines:
+            lines[-1] += raw[1:]   # 折り返し行
+        else:
+            lines.append(raw)
+
+    out, ev = [], None
+    for line in lines:
+        if line == "BEGIN:VEVENT":
+            ev = {}
+            continue
+        if line == "END:VEVENT" and ev is not None:
+            start, name = ev.get("DTSTART"), ev.get("SUMMARY")
+            if start and name:
+                end = ev.get("DTEND")
+                all_day = "VALUE=DATE" in ev.get("DTSTART;", "")
+                last = (end - dt.timedelta(days=1)) if (end and all_day) else (end or start)
+                d = start
+                while d <= max(last, start):
+                    out.append((d, ev.get("X-EVENT-ICON") or DEFAULT_ICON, name))
+                    d += dt.timedelta(days=1)
+            ev = None
+            continue
+        if ev is None or ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        name, _, params = key.partition(";")
+        name = name.upper()
+        if name in ("DTSTART", "DTEND"):
+            ev[name] = _ics_date(value)
+            ev[name + ";"] = params.upper()
+        elif name == "SUMMARY":
+            ev[name] = _ics_unescape(value).strip()
+        elif name == "X-EVENT-ICON":
+            ev[name] = value.strip()
+    return out
+
+
+READERS = {".xlsx": read_xlsx, ".csv": read_csv, ".ics": read_ics}
+
+
+def build_event_data(paths: list) -> dict:
     data = {}
-    for _, row in df.iterrows():
-        date = pd.to_datetime(row["date"]).date().isoformat()
-        icon = str(row["icon"])
-        name = str(row["name"])
-        data.setdefault(date, []).append({"icon": icon, "name": name})
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    for p in paths:
+        reader = READERS.get(p.suffix.lower())
+        if reader is None:
+            print(f"⚠️ unsupported event source: {p}", file=sys.stderr)
+            continue
+        rows = reader(p)
+        for d, icon, name in rows:
+            data.setdefault(d.isoformat(), []).append({"icon": icon, "name": name})
+        print(f"📥 {p}: {len(rows)} events", file=sys.stderr)
+    return data
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    paths = [Path(a) for a in argv] if argv else default_sources()
+    if not paths:
+        print(f"⚠️ no event sources ({EXCEL_PATH} / {EXTRA_DIR}/*.csv|*.ics)", file=sys.stderr)
+        return 0
+
+    digest = sources_digest(paths)
+    hash_file = Path(HASH_PATH)
+    if Path(JSON_PATH).exists() and hash_file.exists() and hash_file.read_text().strip() == digest:
+        print(f"⏩ event sources unchanged ({digest[:12]}): {JSON_PATH} kept", file=sys.stderr)
+        return 0
+
+    data = build_event_data(paths)
+    changed = write_json(JSON_PATH, data, compact=False)
+    write_bytes(HASH_PATH, (digest + "\n").encode())
+    print(f"✅ {JSON_PATH}: {len(data)} dates ({'updated' if changed else 'unchanged'})", file=sys.stderr)
+    return 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
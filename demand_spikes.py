@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+demand_spikes.py
+– 履歴スナップショット全体を使った需要急騰検知（バッチ・ベクトル化）
+
+  対象 : 今日以降の全宿泊日 × adultNum（1名/2名）
+  指標 : 1/3/7日ウィンドウの
+           ・在庫ピックアップ率  (過去在庫 - 現在在庫) / 過去在庫   … 客室↓ で正
+           ・価格変化率          (現在価格 - 過去価格) / 過去価格   … 単価↑ で正
+  基準 : (adultNum, リードタイム帯, イベント有無) ごとの平均・標準偏差で z スコア化
+         （イベント日は件数が足りる時だけイベント日同士で比較、足りなければ通常日の基準）
+  判定 : どれかのウィンドウで「客室↓ かつ 単価↑」で、2つの z の平均が SPIKE_Z 以上
+         → スコア順に並べたレコードを返す（従来の demand_spike_history.json の項目も含む）
+  再計算 : detect_spikes_runs で複数の基準日を (基準日, adultNum, 宿泊日) の1つの行列にして一度に判定
+"""
+
+import numpy as np
+
+from history_arrays import days_to_iso
+
+WINDOWS       = (1, 3, 7)
+LEAD_BUCKETS  = (7, 14, 30, 60, 120)   # リードタイム帯の境界（日）
+SPIKE_Z       = 2.0                     # 判定に使う z スコア平均の下限
+MIN_RATIO     = 0.02                    # 変化率の下限（ばらつきが極端に小さい帯での誤検知よけ）
+MIN_GROUP     = 8                       # イベント日専用の基準を使うのに必要な件数
+MIN_STD       = 0.01
+
+
+def _ffill_matrix(stay_idx, col_idx, values, shape) -> np.ndarray:
+    """(宿泊日 × 取得日) の行列にして、欠けた取得日は直前の値で埋める"""
+    m = np.full(shape, np.nan)
+    m[stay_idx, col_idx] = values
+    have = ~np.isnan(m)
+    pos = np.where(have, np.arange(shape[1]), 0)
+    np.maximum.accumulate(pos, axis=1, out=pos)
+    filled = m[np.arange(shape[0])[:, None], pos]
+    filled[~np.maximum.accumulate(have, axis=1)] = np.nan
+    return filled
+
+
+def _group_z(x: np.ndarray, groups: np.ndarray, n_groups: int, baseline: np.ndarray):
+    """groups ごとの平均・標準偏差（baseline=True の行だけで計算）で z スコア化。件数も返す。"""
+    ok = baseline & np.isfinite(x)
+    cnt = np.bincount(groups[ok], minlength=n_groups).astype(float)
+    s1  = np.bincount(groups[ok], weights=x[ok], minlength=n_groups)
+    s2  = np.bincount(groups[ok], weights=x[ok] ** 2, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s1 / cnt
+        std  = np.sqrt(np.maximum(s2 / cnt - mean ** 2, 0.0))
+    std = np.maximum(np.nan_to_num(std), MIN_STD)
+    return (x - mean[groups]) / std[groups], cnt
+
+
+def detect_spikes_batch(histories: dict, today_day: int, event_days=()) -> dict:
+    """
+    histories : {adult_num: HistoryArrays}
+    today_day : 基準日（1970-01-01 からの日数）
+    event_days: イベントのある宿泊日（日数）の集合
+    戻り値    : {adult_num: [レコード, ...]}（スコア降順）
+    """
+    return detect_spikes_runs(histories, [today_day], event_days)[int(today_day)]
+
+
+def detect_spikes_runs(histories: dict, run_days, event_days=()) -> dict:
+    """
+    detect_spikes_batch を複数の基準日について1回で（再計算用）。
+    各基準日では、その日以降の宿泊日と、その日までの span 日ぶんのスナップショットだけを見る。
+    run_days  : 基準日（日数）の列
+    event_days: イベントのある宿泊日（日数）の集合（最も古い基準日以降のぶんがあればよい）
+    戻り値    : {基準日: {adult_num: [レコード, ...]}}（スコア降順）
+    """
+    span = max(WINDOWS)
+    runs = np.unique(np.asarray(run_days, dtype=np.int64))
+    adults = sorted(histories)
+    n_a = len(adults)
+    out = {r: {n: [] for n in adults} for r in runs.tolist()}
+    if not len(runs) or not adults:
+        return out
+
+    # スナップショットを、窓（基準日 - span 〜 基準日）に入る基準日ぶんだけ複製する（列 = span - ずれ）
+    parts = []
+    for a_i, n in enumerate(adults):
+        h = histories[n]
+        snap = h.snap.astype(np.int64)
+        for off in range(span + 1):
+            k = np.searchsorted(runs, snap + off)
+            sel = (k < len(runs)) & (runs[np.minimum(k, len(runs) - 1)] == snap + off) & (h.stay >= snap + off)
+            parts.append((k[sel] * n_a + a_i, h.stay[sel], np.full(int(sel.sum()), span - off), h.vacancy[sel], h.price[sel]))
+
+    # 基準日・adultNum をまたいで1つの行列にまとめる（行 = (基準日, adultNum, 宿泊日)）
+    ra    = np.concatenate([p[0] for p in parts])
+    stay  = np.concatenate([p[1] for p in parts])
+    col   = np.concatenate([p[2] for p in parts])
+    vac   = np.concatenate([p[3] for p in parts]).astype(float)
+    price = np.concatenate([p[4] for p in parts])
+    if not len(stay):
+        return out
+
+    row_key = ra * 1_000_000 + stay
+    rows, row_idx = np.unique(row_key, return_inverse=True)
+    row_ra    = rows // 1_000_000
+    row_run   = row_ra // n_a
+    row_adult = row_ra % n_a
+    row_stay  = (rows % 1_000_000).astype(np.int32)
+    shape = (len(rows), span + 1)
+    V = _ffill_matrix(row_idx, col, vac, shape)
+    P = _ffill_matrix(row_idx, col, price, shape)
+    P[P <= 0] = np.nan
+
+    cur_v, cur_p = V[:, -1], P[:, -1]
+    lead   = row_stay - runs[row_run]
+    bucket = np.digitize(lead, LEAD_BUCKETS)
+    event  = np.isin(row_stay, np.fromiter(event_days, dtype=np.int64)) if event_days else np.zeros(len(rows), bool)
+    n_b    = len(LEAD_BUCKETS) + 1
+    n_groups = len(runs) * n_a * n_b * 2
+    groups_evt = (row_ra * n_b + bucket) * 2 + event          # 基準日ごと。イベント日はイベント日同士
+    groups_std = (row_ra * n_b + bucket) * 2                  # 通常日の基準
+
+    pick, chg, z_v, z_p, score = {}, {}, {}, {}, {}
+    for w in WINDOWS:
+        base_v, base_p = V[:, -1 - w], P[:, -1 - w]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pick[w] = np.where(base_v > 0, (base_v - cur_v) / base_v, np.nan)
+            chg[w]  = (cur_p - base_p) / base_p
+        zv_std, _   = _group_z(pick[w], groups_std, n_groups, ~event)
+        zp_std, _   = _group_z(chg[w], groups_std, n_groups, ~event)
+        zv_evt, cnt = _group_z(pick[w], groups_evt, n_groups, event)
+        zp_evt, _   = _group_z(chg[w], groups_evt, n_groups, event)
+        use_evt = event & (cnt[groups_evt] >= MIN_GROUP)
+        z_v[w] = np.where(use_evt, zv_evt, zv_std)
+        z_p[w] = np.where(use_evt, zp_evt, zp_std)
+        ok = (pick[w] >= MIN_RATIO) & (chg[w] >= MIN_RATIO) & (z_v[w] > 0) & (z_p[w] > 0)
+        score[w] = np.where(ok, (z_v[w] + z_p[w]) / 2, -np.inf)
+
+    S = np.stack([score[w] for w in WINDOWS], axis=1)
+    best = np.argmax(S, axis=1)
+    best_score = S[np.arange(len(rows)), best]
+    hit = np.nonzero(best_score >= SPIKE_Z)[0]
+    hit = hit[np.argsort(-best_score[hit], kind="stable")]
+
+    stay_iso = days_to_iso(row_stay[hit]).tolist()
+    for i, iso in zip(hit.tolist(), stay_iso):
+        w = WINDOWS[best[i]]
+        n = adults[row_adult[i]]
+        r = int(runs[row_run[i]])
+        last_p, last_v = float(P[i, -1 - w]), float(V[i, -1 - w])
+        out[r][n].append({
+            # 従来項目（ダッシュボードのバナーが参照）
+            "spike_date":    iso,
+            "price":         float(cur_p[i]),
+            "last_price":    last_p,
+            "price_diff":    float(cur_p[i] - last_p),
+            "price_ratio":   round(float(chg[w][i]), 4),
+            "vacancy":       int(cur_v[i]),
+            "last_vac":      int(last_v),
+            "vacancy_diff":  int(cur_v[i] - last_v),
+            "vacancy_ratio": round(float(-pick[w][i]), 4),
+            # 追加項目
+            "adult_num":     n,
+            "window_days":   w,
+            "lead_days":     int(lead[i]),
+            "event":         bool(event[i]),
+            "score":         round(float(best_score[i]), 2),
+            "z_vacancy":     round(float(z_v[w][i]), 2),
+            "z_price":       round(float(z_p[w][i]), 2),
+            "pickup":        {f"{k}d": (None if np.isnan(pick[k][i]) else round(float(pick[k][i]), 4)) for k in WINDOWS},
+        })
+    for by_adult in out.values():
+        for items in by_adult.values():
+            for rank, rec in enumerate(items, 1):
+                rec["rank"] = rank
+    return out
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+event_index.py
+– event_data.json（{iso: [{"icon", "name"}, ...]}）を宿泊日で引く索引
+
+  ・読み込みは1回。ファイルの mtime・サイズが変わった時だけ読み直す（同じ実行の中で何度呼んでもよい）
+  ・日付でないキーや壊れた行は読み飛ばす
+  ・急騰検知・キューブ・リフレッシュ計画は days / day_set() を、キャッシュの書き出しは events() を使う
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from history_arrays import iso_to_days, to_day, is_date_string
+
+_lock  = threading.Lock()
+_cache = {}   # path → ((mtime_ns, size), EventIndex)
+
+
+class EventIndex:
+    """宿泊日（iso）→ イベント一覧。days は日付（1970-01-01 からの日数）の昇順配列。"""
+
+    __slots__ = ("by_date", "days")
+
+    def __init__(self, by_date: dict):
+        self.by_date = by_date
+        self.days = np.sort(iso_to_days(list(by_date))).astype(np.int32) if by_date else np.array([], dtype=np.int32)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "EventIndex":
+        by_date = {}
+        for iso, items in (data or {}).items():
+            if not is_date_string(iso):
+                continue
+            evs = [
+                {"icon": str(e.get("icon", "")), "name": str(e["name"])}
+                for e in (items or []) if isinstance(e, dict) and e.get("name")
+            ]
+            if evs:
+                by_date[iso] = evs
+        return cls(by_date)
+
+    def __contains__(self, iso) -> bool:
+        return iso in self.by_date
+
+    def __len__(self):
+        return len(self.by_date)
+
+    def events(self, iso: str) -> list:
+        return self.by_date.get(iso, [])
+
+    def day_set(self, since=None) -> set:
+        """イベントのある日（日数）の集合。since（date / iso / 日数）以降だけに絞れる。"""
+        days = self.days
+        if since is not None:
+            days = days[days >= (since if isinstance(since, (int, np.integer)) else to_day(since))]
+        return set(days.tolist())
+
+    def flags(self, stay_days) -> np.ndarray:
+        """宿泊日（日数の配列）ごとのイベント有無"""
+        return np.isin(np.asarray(stay_days), self.days)
+
+
+def load_event_index(path) -> EventIndex:
+    """path の索引（前回読んだ時からファイルが変わっていなければ読み直さない）"""
+    p = Path(path)
+    try:
+        st = p.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = None
+    key = str(p)
+    with _lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == stamp:
+            return hit[1]
+    try:
+        data = json.loads(p.read_text(encoding="utf-8")) if stamp else {}
+    except Exception:
+        data = {}
+    index = EventIndex.from_json(data)
+    with _lock:
+        _cache[key] = (stamp, index)
+    return index
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+fake_rakuten_server.py
+– 楽天 VacantHotelSearch のローカル代用サーバ（オフライン計測・並列化の検証用）
+
+  - 宿泊日 × adultNum ごとに決定的な（毎回同じ）ホテル一覧を生成
+  - 30件/ページの pagingInfo、存在しないページは 404 not_found
+  - hotelNo 指定時はそのホテルだけを返す（自社価格の個別取得）
+  - 応答遅延（--latency）と、上限レート超過時の 429 + Retry-After（--limit-rps）を再現
+  - GET /__stats でリクエスト数・ステータス別件数・リトライ数（同一クエリの再送）を返す
+  - formatVersion=2（hotels の各要素を配列のまま）・elements（指定した項目だけ残す）・
+    Accept-Encoding: gzip に対応（応答サイズの比較用）
+
+使い方:
+  python fake_rakuten_server.py --port 8765 --latency 0.15 --limit-rps 3
+  RAKUTEN_API_URL=http://127.0.0.1:8765/ RAKUTEN_MY_HOTEL_NO=1001 python update_cache.py
+"""
+
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+import datetime as dt
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PER_PAGE = 30
+
+
+class FakeRakuten:
+    """応答生成とレート制限・統計（サーバ本体から独立させて単体でも使えるように）"""
+
+    def __init__(self, hotels: int = 250, my_hotel_no: int = 1001, latency: float = 0.0,
+                 limit_rps: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.hotels      = hotels
+        self.my_hotel_no = my_hotel_no
+        self.latency     = latency
+        self.limit_rps   = limit_rps
+        self.error_rate  = error_rate
+        self.seed        = seed
+
+        self._lock   = threading.Lock()
+        self._tokens = limit_rps
+        self._last   = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        """統計と再送判定をクリア（ベンチで1回ごとに区切る）"""
+        self.stats = {"requests": 0, "by_status": {}, "unique": 0, "retries": 0}
+        self._seen = set()
+
+    # ---------- データ生成 ----------
+    def _hotels_for(self, checkin: str, adult_num: int) -> list:
+        rnd  = random.Random(f"{self.seed}:{checkin}:{adult_num}")
+        day  = dt.date.fromisoformat(checkin)
+        peak = 1.6 if day.weekday() == 5 else (1.2 if day.weekday() == 4 else 1.0)
+        # 空室のあるホテル数は日付ごとにばらつかせる（週末は少なめ）
+        n = max(1, int(self.hotels * rnd.uniform(0.45, 1.0) / peak))
+        ids = rnd.sample(range(2000, 2000 + self.hotels * 4), n - 1) + [self.my_hotel_no]
+        rnd.shuffle(ids)
+        out = []
+        for no in ids:
+            h = random.Random(f"{self.seed}:{no}")
+            base = h.uniform(5000, 18000) * peak * (1.25 if adult_num >= 2 else 1.0)
+            rooms = []
+            for k in range(h.randint(1, 4)):
+                total = int(round(base * rnd.uniform(0.9, 1.6), -2))
+                rooms.append({"roomBasicInfo": {"roomClass": f"r{k}", "roomName": f"Room {k}", "planName": "素泊まり"}})
+                rooms.append({"dailyCharge": {"stayDate": checkin, "rakutenCharge": total, "total": total, "chargeFlag": 0}})
+            out.append({"hotel": [
+                {"hotelBasicInfo": {"hotelNo": no, "hotelName": f"Hotel {no}", "hotelInformationUrl": "",
+                                    "hotelMinCharge": min(r["dailyCharge"]["total"] for r in rooms if "dailyCharge" in r),
+                                    "address1": "大阪府", "address2": "大阪市", "hotelSpecial": "x" * 200}},
+                {"roomInfo": rooms},
+            ]})
+        return out
+
+    # ---------- レート制限（トークンバケット） ----------
+    def _allow(self) -> bool:
+        if self.limit_rps <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.limit_rps, self._tokens + (now - self._last) * self.limit_rps)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def handle(self, query: dict) -> tuple:
+        """(status, headers, body dict) を返す"""
+        key = json.dumps(sorted(query.items()))
+        with self._lock:
+            self.stats["requests"] += 1
+            if key in self._seen:
+                self.stats["retries"] += 1
+            else:
+                self._seen.add(key)
+                self.stats["unique"] += 1
+
+        status, headers, body = self._respond(query)
+        with self._lock:
+            by = self.stats["by_status"]
+            by[str(status)] = by.get(str(status), 0) + 1
+        return status, headers, body
+
+    def _respond(self, query: dict) -> tuple:
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.7, 1.3))
+
+        if not self._allow():
+            return 429, {"Retry-After": "1"}, {"error": "too_many_requests", "error_description": "rate limit"}
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {}, {"error": "service_unavailable"}
+
+        checkin   = query.get("checkinDate", "")
+        adult_num = int(query.get("adultNum", 1) or 1)
+        page      = int(query.get("page", 1) or 1)
+        try:
+            hotels = self._hotels_for(checkin, adult_num)
+        except ValueError:
+            return 400, {}, {"error": "wrong_parameter", "error_description": "checkinDate"}
+
+        if query.get("hotelNo"):
+            hotels = [h for h in hotels if str(h["hotel"][0]["hotelBasicInfo"]["hotelNo"]) == str(query["hotelNo"])]
+        if not hotels:
+            return 404, {}, {"error": "not_found", "error_description": "データが見つかりませんでした"}
+
+        page_count = -(-len(hotels) // PER_PAGE)
+        if page > page_count:
+            return 404, {}, {"error": "not_found", "error_description": "データが見つかりませんでした"}
+        first = (page - 1) * PER_PAGE
+        chunk = hotels[first:first + PER_PAGE]
+        if str(query.get("formatVersion", "1")) == "2":
+            chunk = [h["hotel"] for h in chunk]
+        body = {
+            "pagingInfo": {"recordCount": len(hotels), "pageCount": page_count, "page": page,
+                           "first": first + 1, "last": first + len(chunk)},
+            "hotels": chunk,
+        }
+        if query.get("elements"):
+            body = _select_elements(body, set(query["elements"].split(","))) or {}
+        return 200, {}, body
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+
+def _select_elements(obj, keep: set):
+    """elements 指定：keep に含まれる項目（と、それを含む入れ物）だけを残す"""
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if k in keep and not isinstance(v, (dict, list)):
+                out[k] = v
+            elif isinstance(v, (dict, list)):
+                sub = _select_elements(v, keep)
+                if sub:
+                    out[k] = sub
+        return out
+    if isinstance(obj, list):
+        return [x for x in (_select_elements(v, keep) for v in obj) if x]
+    return obj
+
+
+def make_server(fake: FakeRakuten, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats":
+                status, headers, body = 200, {}, fake.snapshot()
+            else:
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, headers, body = fake.handle(query)
+
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            gzipped = "gzip" in (self.headers.get("Accept-Encoding") or "")
+            if gzipped:
+                payload = gzip.compress(payload, compresslevel=6)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            if gzipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(payload)))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for Rakuten VacantHotelSearch")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--hotels", type=int, default=250, help="1日あたりの最大ホテル数")
+    ap.add_argument("--my-hotel-no", type=int, default=1001)
+    ap.add_argument("--latency", type=float, default=0.15, help="平均応答遅延（秒）")
+    ap.add_argument("--limit-rps", type=float, default=0.0, help="これを超えると 429（0で無制限）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="503 を返す確率")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    fake = FakeRakuten(args.hotels, args.my_hotel_no, args.latency, args.limit_rps, args.error_rate, args.seed)
+    server = make_server(fake, args.host, args.port)
+    print(f"🧪 fake Rakuten API on http://{args.host}:{server.server_address[1]}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
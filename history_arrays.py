@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+history_arrays.py
+– 履歴スナップショットの配列表現（NumPy）
+
+  1行 = (宿泊日, 取得日, vacancy, avg_price)。日付は 1970-01-01 からの日数（int32）で持つ。
+  取得時刻（at）は 1970-01-01 00:00 からの分数（int64。日付だけの旧データは 00:00）。
+  「宿泊日の Nか月前以降だけ残す」窓かけ・同日スナップショットの追記・ネスト dict への変換を
+  行ごとの Python ループなしで処理する（保持期間を延ばしても後処理時間が増えにくい）。
+
+  ストアは値が変わった時だけ1行持つ（変化点）。from_changes が実行時刻ごとの値に展開し、
+  daily() が1日1スナップショット（その日の最後の実行）の形に戻す。
+"""
+
+import re
+import functools
+import datetime as dt
+import numpy as np
+
+_EPOCH = dt.date(1970, 1, 1)
+_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:T(\d{2}):(\d{2})(?::(\d{2}))?)?\Z")
+MINUTES_PER_DAY = 1440
+_KEY = 1 << 32   # (宿泊日, 時刻) を1つの int64 キーにする時の桁（分数は 2^32 未満）
+
+
+@functools.lru_cache(maxsize=None)
+def is_date_string(s, with_time: bool = False) -> bool:
+    """
+    'YYYY-MM-DD' か（with_time=True なら実行時刻のスナップショットキー 'YYYY-MM-DDTHH:MM[:SS]' も可）。
+    date.fromisoformat は Python のバージョンで受け付ける形が違う（3.9 は時刻付き不可、3.11 は '20260101' も可）ので使わない。
+    同じキーを何度も判定するのでメモ化。
+    """
+    m = _DATE_RE.match(s) if isinstance(s, str) else None
+    if m is None or (m[4] and not with_time):
+        return False
+    try:
+        dt.date(int(m[1]), int(m[2]), int(m[3]))
+    except ValueError:
+        return False
+    return not m[4] or (int(m[4]) < 24 and int(m[5]) < 60 and int(m[6] or 0) < 60)
+
+
+def to_day(d) -> int:
+    """date / ISO文字列 → 1970-01-01 からの日数"""
+    if isinstance(d, str):
+        d = dt.date.fromisoformat(d)
+    return (d - _EPOCH).days
+
+
+def iso_to_days(values) -> np.ndarray:
+    return np.asarray(values, dtype="datetime64[D]").astype(np.int32)
+
+
+def iso_to_minutes(values) -> np.ndarray:
+    """ISO 日付 / 日時（日付だけなら 00:00。秒は切り捨て）→ 1970-01-01 00:00 からの分数"""
+    return np.asarray(values, dtype="datetime64[m]").astype(np.int64)
+
+
+def days_to_iso(days: np.ndarray) -> np.ndarray:
+    return np.datetime_as_string(np.asarray(days, dtype=np.int64).astype("datetime64[D]"), unit="D")
+
+
+def months_before(days: np.ndarray, months: int) -> np.ndarray:
+    """
+    各日付の months か月前（dateutil.relativedelta と同じく、月末を超える日は月末に丸める）。
+    例: 2025-05-31 の3か月前 → 2025-02-28
+    """
+    d = np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+    m = d.astype("datetime64[M]")
+    day_index = (d - m.astype("datetime64[D]")).astype(np.int64)          # 0始まりの日
+    target = m - months
+    month_len = ((target + 1).astype("datetime64[D]") - target.astype("datetime64[D]")).astype(np.int64)
+    return (target.astype("datetime64[D]") + np.minimum(day_index, month_len - 1)).astype(np.int32)
+
+
+class HistoryArrays:
+    """(stay, snap) で昇順に並んだ列指向の履歴"""
+
+    __slots__ = ("stay", "snap", "vacancy", "price", "at")
+
+    def __init__(self, stay, snap, vacancy, price, at=None):
+        self.stay    = np.asarray(stay, dtype=np.int32)
+        self.snap    = np.asarray(snap, dtype=np.int32)
+        self.vacancy = np.asarray(vacancy, dtype=np.int64)
+        self.price   = np.asarray(price, dtype=np.float64)
+        self.at      = self.snap.astype(np.int64) * MINUTES_PER_DAY if at is None else np.asarray(at, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.stay)
+
+    # ---------- 生成 ----------
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [])
+
+    @classmethod
+    def from_rows(cls, rows) -> "HistoryArrays":
+        """rows: [(stay_iso, snap_iso, vacancy, avg_price), ...]（snap_iso は日付でも日時でもよい）"""
+        rows = list(rows)
+        if not rows:
+            return cls.empty()
+        stay, snap, vac, price = zip(*rows)
+        at = iso_to_minutes(snap)
+        out = cls(iso_to_days(stay), at // MINUTES_PER_DAY,
+                  [v or 0 for v in vac], [p or 0 for p in price], at=at)
+        return out.sorted()
+
+    @classmethod
+    def from_changes(cls, changes: "HistoryArrays", runs) -> "HistoryArrays":
+        """
+        変化点だけの履歴（各行の値は次の行の時刻まで続く）を、実行時刻 runs（分）ごとの値に展開する。
+        宿泊日ごとに、最初の変化点以降・宿泊日当日までの各実行へ直前の変化点の値を入れる。
+        changes は (stay, at) 昇順（from_rows の戻り値のまま）。
+        """
+        runs = np.unique(np.asarray(runs, dtype=np.int64))
+        if not len(changes) or not len(runs):
+            return cls.empty()
+        stay_u, first = np.unique(changes.stay, return_index=True)
+        lo = np.searchsorted(runs, changes.at[first], side="left")
+        hi = np.searchsorted(runs // MINUTES_PER_DAY, stay_u, side="right")
+        count = np.maximum(hi - lo, 0)
+
+        # 宿泊日 i の実行 lo[i]..hi[i]-1 を1本の配列に並べる
+        stay = np.repeat(stay_u, count)
+        at = runs[np.repeat(lo - (np.cumsum(count) - count), count) + np.arange(count.sum())]
+
+        # 各 (宿泊日, 実行時刻) 以前で最後の変化点
+        keys = changes.stay.astype(np.int64) * _KEY + changes.at
+        row = np.searchsorted(keys, stay.astype(np.int64) * _KEY + at, side="right") - 1
+        return cls(stay, at // MINUTES_PER_DAY, changes.vacancy[row], changes.price[row], at=at)
+
+    @classmethod
+    def from_nested(cls, hist: dict) -> "HistoryArrays":
+        """{stay: {snap: {"vacancy", "avg_price"}}}（snap は日付か実行時刻。どちらでもないキーは読み飛ばす）"""
+        rows = []
+        for stay, snaps in hist.items():
+            for snap, v in (snaps or {}).items():
+                rows.append((stay, snap, v.get("vacancy", 0), v.get("avg_price", 0)))
+        rows = [r for r in rows if is_date_string(r[0]) and is_date_string(r[1], with_time=True)]
+        return cls.from_rows(rows)
+
+    # ---------- 変換 ----------
+    def sorted(self) -> "HistoryArrays":
+        order = np.lexsort((self.at, self.stay))
+        return self._take(order)
+
+    def _take(self, idx) -> "HistoryArrays":
+        return HistoryArrays(self.stay[idx], self.snap[idx], self.vacancy[idx], self.price[idx], self.at[idx])
+
+    def daily(self) -> "HistoryArrays":
+        """同じ (宿泊日, 取得日) の行はその日の最後の実行だけ残す（1日1スナップショットの形）"""
+        if not len(self):
+            return self
+        last = np.r_[(self.stay[1:] != self.stay[:-1]) | (self.snap[1:] != self.snap[:-1]), True]
+        return self._take(last)
+
+    def window(self, months: int) -> "HistoryArrays":
+        """各宿泊日の months か月前より古いスナップショットを除いたもの（months<=0 ならそのまま）"""
+        if months <= 0 or not len(self):
+            return self
+        uniq, inv = np.unique(self.stay, return_inverse=True)
+        limit = months_before(uniq, months)[inv]
+        return self._take(self.snap >= limit)
+
+    def append(self, snap_day: int, stay_days, vacancy, price) -> "HistoryArrays":
+        """snap_day 時点のスナップショットを追加（同じ (宿泊日, 取得日) は新しい値で置き換え）"""
+        stay_days = np.asarray(stay_days, dtype=np.int32)
+        keep = ~((self.snap == snap_day) & np.isin(self.stay, stay_days))
+        base = self._take(keep)
+        new = HistoryArrays(stay_days, np.full(len(stay_days), snap_day, dtype=np.int32), vacancy, price)
+        return HistoryArrays(
+            np.concatenate([base.stay, new.stay]), np.concatenate([base.snap, new.snap]),
+            np.concatenate([base.vacancy, new.vacancy]), np.concatenate([base.price, new.price]),
+            np.concatenate([base.at, new.at]),
+        ).sorted()
+
+    def to_nested(self) -> dict:
+        out = {}
+        if not len(self):
+            return out
+        stay_u, stay_inv = np.unique(self.stay, return_inverse=True)
+        snap_u, snap_inv = np.unique(self.snap, return_inverse=True)
+        stay_s = days_to_iso(stay_u).tolist()
+        snap_s = days_to_iso(snap_u).tolist()
+        for si, ni, v, p in zip(stay_inv.tolist(), snap_inv.tolist(), self.vacancy.tolist(), self.price.tolist()):
+            d = out.get(stay_s[si])
+            if d is None:
+                d = out[stay_s[si]] = {}
+            d[snap_s[ni]] = {"vacancy": v, "avg_price": p}
+        return out
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+run_metrics.py
+– 1回の実行の計測値を集めて、機械可読の実行レポート（run_report.json）にまとめる
+
+  request(endpoint, status, seconds, nbytes, ...)    : HTTP 1試行ぶん（レイテンシ・ステータス・受信バイト・リトライ）
+  pages(market_id, adult_num, fetched, total)        : 市場ページを何枚取ったか（宿泊日ごと）
+  observe(name, seconds)                             : 任意のレイテンシ（例: 1宿泊日ぶんの取得）
+  timer(group, name)                                 : with / デコレータで区間時間を合算（group = "stage" / "io" など）
+  section(name, data)                                : そのほかの集計（例: クロールのタスク数・レート制御）をそのまま載せる
+
+  レイテンシは固定バケットのヒストグラム＋p50/p90/p99。スレッドセーフ（並列クロール・並列ステージから呼ばれる）。
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+# ヒストグラムのバケット上限（ミリ秒）。最後は上限なし
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+_samples  = {}   # name → [秒, ...]
+_requests = {}   # endpoint → {"attempts", "retries", "bytes", "wire_bytes", "status": {status: 件数}}
+_pages    = {}   # (market_id, adult_num) → {"dates", "fetched", "total", "by_count": {枚数: 日数}}
+_timers   = {}   # group → {name: {"seconds", "calls"}}
+_sections = {}   # name → dict
+
+
+def reset():
+    global _t0
+    with _lock:
+        _t0 = time.perf_counter()
+        for d in (_samples, _requests, _pages, _timers, _sections):
+            d.clear()
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        _samples.setdefault(name, []).append(seconds)
+
+
+def request(endpoint: str, status, seconds: float, nbytes: int = 0, wire_bytes: int = None, attempt: int = 0):
+    """status は HTTP ステータス（int）か "exception" """
+    with _lock:
+        r = _requests.setdefault(endpoint, {"attempts": 0, "retries": 0, "bytes": 0, "wire_bytes": 0, "status": {}})
+        r["attempts"]   += 1
+        r["retries"]    += 1 if attempt else 0
+        r["bytes"]      += nbytes
+        r["wire_bytes"] += nbytes if wire_bytes is None else wire_bytes
+        r["status"][str(status)] = r["status"].get(str(status), 0) + 1
+        _samples.setdefault(f"request:{endpoint}", []).append(seconds)
+
+
+def pages(market_id: str, adult_num: int, fetched: int, total: int):
+    with _lock:
+        p = _pages.setdefault((market_id, adult_num), {"dates": 0, "fetched": 0, "total": 0, "by_count": {}})
+        p["dates"]   += 1
+        p["fetched"] += fetched
+        p["total"]   += total or 0
+        p["by_count"][str(fetched)] = p["by_count"].get(str(fetched), 0) + 1
+
+
+def section(name: str, data: dict):
+    with _lock:
+        _sections[name] = data
+
+
+@contextmanager
+def timer(group: str, name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t
+        with _lock:
+            s = _timers.setdefault(group, {}).setdefault(name, {"seconds": 0.0, "calls": 0})
+            s["seconds"] += elapsed
+            s["calls"]   += 1
+
+
+def _quantile(sorted_vals: list, q: float) -> float:
+    if not sorted_vals:
+        return None
+    i = min(len(sorted_vals) - 1, max(0, round(q * (len(sorted_vals) - 1))))
+    return sorted_vals[i]
+
+
+def histogram(values: list) -> dict:
+    """秒のリスト → 件数・合計・p50/p90/p99/max（ミリ秒）とバケット別件数"""
+    vals = sorted(values)
+    buckets = {f"le_{b}ms": 0 for b in LATENCY_BUCKETS_MS}
+    buckets["inf"] = 0
+    for v in vals:
+        ms = v * 1000
+        for b in LATENCY_BUCKETS_MS:
+            if ms <= b:
+                buckets[f"le_{b}ms"] += 1
+                break
+        else:
+            buckets["inf"] += 1
+    ms = lambda v: None if v is None else round(v * 1000, 1)
+    return {
+        "count":   len(vals),
+        "total_s": round(sum(vals), 3),
+        "p50_ms":  ms(_quantile(vals, 0.50)),
+        "p90_ms":  ms(_quantile(vals, 0.90)),
+        "p99_ms":  ms(_quantile(vals, 0.99)),
+        "max_ms":  ms(vals[-1] if vals else None),
+        "buckets": buckets,
+    }
+
+
+def report() -> dict:
+    with _lock:
+        samples = {k: list(v) for k, v in _samples.items()}
+        reqs    = {k: {**v, "status": dict(v["status"])} for k, v in _requests.items()}
+        pgs     = {f"{mid}:{n}p": {**v, "by_count": dict(sorted(v["by_count"].items(), key=lambda kv: int(kv[0])))}
+                   for (mid, n), v in _pages.items()}
+        timers  = {g: {n: {"seconds": round(s["seconds"], 3), "calls": s["calls"]} for n, s in d.items()}
+                   for g, d in _timers.items()}
+        sections = dict(_sections)
+        elapsed = time.perf_counter() - _t0
+    totals = {"attempts": 0, "retries": 0, "bytes": 0, "wire_bytes": 0, "status": {}}
+    for r in reqs.values():
+        for k in ("attempts", "retries", "bytes", "wire_bytes"):
+            totals[k] += r[k]
+        for s, c in r["status"].items():
+            totals["status"][s] = totals["status"].get(s, 0) + c
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests":  {"total": totals, "by_endpoint": reqs},
+        "latency":   {k: histogram(v) for k, v in sorted(samples.items())},
+        "pages":     pgs,
+        **timers,
+        **sections,
+    }
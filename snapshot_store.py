@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+"""
+snapshot_store.py
+– 在庫・平均価格データの保存先（SQLite）
+
+  snapshots : (adult_num, stay_date, snapshot_date) → vacancy / avg_price   … 履歴（値が変わった時だけ1行。次の行までその値）
+  runs      : (adult_num, run_at)                                          … 履歴を記録した実行の時刻（スナップショットキー）
+  cache     : (adult_num, stay_date) → キャッシュ1件分（JSON）              … vacancy_price_cache*.json の元
+  finalized : (adult_num, stay_date) → vacancy / avg_price                  … finalized_daily_data*.json の元
+  positions : (adult_num, stay_date, snapshot_date) → my_price / my_pct     … 自社価格と市場内パーセンタイル
+  hotel_prices : (adult_num, stay_date, hotel_no, snapshot_date) → min_price … ホテル別最安値（変化した時だけ1行、NULL = 空室なし）
+
+  JSON ファイル群はここからの書き出し（ビュー）。毎回の更新は
+  「今回の実行で値が変わった宿泊日だけ INSERT」「宿泊日ごとの範囲 DELETE」だけで済み、
+  履歴全体を読み込んで書き戻す必要がない。
+  スナップショットのキーは実行時刻（YYYY-MM-DDTHH:MM。旧データは日付だけ）なので、1日に何回クロールしても
+  上書きされず、値が変わらなければ行も増えない。読み出しは runs の各実行へ変化点の値を前方補完して展開する
+  （HistoryArrays.from_changes）。旧形式（1日1行の全件コピー）の DB は最初に開いた時に変化点だけに詰める。
+  DB が無い初回だけ、既存の JSON から取り込む（bootstrap_from_json）。
+  読み込み・書き込み・削除の所要時間は run_metrics の io（load / db_write / prune）に計上する。
+"""
+
+import json
+import sqlite3
+import datetime as dt
+from pathlib import Path
+
+from history_arrays import HistoryArrays, is_date_string, iso_to_days, iso_to_minutes, days_to_iso, months_before
+from competitor_matrix import PriceMatrix
+from run_metrics import timer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+-- vacancy / avg_price は型指定なし（int / float を JSON と同じ形のまま保持する）
+CREATE TABLE IF NOT EXISTS snapshots (
+    adult_num     INTEGER NOT NULL,
+    stay_date     TEXT    NOT NULL,
+    snapshot_date TEXT    NOT NULL,
+    vacancy,
+    avg_price,
+    PRIMARY KEY (adult_num, stay_date, snapshot_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_snapshots_snapshot ON snapshots (adult_num, snapshot_date);
+CREATE TABLE IF NOT EXISTS runs (
+    adult_num INTEGER NOT NULL,
+    run_at    TEXT    NOT NULL,
+    PRIMARY KEY (adult_num, run_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cache (
+    adult_num INTEGER NOT NULL,
+    stay_date TEXT    NOT NULL,
+    data      TEXT    NOT NULL,
+    PRIMARY KEY (adult_num, stay_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (
+    adult_num     INTEGER NOT NULL,
+    stay_date     TEXT    NOT NULL,
+    snapshot_date TEXT    NOT NULL,
+    my_price,
+    my_pct,
+    PRIMARY KEY (adult_num, stay_date, snapshot_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hotel_prices (
+    adult_num     INTEGER NOT NULL,
+    stay_date     TEXT    NOT NULL,
+    hotel_no      INTEGER NOT NULL,
+    snapshot_date TEXT    NOT NULL,
+    min_price,
+    PRIMARY KEY (adult_num, stay_date, hotel_no, snapshot_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS finalized (
+    adult_num INTEGER NOT NULL,
+    stay_date TEXT    NOT NULL,
+    vacancy,
+    avg_price,
+    PRIMARY KEY (adult_num, stay_date)
+) WITHOUT ROWID;
+"""
+
+
+class SnapshotStore:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)  # adultNum ごとの後処理を並列に走らせた時の書き込み待ち
+        self.conn.execute("PRAGMA journal_mode=DELETE")  # Actions のキャッシュで持ち越すので WAL の付随ファイルを残さない
+        self.conn.executescript(SCHEMA)
+        self._migrate_snapshots()
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- meta ----------
+    def get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _migrate_snapshots(self):
+        """旧形式（1日1行の全件コピー）の snapshots を変化点だけに詰め、取得日を runs に写す（1回だけ）"""
+        if self.get_meta("snapshot_encoding") == "changes":
+            return
+        adults = [r[0] for r in self.conn.execute("SELECT DISTINCT adult_num FROM snapshots")]
+        for n in adults:
+            self.compact_snapshots(n)
+        self.set_meta("snapshot_encoding", "changes")
+
+    # ---------- 初回取り込み ----------
+    def bootstrap_from_json(self, adult_num: int, cache_file: str, history_file: str, archive_file: str) -> bool:
+        """DB にまだ無い adult_num のデータを既存 JSON から取り込む（1回だけ）。"""
+        key = f"bootstrapped_{adult_num}"
+        if self.get_meta(key):
+            return False
+
+        def _load(path):
+            p = Path(path)
+            try:
+                return json.loads(p.read_text(encoding="utf-8")) if p.exists() else {}
+            except Exception:
+                return {}
+
+        hist = _load(history_file)
+        rows = [
+            (adult_num, stay, snap, v.get("vacancy", 0), v.get("avg_price", 0))
+            for stay, snaps in hist.items() if is_date_string(stay)
+            for snap, v in snaps.items() if is_date_string(snap, with_time=True)
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", rows)
+        self.compact_snapshots(adult_num)
+        self.save_cache(adult_num, _load(cache_file))
+        self.upsert_finalized(adult_num, _load(archive_file))
+        self.set_meta(key, dt.datetime.now().isoformat(timespec="seconds"))
+        return True
+
+    # ---------- cache ----------
+    @timer("io", "load")
+    def load_cache(self, adult_num: int) -> dict:
+        cur = self.conn.execute("SELECT stay_date, data FROM cache WHERE adult_num = ? ORDER BY stay_date", (adult_num,))
+        return {stay: json.loads(data) for stay, data in cur}
+
+    @timer("io", "db_write")
+    def save_cache(self, adult_num: int, cache: dict):
+        rows = [(adult_num, k, json.dumps(v, ensure_ascii=False)) for k, v in cache.items() if is_date_string(k)]
+        with self.conn:
+            self.conn.execute("DELETE FROM cache WHERE adult_num = ?", (adult_num,))
+            self.conn.executemany("INSERT INTO cache VALUES (?, ?, ?)", rows)
+
+    # ---------- finalized ----------
+    @timer("io", "db_write")
+    def upsert_finalized(self, adult_num: int, rows: dict) -> int:
+        """追加・値が変わった行だけ書き、その件数を返す（同じ値の行は触らない）"""
+        data = [(adult_num, k, v.get("vacancy", 0), v.get("avg_price", 0)) for k, v in rows.items() if is_date_string(k)]
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO finalized VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (adult_num, stay_date) DO UPDATE SET vacancy = excluded.vacancy, avg_price = excluded.avg_price "
+                "WHERE vacancy IS NOT excluded.vacancy OR avg_price IS NOT excluded.avg_price", data)
+        return self.conn.total_changes - before
+
+    @timer("io", "load")
+    def load_finalized(self, adult_num: int) -> dict:
+        cur = self.conn.execute(
+            "SELECT stay_date, vacancy, avg_price FROM finalized WHERE adult_num = ? ORDER BY stay_date", (adult_num,))
+        return {stay: {"vacancy": vac, "avg_price": price} for stay, vac, price in cur}
+
+    # ---------- snapshots ----------
+    _LATEST_SNAPSHOTS = """
+        SELECT stay_date, vacancy, avg_price FROM snapshots s
+        WHERE adult_num = ? AND stay_date BETWEEN ? AND ?
+          AND snapshot_date = (
+              SELECT MAX(snapshot_date) FROM snapshots
+              WHERE adult_num = s.adult_num AND stay_date = s.stay_date AND snapshot_date < ?)
+    """
+
+    @timer("io", "db_write")
+    def append_snapshots(self, adult_num: int, snapshot_at: str, rows: dict) -> int:
+        """
+        rows: {stay_date: {"vacancy", "avg_price"}} を snapshot_at（実行時刻）時点として記録。
+        直前の値から変わった宿泊日だけ1行書き（同じ時刻の行は置き換え）、実行時刻は runs に残す。書いた行数を返す。
+        """
+        stays = sorted(rows)
+        latest = {}
+        if stays:
+            for stay, vac, price in self.conn.execute(
+                    self._LATEST_SNAPSHOTS, (adult_num, stays[0], stays[-1], snapshot_at)):
+                latest[stay] = (vac, price)
+
+        changed, same = [], []
+        for stay in stays:
+            value = (rows[stay].get("vacancy", 0), rows[stay].get("avg_price", 0))
+            if latest.get(stay) == value:
+                same.append((adult_num, stay, snapshot_at))
+            else:
+                changed.append((adult_num, stay, snapshot_at) + value)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?)", (adult_num, snapshot_at))
+            self.conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", changed)
+            # 同じ時刻で書き直して前の値に戻った宿泊日は、その時刻の行を消す（変化点でなくなる）
+            self.conn.executemany(
+                "DELETE FROM snapshots WHERE adult_num = ? AND stay_date = ? AND snapshot_date = ?", same)
+        return len(changed)
+
+    @timer("io", "prune")
+    def compact_snapshots(self, adult_num: int) -> int:
+        """
+        直前の行と同じ値の行を削除して変化点だけにする（旧形式・JSON から取り込んだ全件コピー用）。
+        消す前に、各行の取得日時を runs に写す（展開時に「その実行でも同じ値だった」と分かるように）。
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO runs SELECT DISTINCT adult_num, snapshot_date FROM snapshots WHERE adult_num = ?",
+                (adult_num,))
+            cur = self.conn.execute("""
+                DELETE FROM snapshots WHERE adult_num = ?1 AND (stay_date, snapshot_date) IN (
+                    SELECT stay_date, snapshot_date FROM (
+                        SELECT stay_date, snapshot_date, vacancy, avg_price,
+                               LAG(snapshot_date) OVER w AS prev_snap,
+                               LAG(vacancy)       OVER w AS prev_vac,
+                               LAG(avg_price)     OVER w AS prev_price
+                        FROM snapshots WHERE adult_num = ?1
+                        WINDOW w AS (PARTITION BY stay_date ORDER BY snapshot_date))
+                    WHERE prev_snap IS NOT NULL AND vacancy IS prev_vac AND avg_price IS prev_price)
+            """, (adult_num,))
+        return cur.rowcount
+
+    @timer("io", "db_write")
+    def append_positions(self, adult_num: int, snapshot_date: str, rows: dict) -> int:
+        """rows: {stay_date: {"my_price", "my_pct"}}（my_pct が無い日は入れない）"""
+        data = [(adult_num, stay, snapshot_date, v.get("my_price") or 0, v["my_pct"])
+                for stay, v in rows.items() if v.get("my_pct") is not None]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?)", data)
+        return len(data)
+
+    @timer("io", "load")
+    def load_positions(self, adult_num: int, stay_from: str = None, stay_to: str = None) -> list:
+        """[(stay_date, snapshot_date, my_price, my_pct), ...]"""
+        sql = "SELECT stay_date, snapshot_date, my_price, my_pct FROM positions WHERE adult_num = ?"
+        args = [adult_num]
+        if stay_from:
+            sql += " AND stay_date >= ?"
+            args.append(stay_from)
+        if stay_to:
+            sql += " AND stay_date <= ?"
+            args.append(stay_to)
+        # 同じ日の複数回の実行は後の行が勝つように時刻順
+        return self.conn.execute(sql + " ORDER BY stay_date, snapshot_date", args).fetchall()
+
+    # ---------- hotel_prices ----------
+    _LATEST_HOTEL_PRICES = """
+        SELECT hotel_no, stay_date, min_price FROM hotel_prices h
+        WHERE adult_num = ? AND stay_date BETWEEN ? AND ?
+          AND snapshot_date = (
+              SELECT MAX(snapshot_date) FROM hotel_prices
+              WHERE adult_num = h.adult_num AND stay_date = h.stay_date AND hotel_no = h.hotel_no
+                AND snapshot_date <= ?)
+    """
+
+    @timer("io", "db_write")
+    def append_hotel_prices(self, adult_num: int, snapshot_date: str, by_stay: dict, complete=()) -> int:
+        """
+        by_stay : {stay_date: {hotel_no: min_price}}（今回のクロールで見えたホテル）
+        complete: 全ページを取得できた宿泊日。ここに載っていない既知ホテルは「空室なし」（NULL）として記録。
+        直前の値から変わった (ホテル, 宿泊日) だけを書く（毎日の全件コピーはしない）。
+        """
+        stays = sorted(set(by_stay) | set(complete))
+        if not stays:
+            return 0
+        latest = {}
+        for hotel_no, stay, price in self.conn.execute(
+                self._LATEST_HOTEL_PRICES, (adult_num, stays[0], stays[-1], snapshot_date)):
+            latest.setdefault(stay, {})[hotel_no] = price
+
+        data = []
+        for stay in stays:
+            seen = {int(h): p for h, p in (by_stay.get(stay) or {}).items()}
+            known = latest.get(stay, {})
+            data += [(adult_num, stay, h, snapshot_date, p) for h, p in seen.items() if known.get(h, -1) != p]
+            if stay in complete:
+                data += [(adult_num, stay, h, snapshot_date, None)
+                         for h, p in known.items() if p is not None and h not in seen]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO hotel_prices VALUES (?, ?, ?, ?, ?)", data)
+        return len(data)
+
+    @timer("io", "load")
+    def load_hotel_matrix(self, adult_num: int, as_of: str = "9999-12-31",
+                          stay_from: str = "0000-01-01", stay_to: str = "9999-12-31") -> PriceMatrix:
+        """as_of 時点で最新の ホテル × 宿泊日 最安値マトリクス（空室なしは NaN）"""
+        return PriceMatrix.from_rows(self.conn.execute(
+            self._LATEST_HOTEL_PRICES, (adult_num, stay_from, stay_to, as_of)))
+
+    @timer("io", "prune")
+    def prune_hotel_prices(self, adult_num: int, stay_before: str) -> int:
+        """stay_before より前の宿泊日のホテル別最安値を削除"""
+        with self.conn:
+            cur = self.conn.execute(
+                "DELETE FROM hotel_prices WHERE adult_num = ? AND stay_date < ?", (adult_num, stay_before))
+        return cur.rowcount
+
+    @timer("io", "prune")
+    def prune_snapshots(self, adult_num: int, months: int) -> int:
+        """
+        各宿泊日について「宿泊日の months か月前」より古いスナップショットを削除（months<=0 なら無期限保持）。
+        境目をまたいで続いている値は、境目より前の最後の変化点を境目の日付に付け替えて残す。
+        """
+        if months <= 0:
+            return 0
+        stays = [r[0] for r in self.conn.execute(
+            "SELECT DISTINCT stay_date FROM snapshots WHERE adult_num = ?", (adult_num,))]
+        if not stays:
+            return 0
+        limits = days_to_iso(months_before(iso_to_days(stays), months)).tolist()
+        args = [(adult_num, stay, limit) for stay, limit in zip(stays, limits)]
+        with self.conn:
+            self.conn.executemany("""
+                UPDATE OR IGNORE snapshots SET snapshot_date = ?3
+                WHERE adult_num = ?1 AND stay_date = ?2 AND snapshot_date = (
+                    SELECT MAX(snapshot_date) FROM snapshots
+                    WHERE adult_num = ?1 AND stay_date = ?2 AND snapshot_date < ?3)
+            """, args)
+            cur = self.conn.executemany(
+                "DELETE FROM snapshots WHERE adult_num = ? AND stay_date = ? AND snapshot_date < ?", args)
+            removed = cur.rowcount
+            self.conn.executemany(
+                "DELETE FROM positions WHERE adult_num = ? AND stay_date = ? AND snapshot_date < ?", args)
+            self.conn.execute(
+                "DELETE FROM runs WHERE adult_num = ?1 AND run_at < "
+                "(SELECT MIN(snapshot_date) FROM snapshots WHERE adult_num = ?1)", (adult_num,))
+        return removed
+
+    @timer("io", "load")
+    def load_history_arrays(self, adult_num: int, stay_from: str = None, stay_to: str = None,
+                            per_run: bool = False) -> HistoryArrays:
+        """
+        変化点を各実行の値に展開した履歴。既定は1日1スナップショット（その日の最後の実行）、
+        per_run=True なら同じ日の複数回の実行もそのまま（at で区別）。
+        """
+        sql = "SELECT stay_date, snapshot_date, vacancy, avg_price FROM snapshots WHERE adult_num = ?"
+        args = [adult_num]
+        if stay_from:
+            sql += " AND stay_date >= ?"
+            args.append(stay_from)
+        if stay_to:
+            sql += " AND stay_date <= ?"
+            args.append(stay_to)
+        changes = HistoryArrays.from_rows(self.conn.execute(sql, args))
+        runs = [r[0] for r in self.conn.execute("SELECT run_at FROM runs WHERE adult_num = ?", (adult_num,))]
+        history = HistoryArrays.from_changes(changes, iso_to_minutes(runs))
+        return history if per_run else history.daily()
+
+    def load_history(self, adult_num: int, window_months: int = 0, stay_from: str = None, stay_to: str = None) -> dict:
+        """
+        {stay_date: {snapshot_date: {"vacancy", "avg_price"}}}（日付昇順）。
+        window_months > 0 なら各宿泊日の months か月前以降のスナップショットだけを返す。
+        """
+        return self.load_history_arrays(adult_num, stay_from, stay_to).window(window_months).to_nested()
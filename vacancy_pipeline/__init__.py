@@ -0,0 +1,16 @@
+"""
+vacancy_pipeline
+– 空室・価格ダッシュボードのデータ更新パイプライン（旧 update_cache.py を段階ごとに分割したもの）
+
+  settings : 環境変数・出力ファイル名（認証情報は api_config() / my_hotel_no() で使う時に検証）
+  files    : JSON の読み書き・事前圧縮・履歴シャード
+  markets  : 対象市場と市場ごとの SQLite ストア
+  api      : 楽天APIの取得層（レート制御・リトライ・記録／再生）
+  crawl    : リフレッシュ計画・チェックポイント・並列クロール
+  stages   : アーカイブ・キャッシュ・競合・履歴・キューブ・急騰・更新メタ
+  recompute: スナップショットから差分・アーカイブ・急騰履歴を作り直す（オフライン）
+  report   : 実行レポート
+  cli      : サブコマンド（python -m vacancy_pipeline --help）
+
+  import してもログ出力・認証情報の検証・通信は起きない。
+"""
@@ -0,0 +1,558 @@
+"""
+vacancy_pipeline.api
+– 楽天トラベル空室検索API の取得層（レート制御・リトライ・記録／再生・価格抽出・1日分の取得）
+
+  requests は最初の通信時に読み込む（オフラインの段階だけを動かす時は import しない）。
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+import datetime as dt
+from pathlib import Path
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import run_metrics
+
+from .settings import (
+    HTTP_MODE, HTTP_FIXTURES_DIR, THROTTLE_SEC, MAX_RETRIES, MIN_RPS, MAX_RPS, AIMD_STEP, AIMD_BACKOFF,
+    AIMD_COOLDOWN, CRAWL_WORKERS, FULL_PAGES_DAYS, MAX_PAGES_NEAR, MAX_PAGES, LEAN_PAYLOAD, RESPONSE_ELEMENTS,
+    api_config, base_date,
+)
+from .markets import Market, default_market
+
+
+class RateLimiter:
+    """
+    プロセス全体で共有する適応型レートリミッタ（AIMD・スレッドセーフ）。
+    何本並列で投げても、リクエスト開始間隔が 1/rate 秒未満にならないよう
+    各スレッドに“発射枠”を順番に割り当てる。
+      - on_success : 加算的に rate を上げる（MAX_RPS まで）
+      - on_throttle: 乗算的に rate を下げ、Retry-After があれば全体をその間停止
+    rate の推移は history（直近500件）に残し、stats() でログ用に取り出せる。
+    """
+
+    def __init__(self, min_interval: float, min_rps: float = MIN_RPS, max_rps: float = MAX_RPS,
+                 step: float = AIMD_STEP, backoff: float = AIMD_BACKOFF):
+        self.enabled = min_interval > 0
+        self.rate    = min(max_rps, 1.0 / min_interval) if self.enabled else 0.0
+        self.min_rps = min_rps
+        self.max_rps = max_rps
+        self.step    = step
+        self.backoff = backoff
+
+        self._lock          = threading.Lock()
+        self._next_slot     = 0.0
+        self._paused_until  = 0.0
+        self._last_decrease = float("-inf")
+        self._t0            = time.monotonic()
+
+        self.counts  = {"success": 0, "throttled": 0, "server_error": 0, "http_error": 0, "exception": 0, "decrease": 0}
+        self.history = deque(maxlen=500)
+        self._record("start")
+
+    def _record(self, event: str):
+        self.history.append((round(time.monotonic() - self._t0, 2), round(self.rate, 3), event))
+
+    def acquire(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.counts["success"] += 1
+            if not self.enabled:
+                return
+            self.rate = min(self.max_rps, self.rate + self.step / self.rate)
+            if self.counts["success"] % 50 == 0:
+                self._record("increase")
+
+    def on_throttle(self, kind: str = "throttled", retry_after: float = None):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if not self.enabled:
+                return
+            now = time.monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease >= AIMD_COOLDOWN:
+                self._last_decrease = now
+                self.rate = max(self.min_rps, self.rate * self.backoff)
+                self.counts["decrease"] += 1
+                self._record(kind)
+
+    def on_error(self, kind: str):
+        """レートを変えない失敗（http_error / exception）の件数だけ数える"""
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "rate": round(self.rate, 3),
+                "counts": dict(self.counts),
+                "history": list(self.history),
+            }
+
+
+_rate_limiter = RateLimiter(0 if HTTP_MODE == "replay" else THROTTLE_SEC)  # replay は待たない
+
+# 市場ごとのリクエスト数（リトライ込みの試行回数）：{市場ID: 回数}
+_request_costs = {}
+_request_costs_lock = threading.Lock()
+
+
+def _count_request(cost_key: str):
+    if cost_key is None:
+        return
+    with _request_costs_lock:
+        _request_costs[cost_key] = _request_costs.get(cost_key, 0) + 1
+
+
+def request_costs() -> dict:
+    """{市場ID: これまでのリクエスト数}"""
+    with _request_costs_lock:
+        return dict(_request_costs)
+
+
+def rate_stats() -> dict:
+    return _rate_limiter.stats()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """共有の requests.Session（requests は実際に通信する時に初めて読み込む）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            _session = requests.Session()
+            # 圧縮して送ってもらう（展開は requests 側）
+            _session.headers["Accept-Encoding"] = "gzip, deflate"
+            # 並列数ぶんのコネクションを使い回せるようにプールを広げる
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(10, CRAWL_WORKERS))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+# ------------------------------------------------------------
+# 記録／再生（record / replay）
+#  - キーは認証情報を除いたクエリの SHA1。1応答1ファイル（JSON）
+#  - _meta.json に記録日を残す（replay 時は CRAWL_TODAY にこれを使うと日付が揃う）
+# ------------------------------------------------------------
+_SECRET_PARAMS = ("applicationId", "accessKey")
+
+
+class _FixtureResponse:
+    """保存済み応答を requests.Response 風に見せる最小限のラッパ"""
+
+    def __init__(self, status_code: int, text: str, headers: dict = None):
+        self.status_code = status_code
+        self.text        = text
+        self.content     = text.encode("utf-8")
+        self.headers     = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def fixture_key(params: dict) -> str:
+    cleaned = {k: str(v) for k, v in params.items() if k not in _SECRET_PARAMS}
+    return hashlib.sha1(json.dumps(cleaned, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _fixture_path(params: dict) -> Path:
+    return Path(HTTP_FIXTURES_DIR) / f"{fixture_key(params)}.json"
+
+
+def _record_fixture(params: dict, r):
+    p = _fixture_path(params)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    meta = p.parent / "_meta.json"
+    if not meta.exists():
+        meta.write_text(json.dumps({"recorded_on": base_date().isoformat()}), encoding="utf-8")
+    p.write_text(json.dumps({
+        "params":  {k: v for k, v in params.items() if k not in _SECRET_PARAMS},
+        "status":  r.status_code,
+        "headers": {k: v for k, v in r.headers.items() if k.lower() == "retry-after"},
+        "body":    r.text,
+    }, ensure_ascii=False), encoding="utf-8")
+
+
+def _http_get(url: str, params: dict, headers: dict = None, timeout: int = 10):
+    if HTTP_MODE == "replay":
+        p = _fixture_path(params)
+        if not p.exists():
+            return _FixtureResponse(404, json.dumps({"error": "not_found", "error_description": "no fixture"}))
+        rec = json.loads(p.read_text(encoding="utf-8"))
+        return _FixtureResponse(rec["status"], rec["body"], rec.get("headers"))
+
+    r = _get_session().get(url, params=params, headers=headers, timeout=timeout)
+    if HTTP_MODE == "record":
+        _record_fixture(params, r)
+    return r
+
+
+def _parse_retry_after(value) -> float:
+    """Retry-After（秒数 or HTTP-date）を秒に。解釈できなければ None。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - dt.datetime.now(dt.timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def _retry_wait(attempt: int, base: float = 2.0) -> float:
+    """指数バックオフ＋ジッター（半分は固定・半分はランダム）で、並列リトライが同時に再突入しないようにする。"""
+    cap = min(base * (2 ** attempt), 20)
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def _observe_response(endpoint: str, r, seconds: float, attempt: int):
+    """1試行ぶんを run_metrics へ（受信バイトは展開後、wire は Content-Length があればその値）"""
+    nbytes = len(r.content or b"")
+    wire = r.headers.get("Content-Length")
+    run_metrics.request(endpoint, r.status_code, seconds, nbytes,
+                        int(wire) if wire and wire.isdigit() else None, attempt)
+
+
+def rakuten_get_json(url: str, params: dict, headers: dict = None, timeout: int = 10, cost_key: str = None,
+                     parse=None) -> dict:
+    """parse を渡すと 200 の応答本文（bytes）をそれで解析する（既定は r.json()）。解析時間は parse:<endpoint> に計上。"""
+    endpoint = "hotel" if "hotelNo" in params else "market"
+    last_err = None
+    for attempt in range(MAX_RETRIES):
+        _rate_limiter.acquire()
+        _count_request(cost_key)
+        t0, r = time.perf_counter(), None
+        try:
+            r = _http_get(url, params=params, headers=headers, timeout=timeout)
+            _observe_response(endpoint, r, time.perf_counter() - t0, attempt)
+
+            if r.status_code == 200:
+                t1 = time.perf_counter()
+                data = parse(r.content) if parse else r.json()   # 解析に失敗したら下の except で1回の失敗として扱う
+                run_metrics.observe(f"parse:{endpoint}", time.perf_counter() - t1)
+                _rate_limiter.on_success()
+                return data
+
+            if r.status_code == 429:
+                retry_after = _parse_retry_after(r.headers.get("Retry-After"))
+                _rate_limiter.on_throttle("throttled", retry_after)
+                wait = max(retry_after or 0.0, _retry_wait(attempt))
+                print(f"  ⚠️ 429 Too Many Requests: retry in {wait:.1f}s (attempt {attempt+1}/{MAX_RETRIES}, rate={_rate_limiter.rate:.2f}/s)", file=sys.stderr)
+                time.sleep(wait)
+                continue
+
+            if r.status_code in (500, 502, 503, 504):
+                _rate_limiter.on_throttle("server_error")
+                wait = _retry_wait(attempt)
+                print(f"  ⚠️ {r.status_code} server error: retry in {wait:.1f}s (attempt {attempt+1}/{MAX_RETRIES})", file=sys.stderr)
+                time.sleep(wait)
+                continue
+
+            last_err = f"HTTP {r.status_code}: {r.text[:200]}"
+            _rate_limiter.on_error("http_error")
+            break
+
+        except Exception as e:
+            last_err = f"exception: {e}"
+            _rate_limiter.on_error("exception")
+            if r is None:  # 応答を受け取れなかった（受け取った後の JSON 解析失敗はステータス側で計上済み）
+                run_metrics.request(endpoint, "exception", time.perf_counter() - t0, attempt=attempt)
+            wait = _retry_wait(attempt)
+            print(f"  ⚠️ request exception: retry in {wait:.1f}s (attempt {attempt+1}/{MAX_RETRIES})", file=sys.stderr)
+            time.sleep(wait)
+
+    raise RuntimeError(f"rakuten_get_json failed: {last_err or 'unknown error'}")
+
+
+# ------------------------------------------------------------
+# 価格抽出ヘルパー：1ホテル塊の“当日最安値(最低価格)”を返す
+#  （formatVersion=1 は {"hotel": [基本情報, 部屋]}、2 は [基本情報, 部屋] のまま）
+# ------------------------------------------------------------
+def _hotel_blocks(hotel_obj) -> list:
+    return hotel_obj.get("hotel", []) if isinstance(hotel_obj, dict) else (hotel_obj or [])
+
+
+def _extract_hotel_min_price(hotel_obj):
+    try:
+        blocks = _hotel_blocks(hotel_obj)
+        if len(blocks) < 2:
+            return None
+        room_block = blocks[1]  # roomInfo 配列が入っている側
+        min_price = None
+        for ri in room_block.get("roomInfo", []):
+            dc = ri.get("dailyCharge") or {}
+            total = dc.get("total")
+            if isinstance(total, (int, float)) and total > 0:
+                if (min_price is None) or (total < min_price):
+                    min_price = total
+        return min_price
+    except Exception:
+        return None
+
+
+def _extract_hotel_no(hotel_obj) -> str:
+    """1ホテル塊の施設番号（hotelBasicInfo.hotelNo）を文字列で返す。取れなければ空文字。"""
+    try:
+        info = _hotel_blocks(hotel_obj)[0].get("hotelBasicInfo") or {}
+        no = info.get("hotelNo")
+        return str(no) if no is not None else ""
+    except Exception:
+        return ""
+
+
+# ------------------------------------------------------------
+# 応答の軽量解析
+#  - 使うのは件数・ページ数・施設番号・料金（dailyCharge.total）だけなので、本文の bytes から
+#    その数値を順に拾う（json.loads で全体の dict の木を作らない）
+#  - 施設番号の後に続く料金をその施設の部屋として扱う（v1 / v2・elements 指定の有無どれでも同じ並び）
+#  - 文字列中の "..." は \" にエスケープされているので、キー名の一致を取り違えない
+#  - 施設番号が1つも無いのに料金がある（想定外の形）時は従来どおり JSON として解析する
+# ------------------------------------------------------------
+_PAYLOAD_TOKEN = re.compile(rb'"(hotelNo|total|recordCount|pageCount)"\s*:\s*(\d+(?:\.\d+)?)')
+
+
+def parse_hotels_payload(content: bytes) -> dict:
+    """応答本文 → {"recordCount", "pageCount", "hotels": [(施設番号, 最安値 or None), ...]}"""
+    out = {"recordCount": 0, "pageCount": 1, "hotels": []}
+    hotels = out["hotels"]
+    no, best, orphan = None, None, False
+    for key, value in _PAYLOAD_TOKEN.findall(content):
+        if key == b"total":
+            if no is None:
+                orphan = True
+                continue
+            v = float(value) if b"." in value else int(value)
+            if v > 0 and (best is None or v < best):
+                best = v
+        elif key == b"hotelNo":
+            if no is not None:
+                hotels.append((no, best))
+            no, best = value.decode(), None
+        else:
+            out[key.decode()] = int(float(value))
+    if no is not None:
+        hotels.append((no, best))
+    if orphan and not hotels:
+        return _parse_hotels_json(content)
+    return out
+
+
+def _parse_hotels_json(content: bytes) -> dict:
+    data = json.loads(content)
+    paging = data.get("pagingInfo", {})
+    return {
+        "recordCount": paging.get("recordCount", 0),
+        "pageCount":   int(paging.get("pageCount", 1) or 1),
+        "hotels":      [(_extract_hotel_no(h), _extract_hotel_min_price(h)) for h in data.get("hotels", [])],
+    }
+
+
+# ------------------------------------------------------------
+# 市場ページの選択ポリシー
+#  - 宿泊日まで FULL_PAGES_DAYS 日以内：存在する全ページ（MAX_PAGES_NEAR まで）
+#  - それより先：1ページ目を含め、全ページから MAX_PAGES 枚を等間隔に抽出
+# ------------------------------------------------------------
+def select_market_pages(date: dt.date, page_count: int, today: dt.date = None) -> list:
+    today = today or base_date()
+    if page_count <= 1:
+        return [1]
+    if (date - today).days <= FULL_PAGES_DAYS:
+        return list(range(1, min(page_count, MAX_PAGES_NEAR) + 1))
+    k = min(page_count, MAX_PAGES)
+    if k <= 1:
+        return [1]
+    return sorted({1 + round(i * (page_count - 1) / (k - 1)) for i in range(k)})
+
+
+def _add_credentials(params: dict):
+    if LEAN_PAYLOAD:
+        params["formatVersion"] = 2
+        params["elements"] = RESPONSE_ELEMENTS
+    cfg = api_config()
+    params["applicationId"] = cfg["app_id"]
+    if cfg["use_v2"]:
+        params["accessKey"] = cfg["access_key"]
+
+
+def _market_params(date: dt.date, adult_num: int, page: int, market: Market = None) -> dict:
+    market = market or default_market()
+    params = {
+        "format": "json",
+        "checkinDate":  date.strftime("%Y-%m-%d"),
+        "checkoutDate": (date + dt.timedelta(days=1)).strftime("%Y-%m-%d"),
+        "adultNum": adult_num,
+        **market.area,
+        "page": page,
+    }
+
+    _add_credentials(params)
+    return params
+
+
+def _fetch_market_page(date: dt.date, adult_num: int, page: int, market: Market = None):
+    market = market or default_market()
+    try:
+        cfg = api_config()
+        return rakuten_get_json(cfg["url"], params=_market_params(date, adult_num, page, market),
+                                headers=cfg["headers"], timeout=10, cost_key=market.id, parse=parse_hotels_payload)
+    except Exception as e:
+        print(f"  ⚠️ market fetch error [{market.id}] {date} p{page}: {e}", file=sys.stderr)
+        return None
+
+
+# 2ページ目以降を並列で取りに行くためのプール（日付単位のプールとは別にしてデッドロックを避ける）
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool():
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None and CRAWL_WORKERS > 1:
+            _page_pool = ThreadPoolExecutor(max_workers=CRAWL_WORKERS)
+        return _page_pool
+
+
+def shutdown_page_pool():
+    """ページ取得用のプールを止める（次に必要になった時はまた作る）"""
+    global _page_pool
+    with _page_pool_lock:
+        pool, _page_pool = _page_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+# ------------------------------------------------------------
+# 楽天API：市場の在庫数と平均(最低)価格（adultNum可変）
+#  - 1ページ目の pagingInfo で実在ページ数を把握し、必要なページだけ取得
+#  - 取得済みページに自社（市場の my_hotels 先頭）が載っていれば my_price として返す（無ければ None）
+#    自社が複数ある市場は my_prices {hotelNo: 最安値} も返す
+#  - ホテル別の最安値 hotels {hotelNo: 最安値} も返す（競合マトリクス用。追加リクエストなし）
+#    complete = 全ページ取得できた日（載っていないホテル = 空室なし と言える）
+# ------------------------------------------------------------
+def fetch_market_avg(date: dt.date, adult_num: int, market: Market = None) -> dict:
+    market = market or default_market()
+    print(f"🔍 market[{market.id}]({adult_num}p) {date}", file=sys.stderr)
+
+    first = _fetch_market_page(date, adult_num, 1, market)
+    if first is None:
+        # 1ページ目が取れないと件数もページ数も不明 → 空扱い（呼び出し側で既存値を保持）
+        run_metrics.pages(market.id, adult_num, 0, 0)
+        return {"vacancy": 0, "avg_price": 0.0, "my_price": None, "my_prices": {}, "hotels": {}, "complete": False}
+
+    vacancy_total = first["recordCount"]
+    page_count    = first["pageCount"]
+
+    rest = [p for p in select_market_pages(date, page_count) if p != 1]
+    pool = _get_page_pool()
+    if pool is not None and len(rest) > 1:
+        pages = list(pool.map(lambda p: _fetch_market_page(date, adult_num, p, market), rest))
+    else:
+        pages = [_fetch_market_page(date, adult_num, p, market) for p in rest]
+
+    hotel_mins = []
+    by_hotel   = {}
+    for data in [first] + [d for d in pages if d is not None]:
+        for hotel_no, mp in data["hotels"]:
+            if isinstance(mp, (int, float)):
+                hotel_mins.append(mp)
+                if hotel_no.isdigit():
+                    by_hotel[hotel_no] = min(mp, by_hotel.get(hotel_no, mp))
+
+    my_prices = {h: float(by_hotel[h]) for h in market.my_hotels if h in by_hotel}
+    missing = sum(1 for d in pages if d is None)
+    run_metrics.pages(market.id, adult_num, 1 + len(rest) - missing, page_count)
+    avg_price = round(sum(hotel_mins) / len(hotel_mins), 0) if hotel_mins else 0.0
+    print(
+        f"   → market[{market.id}]({adult_num}p) avg(min) = {avg_price}  (vacancy={vacancy_total}, hotels={len(hotel_mins)}, "
+        f"pages={1 + len(rest) - missing}/{page_count}" + (f", failed={missing}" if missing else "") + ")",
+        file=sys.stderr,
+    )
+    return {
+        "vacancy":   vacancy_total,
+        "avg_price": avg_price,
+        "my_price":  my_prices.get(market.my_hotel_no),
+        "my_prices": my_prices,
+        "hotels":    by_hotel,
+        "complete":  missing == 0 and 1 + len(rest) >= page_count,
+    }
+
+
+# ------------------------------------------------------------
+# 楽天API：自社ホテルの当日最安値（adultNum可変）
+# ------------------------------------------------------------
+def fetch_my_min_price(date: dt.date, hotel_no: str, adult_num: int, market: Market = None) -> float:
+    """自社施設1軒の当日最安値。hotelNo で施設が決まるのでエリアコードは付けない（市場のエリアと違っても取れる）"""
+    if not hotel_no:
+        return 0.0
+    market = market or default_market()
+
+    params = {
+        "format": "json",
+        "checkinDate":  date.strftime("%Y-%m-%d"),
+        "checkoutDate": (date + dt.timedelta(days=1)).strftime("%Y-%m-%d"),
+        "adultNum": adult_num,
+        "hotelNo": hotel_no,
+        "page": 1,
+    }
+
+    _add_credentials(params)
+
+    try:
+        cfg = api_config()
+        data = rakuten_get_json(cfg["url"], params=params, headers=cfg["headers"], timeout=10, cost_key=market.id,
+                                parse=parse_hotels_payload)
+    except Exception as e:
+        print(f"  ⚠️ my fetch error {date} ({adult_num}p): {e}", file=sys.stderr)
+        return 0.0
+
+    mins = [mp for _, mp in data["hotels"] if isinstance(mp, (int, float))]
+
+    my_min = float(min(mins)) if mins else 0.0
+    print(f"   → my({adult_num}p) min = {my_min}", file=sys.stderr)
+    return my_min
+
+
+# ------------------------------------------------------------
+# 1日分（市場＋自社）の取得
+#  - 自社価格は市場ページから拾えればそれを使い、載っていない時だけ個別リクエスト
+# ------------------------------------------------------------
+def fetch_date(day: dt.date, adult_num: int, market: Market = None) -> tuple:
+    market = market or default_market()
+    res = fetch_market_avg(day, adult_num=adult_num, market=market)
+    if res.get("my_price") is not None:
+        print(f"   → my({adult_num}p) min = {res['my_price']}  (from market pages)", file=sys.stderr)
+        return res, res["my_price"]
+
+    my_p = 0.0
+    try:
+        my_p = fetch_my_min_price(day, market.my_hotel_no, adult_num=adult_num, market=market)
+    except Exception as e:
+        print(f"  ⚠️ my price error {day.isoformat()} ({adult_num}p): {e}", file=sys.stderr)
+    return res, my_p
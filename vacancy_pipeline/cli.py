@@ -0,0 +1,158 @@
+"""
+vacancy_pipeline.cli
+– サブコマンドで段階ごとに実行する入口（python -m vacancy_pipeline <command> / python update_cache.py）
+
+  run     : 日次の全工程（クロール → キャッシュ・履歴・キューブ → 急騰 → 更新メタ・実行レポート）。省略時はこれ
+  crawl   : リフレッシュ計画 → クロール → キャッシュ（アーカイブ・競合指標を含む）→ 更新メタ
+  history : ストアのキャッシュから今日のスナップショットを追記し、履歴（JSON・シャード）とキューブを書き出す
+  spikes  : 履歴から急騰を検知して demand_spike_history*.json を更新
+  archive : ストアのキャッシュのうち過去日を finalized に退避して書き出す
+  export  : ストアから JSON・シャード・キューブを書き出し直すだけ（取得も追記もしない）
+  recompute : スナップショットから差分・過去日アーカイブ・急騰履歴を作り直す（しきい値・計算式を直した後に）
+
+  crawl / run 以外はネットワークも認証情報も使わない。(市場, adultNum) ごとの処理は --workers 本で並列。
+  段階のモジュールはコマンドを決めてから読み込む（--help や軽い段階で numpy / requests を読まない）。
+"""
+
+import sys
+import argparse
+import functools
+
+from .settings import PIPELINE_WORKERS, PROFILE_FILE, RUN_REPORT_FILE, base_date, run_timestamp
+
+COMMANDS = ("run", "crawl", "history", "spikes", "archive", "export", "recompute")
+
+
+def _targets(args) -> list:
+    """[(market, [adult_num, ...]), ...]（--market / --adults で絞り込み）"""
+    from .markets import MARKETS, load_markets
+    load_markets()
+    unknown = set(args.market or ()) - set(MARKETS)
+    if unknown:
+        raise SystemExit(f"❌ unknown market: {', '.join(sorted(unknown))} (known: {', '.join(MARKETS)})")
+    out = []
+    for m in MARKETS.values():
+        if args.market and m.id not in args.market:
+            continue
+        adults = [n for n in m.adults if not args.adults or n in args.adults]
+        if adults:
+            out.append((m, adults))
+    return out
+
+
+def _crawl(targets: list, today):
+    """全市場 × adultNum の全対象日を1つのスケジュールでまとめて取得（共有レートリミッタ・共有予算）"""
+    import run_metrics
+    from .crawl import CrawlJournal, crawl_dates, iter_target_dates, plan_refresh
+    from .api import shutdown_page_pool
+    target_dates = iter_target_dates(today, 9, today)
+    # 途中で落ちても取得済み分はジャーナルに残り、同じ run ID の再実行で続きから再開する
+    journal = CrawlJournal()
+    with run_metrics.timer("stage", "plan"):
+        tasks = plan_refresh([(m.id, n, d) for m, adults in targets for n in adults for d in target_dates], today)
+    with run_metrics.timer("stage", "crawl"):
+        try:
+            prefetched = crawl_dates(tasks, journal=journal)
+        finally:
+            shutdown_page_pool()   # クロール後の段階にページ取得用のスレッドを残さない
+    return prefetched, journal
+
+
+def cmd_run(targets, today, workers):
+    """日次の全工程（クロール → キャッシュ・履歴・キューブ → 急騰 → 更新メタ）"""
+    from . import stages
+    prefetched, journal = _crawl(targets, today)
+    stages.update_market_outputs(targets, today, prefetched, workers)
+    # 最後に更新メタ
+    stages.write_last_updated()
+    journal.discard()
+
+
+def cmd_crawl(targets, today, workers):
+    """クロールしてキャッシュ（アーカイブ・競合指標を含む）と更新メタを書く"""
+    from . import stages
+    prefetched, journal = _crawl(targets, today)
+    stages.run_parallel([functools.partial(stages.update_adult_cache, m, n, today, prefetched) for m, adults in targets for n in adults], workers)
+    stages.write_last_updated()
+    journal.discard()
+
+
+def cmd_history(targets, today, workers):
+    """今日のスナップショットを追記し、履歴とキューブを書き出す（ネットワーク不要）"""
+    from . import stages
+    stages.run_parallel([functools.partial(stages.update_adult_history, m, n) for m, adults in targets for n in adults], workers)
+
+
+def cmd_spikes(targets, today, workers):
+    """履歴から急騰を検知して履歴ファイルを更新（ネットワーク不要）"""
+    from . import stages
+    stages.run_parallel([functools.partial(stages.update_spikes, m, today) for m, _ in targets], workers)
+
+
+def cmd_archive(targets, today, workers):
+    """過去日の最終値を finalized に退避して書き出す（ネットワーク不要）"""
+    from . import stages
+    stages.run_parallel([functools.partial(stages.update_archive, m, n, today) for m, adults in targets for n in adults], workers)
+
+
+def cmd_export(targets, today, workers):
+    """ストアから JSON・シャード・キューブを書き出し直す（ネットワーク不要）"""
+    from . import stages
+    stages.run_parallel([functools.partial(stages.export_outputs, m, n) for m, adults in targets for n in adults], workers)
+
+
+def cmd_recompute(targets, today, workers):
+    """スナップショットから差分・過去日アーカイブ・急騰履歴を作り直す（ネットワーク不要）"""
+    from . import stages, recompute
+    stages.run_parallel([functools.partial(recompute.recompute_adult, m, n, today) for m, adults in targets for n in adults], workers)
+    stages.run_parallel([functools.partial(recompute.recompute_spikes, m, today) for m, _ in targets], workers)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="vacancy_pipeline", description="vacancy-dashboard data pipeline")
+    sub = ap.add_subparsers(dest="command")
+    for name in COMMANDS:
+        p = sub.add_parser(name, help=globals()[f"cmd_{name}"].__doc__)
+        p.add_argument("--market", action="append", help="対象の市場ID（複数可。省略時は全市場）")
+        p.add_argument("--adults", type=int, nargs="+", help="対象の adultNum（省略時は市場の設定どおり）")
+        p.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="(市場, adultNum) ごとの処理の同時実行数")
+        p.add_argument("--report", default=RUN_REPORT_FILE if name == "run" else None,
+                       help="実行レポートの書き出し先（run 以外は指定した時だけ）")
+    return ap
+
+
+def main(argv=None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["run"] + argv   # 従来どおり python update_cache.py だけで日次の全工程
+    args = build_parser().parse_args(argv)
+
+    print(f"📡 {args.command} start", file=sys.stderr)
+    # CRAWL_PROFILE=<path>.prof で cProfile（メインスレッドのみ。ワーカー内も見るなら RAKUTEN_CRAWL_WORKERS=1 / --workers 1）
+    profiler = None
+    if PROFILE_FILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    today = base_date()
+    print(f"🕘 run {run_timestamp()}", file=sys.stderr)
+    targets = _targets(args)
+    # ストアはメインスレッドで先に開く（JSON からの取り込み・形式変換を並列の段階の中で同時に走らせない）
+    for m, _ in targets:
+        m.store()
+    globals()[f"cmd_{args.command}"](targets, today, max(1, args.workers))
+
+    from atomic_write import summary as write_summary
+    ws = write_summary()
+    print(f"💾 files: {ws['written']} written ({ws['bytes_written']:,} bytes), "
+          f"{ws['skipped']} unchanged ({ws['bytes_skipped']:,} bytes not rewritten)", file=sys.stderr)
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(PROFILE_FILE)
+        print(f"🔬 profile written: {PROFILE_FILE}", file=sys.stderr)
+    if args.report:
+        from .report import write_run_report
+        write_run_report(today, profiler, command=args.command, path=args.report)
+    print("✨ all done", file=sys.stderr)
+    return 0
@@ -0,0 +1,220 @@
+"""
+vacancy_pipeline.crawl
+– クロール対象日の列挙・リフレッシュ計画・チェックポイント・並列クロール
+"""
+
+import os
+import sys
+import json
+import time
+import calendar
+import threading
+import datetime as dt
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dateutil.relativedelta import relativedelta
+
+import run_metrics
+from event_index import load_event_index
+from history_arrays import HistoryArrays
+from vacancy_query import DateTable, HistoryTable
+
+from .settings import (
+    CHECKPOINT_DIR, CRAWL_RUN_ID, CRAWL_WORKERS, MAX_PAGES_NEAR,
+    REFRESH_BUDGET, REFRESH_ALWAYS_DAYS, REFRESH_MAX_STALE_DAYS,
+)
+from .files import load_json_file
+from .markets import MARKETS, Market, default_market, get_store
+from .api import fetch_date, select_market_pages, request_costs, rate_stats
+
+
+# ------------------------------------------------------------
+# クロール対象日の列挙（月カレンダー順・今日より後のみ）
+# ------------------------------------------------------------
+def iter_target_dates(start_date: dt.date, months: int, today: dt.date) -> list:
+    cal   = calendar.Calendar(firstweekday=calendar.SUNDAY)
+    dates = []
+    for m in range(months):
+        month_start = (start_date + relativedelta(months=m)).replace(day=1)
+        for week in cal.monthdatescalendar(month_start.year, month_start.month):
+            for day in week:
+                if day.month != month_start.month or day <= today:
+                    continue
+                dates.append(day)
+    return dates
+
+
+# ------------------------------------------------------------
+# リフレッシュ計画：どの (adult_num, 日付) を今回取りに行くか
+#  - 優先度 = リードタイム + 直近の変動（履歴スナップショット） + イベント + 急騰履歴
+#  - 毎回取得：REFRESH_ALWAYS_DAYS 以内 / イベント日 / 急騰日 / 未取得 / REFRESH_MAX_STALE_DAYS 超
+#  - それ以外は「優先度 ×(1+経過日数)」の高い順に、REFRESH_BUDGET の範囲で持ち回り
+# ------------------------------------------------------------
+def _snapshot_volatility(series: HistoryArrays, window: int = 14) -> float:
+    """直近 window 件のスナップショット（宿泊日1つぶん）の、前回比変化率（価格・在庫）の平均。"""
+    price, vac = series.price[-window:], series.vacancy[-window:].astype(np.float64)
+    before = np.column_stack([price[:-1], vac[:-1]]).ravel()   # 取得日ごとに 価格, 在庫 の順
+    after  = np.column_stack([price[1:], vac[1:]]).ravel()
+    ok = before != 0
+    changes = (np.abs(after[ok] - before[ok]) / before[ok]).tolist()
+    return sum(changes) / len(changes) if changes else 0.0
+
+
+def _recent_spike_dates(today: dt.date, days: int = 14, market: Market = None) -> set:
+    market = market or default_market()
+    since = (today - dt.timedelta(days=days)).isoformat()
+    return {
+        it.get("spike_date")
+        for n in market.adults
+        for up_date, items in load_json_file(market.files(n)["spikes"]).items() if up_date >= since
+        for it in (items or [])
+    }
+
+
+def estimate_task_cost(day: dt.date, entry: dict, today: dt.date) -> int:
+    """前回の在庫数(≒recordCount)からページ数を見積もり、今回のページ方針で何リクエストになるか。"""
+    page_count = max(1, -(-int(entry.get("vacancy", 0) or 0) // 30)) if entry else MAX_PAGES_NEAR
+    return len(select_market_pages(day, page_count, today))
+
+
+def plan_refresh(tasks: list, today: dt.date, budget: int = REFRESH_BUDGET) -> list:
+    """tasks: [(市場ID, adult_num, 日付), ...]。予算は全市場で共有。"""
+    if budget <= 0:
+        return list(tasks)
+
+    events, spikes, caches, hists = {}, {}, {}, {}
+    for mid, n in {(mid, n) for mid, n, _ in tasks}:
+        market = MARKETS[mid]
+        if mid not in events:
+            events[mid] = load_event_index(market.event_file)
+            spikes[mid] = _recent_spike_dates(today, market=market)
+        store = get_store(market)
+        caches[(mid, n)] = DateTable.from_dict(store.load_cache(n))
+        hists[(mid, n)]  = HistoryTable(store.load_history_arrays(n, stay_from=today.isoformat()))
+
+    selected, optional, spent = set(), [], 0
+    for mid, n, day in tasks:
+        iso   = day.isoformat()
+        entry = caches[(mid, n)].get(iso)
+        cost  = estimate_task_cost(day, entry, today)
+
+        lead = (day - today).days
+        updated = (entry or {}).get("updated_at")
+        stale = (today - dt.date.fromisoformat(updated)).days if updated else None
+
+        if (entry is None or stale is None or stale >= REFRESH_MAX_STALE_DAYS
+                or lead <= REFRESH_ALWAYS_DAYS or iso in events[mid] or iso in spikes[mid]):
+            selected.add((mid, n, day))
+            spent += cost
+            continue
+
+        priority = (
+            1.0 / (1.0 + lead / 14.0)
+            + min(1.0, 10.0 * _snapshot_volatility(hists[(mid, n)].series(iso)))
+        )
+        optional.append((priority * (1 + stale), cost, (mid, n, day)))
+
+    for _, cost, key in sorted(optional, key=lambda x: -x[0]):
+        if spent + cost > budget:
+            continue
+        selected.add(key)
+        spent += cost
+
+    print(f"🗓 refresh plan: {len(selected)}/{len(tasks)} tasks, est. {spent} requests (budget {budget})", file=sys.stderr)
+    return [t for t in tasks if t in selected]
+
+
+# ------------------------------------------------------------
+# クロール結果のチェックポイント・ジャーナル
+#  - 1行1結果の JSONL（run ID ごとに1ファイル）。取得できた (市場, adult_num, 日付) を都度追記
+#  - 再実行時は記録済みの分を読み戻し、未取得の日付だけを取りに行く
+#  - 空結果（API失敗）は記録しない → 再開時に取り直す
+# ------------------------------------------------------------
+class CrawlJournal:
+
+    def __init__(self, run_id: str = CRAWL_RUN_ID, directory: str = CHECKPOINT_DIR):
+        self.run_id = run_id
+        self.path   = Path(directory) / f"crawl_{run_id}.jsonl"
+        self._lock  = threading.Lock()
+
+    def load(self) -> dict:
+        done = {}
+        if not self.path.exists():
+            return done
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                rec = json.loads(line)
+                key = (rec.get("market_id", default_market().id), int(rec["adult_num"]), dt.date.fromisoformat(rec["date"]))
+                done[key] = (rec["market"], rec["my_price"])
+            except Exception:
+                continue  # 書き込み途中で落ちた末尾行などは無視
+        return done
+
+    def append(self, market_id: str, adult_num: int, day: dt.date, result: tuple):
+        market, my_p = result
+        if market["vacancy"] == 0 and market["avg_price"] == 0.0:
+            return
+        line = json.dumps({"market_id": market_id, "adult_num": adult_num, "date": day.isoformat(),
+                           "market": market, "my_price": my_p}, ensure_ascii=False)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def discard(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# ------------------------------------------------------------
+# 並列クロール：(市場ID, adult_num, 日付) の全タスクを1つのスケジュールで処理
+#  - 同時実行数は CRAWL_WORKERS、発射間隔は全市場で共有のレートリミッタ（api）が制御
+#  - 戻り値は {(市場ID, adult_num, day): (market, my_p)}。組み立て順は呼び出し側が決める
+#  - journal を渡すと記録済みタスクは取得せず、新たな結果は都度ジャーナルへ追記
+#  - 市場ごとのタスク数・リクエスト数（リトライ込み）とレート制御の推移をログと実行レポートの "crawl" に出す
+# ------------------------------------------------------------
+def crawl_dates(tasks: list, workers: int = CRAWL_WORKERS, journal: CrawlJournal = None) -> dict:
+    done = journal.load() if journal else {}
+    todo = [key for key in tasks if key not in done]
+    if done:
+        print(f"♻️ resume run {journal.run_id}: {len(tasks) - len(todo)}/{len(tasks)} tasks from checkpoint", file=sys.stderr)
+
+    def _task(mid, n, d):
+        t0 = time.perf_counter()
+        result = fetch_date(d, adult_num=n, market=MARKETS[mid])
+        run_metrics.observe("date", time.perf_counter() - t0)
+        if journal:
+            journal.append(mid, n, d, result)
+        return result
+
+    costs_before = request_costs()
+    if workers <= 1:
+        fetched = {key: _task(*key) for key in todo}
+    else:
+        print(f"🚀 crawl {len(todo)} tasks with {workers} workers", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {key: pool.submit(_task, *key) for key in todo}
+            fetched = {key: fut.result() for key, fut in futures.items()}
+
+    results = {key: done[key] if key in done else fetched[key] for key in tasks}
+
+    per_market = {}
+    for mid, _, _ in tasks:
+        pm = per_market.setdefault(mid, {"tasks": 0, "fetched": 0, "requests": 0})
+        pm["tasks"] += 1
+    for mid, _, _ in todo:
+        per_market[mid]["fetched"] += 1
+    costs_after = request_costs()
+    for mid, pm in per_market.items():
+        pm["requests"] = costs_after.get(mid, 0) - costs_before.get(mid, 0)
+        print(f"💰 market[{mid}]: {pm['fetched']}/{pm['tasks']} tasks fetched, {pm['requests']} requests", file=sys.stderr)
+
+    st = rate_stats()
+    print(f"📈 rate controller: rate={st['rate']}/s counts={st['counts']}", file=sys.stderr)
+    run_metrics.section("crawl", {"tasks": len(tasks), "fetched": len(todo), "workers": workers, "markets": per_market, **st})
+    return results
@@ -0,0 +1,88 @@
+"""
+vacancy_pipeline.files
+– JSON の読み書き・フロント向けファイルの書き出し・履歴シャードの書き出し・日付キー判定（標準ライブラリ＋atomic_write だけで動く）
+"""
+
+import sys
+import json
+import hashlib
+import functools
+import datetime as dt
+from pathlib import Path
+
+import run_metrics
+from history_arrays import is_date_string
+from atomic_write import write_bytes, write_json, dumps_json
+
+from .settings import EXPORT_DIR
+
+
+@run_metrics.timer("io", "load")
+def load_json_file(path: str) -> dict:
+    p = Path(path)
+    if not p.exists():
+        return {}
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+@run_metrics.timer("io", "write")
+def save_json_file(path: str, data: dict, compact: bool = True) -> bool:
+    """中身が変わった時だけ一時ファイル経由で書く（atomic_write）。データファイルは空白なしの compact。"""
+    return write_json(path, data, compact=compact)
+
+
+@run_metrics.timer("io", "write")
+def write_export(path: Path, raw: bytes) -> bool:
+    """
+    フロント向けのファイルを raw のまま書く（中身が変わった時だけ）。
+    GitHub Pages は .gz / .br を Content-Encoding 付きで返さないので事前圧縮はしない。以前の版が残したものは消す。
+    """
+    for old in (path.with_name(path.name + ".gz"), path.with_name(path.name + ".br")):
+        old.unlink(missing_ok=True)
+    return write_bytes(path, raw)
+
+
+def export_history_shards(hist: dict, name: str, out_dir: str = EXPORT_DIR) -> dict:
+    """
+    履歴を宿泊月ごとのシャード <out_dir>/<name>/<YYYY-MM>.<sha256先頭12桁>.json に分けて書き出し、
+    <out_dir>/<name>_manifest.json（月 → ファイル名・ハッシュ・宿泊日一覧）を更新する。
+    内容が同じシャードはファイル名も同じなので書き直さない（ブラウザ側は無期限キャッシュ可）。
+    参照されなくなった古いシャードは削除。
+    """
+    by_month = {}
+    for stay, snaps in hist.items():
+        by_month.setdefault(stay[:7], {})[stay] = snaps
+
+    shard_dir = Path(out_dir) / name
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    shards, keep, written = {}, set(), 0
+    for ym, part in sorted(by_month.items()):
+        raw    = json.dumps(part, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        fname  = f"{ym}.{digest[:12]}.json"
+        if not (shard_dir / fname).exists():
+            write_export(shard_dir / fname, raw)
+            written += 1
+        keep.add(fname)
+        shards[ym] = {"file": f"{name}/{fname}", "sha256": digest, "bytes": len(raw), "dates": sorted(part)}
+
+    for p in shard_dir.iterdir():
+        if p.name not in keep:
+            p.unlink()
+
+    manifest = {"version": 1, "shards": shards}
+    write_export(Path(out_dir) / f"{name}_manifest.json", dumps_json(manifest))
+    print(f"🧩 {name}: {len(shards)} shards ({written} rewritten)", file=sys.stderr)
+    return manifest
+
+
+@functools.lru_cache(maxsize=None)
+def parse_iso_date(s: str):
+    """ISO日付文字列（YYYY-MM-DD）→ date（日付でなければ None）。同じキーを何度も判定するのでメモ化。"""
+    return dt.date.fromisoformat(s) if is_date_string(s) else None
+
+
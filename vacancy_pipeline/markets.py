@@ -0,0 +1,132 @@
+"""
+vacancy_pipeline.markets
+– 対象市場（エリア × adultNum × 自社施設）と市場ごとの保存先
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+from snapshot_store import SnapshotStore
+
+from .settings import EVENT_FILE, EXPORT_DIR, MARKETS_FILE, SNAPSHOT_STORE_FILE, mode_files, my_hotel_no
+from .files import load_json_file
+
+
+# ------------------------------------------------------------
+# 対象市場（エリア × adultNum × 自社施設）
+#  - markets.json（MARKETS_FILE）の "markets" に列挙。無ければ従来の大阪市1市場
+#      {"markets": [
+#        {"id": "osaka-shi", "middleClassCode": "osaka", "smallClassCode": "shi", "detailClassCode": "D",
+#         "adults": [1, 2], "my_hotels": ["123456"], "output_dir": "."},
+#        {"id": "kyoto-shi", "middleClassCode": "kyoto", "smallClassCode": "shi", "detailClassCode": "A",
+#         "adults": [2]}
+#      ]}
+#  - エリアコードを省いた項目は既定（大阪市 osaka / shi / D）。その階層で絞らない時は null を書く
+#  - 出力（JSON・SQLite・data/）は市場ごとに output_dir 配下（既定：先頭の市場は "."、他は markets/<id>）
+#  - my_hotels 省略時は RAKUTEN_MY_HOTEL_NO（使う時に検証）
+# ------------------------------------------------------------
+class Market:
+
+    def __init__(self, id: str, middle: str = "osaka", small: str = "shi", detail: str = "D", large: str = "japan",
+                 adults=(1, 2), my_hotels=None, output_dir: str = ".", event_file: str = EVENT_FILE):
+        self.id         = id
+        self.area       = {k: v for k, v in (("largeClassCode", large), ("middleClassCode", middle),
+                                             ("smallClassCode", small), ("detailClassCode", detail)) if v}
+        self.adults     = tuple(int(n) for n in adults)
+        self.output_dir = Path(output_dir)
+        self.event_file = event_file
+        self._my_hotels = [str(h).strip() for h in my_hotels] if my_hotels else None
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+        self._bootstrapped = False
+
+    @property
+    def my_hotels(self) -> list:
+        return self._my_hotels or [my_hotel_no()]
+
+    @property
+    def my_hotel_no(self) -> str:
+        return self.my_hotels[0]
+
+    @property
+    def is_default(self) -> bool:
+        return self.output_dir == Path(".")
+
+    def path(self, name: str) -> str:
+        return str(self.output_dir / name)
+
+    def files(self, adult_num: int) -> dict:
+        """mode_files と同じキーで、市場の output_dir を付けたパス（shards / cube は data/ 内の名前のまま）"""
+        names = mode_files(adult_num)
+        return {k: (v if k in ("shards", "cube") else self.path(v)) for k, v in names.items()}
+
+    @property
+    def export_dir(self) -> str:
+        return self.path(EXPORT_DIR)
+
+    def store(self) -> SnapshotStore:
+        """
+        市場ごとの SQLite ストアを開く（初回は既存 JSON から取り込む）。
+        接続はスレッドごと（adultNum ごとの後処理を並列に走らせても同じ接続を取り合わない）。
+        """
+        store = getattr(self._local, "store", None)
+        if store is None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path = self.path(SNAPSHOT_STORE_FILE)
+            store = self._local.store = SnapshotStore(path)
+            with self._lock:
+                if not self._bootstrapped:
+                    for n in self.adults:
+                        files = self.files(n)
+                        if store.bootstrap_from_json(n, files["cache"], files["history"], files["archive"]):
+                            print(f"⚠️ {path} had no {n}p data: imported from JSON (history limited to the exported window)",
+                                  file=sys.stderr)
+                    self._bootstrapped = True
+        return store
+
+
+# 市場ID → Market（load_markets で中身を差し替える。モジュールをまたいで同じ dict を共有）
+MARKETS = {}
+
+
+def _set_markets(markets: dict):
+    MARKETS.clear()
+    MARKETS.update(markets)
+
+
+_set_markets({"osaka-shi": Market("osaka-shi")})
+
+
+def default_market() -> Market:
+    """output_dir が "." の市場（無ければ先頭）。従来の1市場構成ではリポジトリ直下の JSON を書く市場。"""
+    return next((m for m in MARKETS.values() if m.is_default), next(iter(MARKETS.values())))
+
+
+def load_markets(path: str = MARKETS_FILE) -> dict:
+    """markets.json を読んで MARKETS を差し替える（無ければ既定の1市場のまま）。"""
+    conf = load_json_file(path).get("markets") or []
+    if not conf:
+        return MARKETS
+    markets = {}
+    for i, m in enumerate(conf):
+        mid = str(m["id"])
+        if mid in markets:
+            raise ValueError(f"❌ {path}: 市場ID '{mid}' が重複しています。")
+        markets[mid] = Market(
+            mid,
+            middle=m.get("middleClassCode", "osaka"), small=m.get("smallClassCode", "shi"),
+            detail=m.get("detailClassCode", "D"),
+            large=m.get("largeClassCode", "japan"),
+            adults=m.get("adults", (1, 2)),
+            my_hotels=m.get("my_hotels"),
+            output_dir=m.get("output_dir", "." if i == 0 else f"markets/{mid}"),
+            event_file=m.get("event_file", EVENT_FILE),
+        )
+    _set_markets(markets)
+    print(f"🗺 markets: {', '.join(f'{m.id}{list(m.adults)}' for m in markets.values())}", file=sys.stderr)
+    return MARKETS
+
+
+def get_store(market: Market = None) -> SnapshotStore:
+    return (market or default_market()).store()
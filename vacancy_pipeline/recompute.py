@@ -0,0 +1,133 @@
+"""
+vacancy_pipeline.recompute
+– ストアのスナップショットから派生データを作り直す（ネットワーク・認証情報不要）
+
+  差分（vacancy_diff / avg_price_diff / my_vs_avg_pct）・過去日最終値アーカイブ・急騰履歴は、
+  これまでクロールの中でしか作られなかった。しきい値や計算式を直した時は、ここで過去分まで作り直す。
+  履歴は adultNum ごとに1回だけ読み、全宿泊日 × 全取得日を numpy でまとめて処理する
+  （取得日ごとにストアを読み直したりクロールを再生したりはしない）。
+  ストアが無ければ、既存の JSON（historical_data*.json・キャッシュ・アーカイブ）から取り込んでから作る。
+"""
+
+import sys
+import datetime as dt
+import numpy as np
+
+import run_metrics
+from history_arrays import HistoryArrays, to_day, days_to_iso, iso_to_days
+from demand_spikes import detect_spikes_runs
+from event_index import load_event_index
+
+from .settings import SPIKE_HISTORY_DAYS
+from .files import save_json_file, is_date_string
+from .markets import Market, get_store
+from .stages import (
+    price_diffs, my_vs_avg_pct, _carry_forward, archive_finalized_past_data, save_demand_spike_history,
+    update_booking_cube, with_events,
+)
+
+
+def _latest_rows(h: HistoryArrays):
+    """
+    宿泊日ごとの最新スナップショットの行番号と、その1つ前の行番号（同じ宿泊日に無ければ -1）。
+    h は (stay, at) 昇順。
+    """
+    if not len(h):
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+    last = np.nonzero(np.r_[h.stay[1:] != h.stay[:-1], True])[0]
+    prev = last - 1
+    prev[(prev < 0) | (h.stay[np.maximum(prev, 0)] != h.stay[last])] = -1
+    return last, prev
+
+
+def recompute_cache(cache: dict, h: HistoryArrays) -> int:
+    """
+    キャッシュの前回値・差分・自社価格比を履歴から付け直す（cache をその場で更新し、変わった件数を返す）。
+      - 取得日（updated_at。無い旧データは宿泊日の前日）のスナップショットと、その1つ前のスナップショットの差分
+        （1つ前が履歴に無い＝初回取得か履歴の保持範囲外なら、今の値のまま）
+      - 最後の実行で取得対象（宿泊日 > 実行日）なのに取り直さず持ち越した値 → 差分0（クロール時の _carry_forward と同じ）
+    """
+    isos = [iso for iso in cache if is_date_string(iso)]
+    if not isos or not len(h):
+        return 0
+    stay = iso_to_days(isos).astype(np.int64)
+    fetched = iso_to_days([cache[iso].get("updated_at") or iso for iso in isos]).astype(np.int64)
+    fetched -= np.array([not cache[iso].get("updated_at") for iso in isos])
+
+    # (宿泊日, 取得日) 以前で最後のスナップショット行と、その1つ前の行（同じ宿泊日の中だけ）
+    keys = h.stay.astype(np.int64) * 100_000 + h.snap
+    row = np.searchsorted(keys, stay * 100_000 + fetched, side="right") - 1
+    found = (row >= 0) & (h.stay[np.maximum(row, 0)] == stay)
+    prev = row - 1
+    has_prev = found & (prev >= 0) & (h.stay[np.maximum(prev, 0)] == stay)
+    last_run = h.snap[np.maximum(np.searchsorted(keys, stay * 100_000 + 99_999, side="right") - 1, 0)]
+    carried = found & (stay > last_run) & (fetched < last_run)
+
+    changed = 0
+    for i, iso in enumerate(isos):
+        entry = cache[iso]
+        if carried[i]:
+            new = _carry_forward(entry)
+        elif has_prev[i]:
+            j = prev[i]
+            new = {**entry, **price_diffs(entry.get("vacancy", 0), entry.get("avg_price", 0),
+                                          int(h.vacancy[j]), float(h.price[j]))}
+        else:
+            new = dict(entry)
+        new["my_vs_avg_pct"] = my_vs_avg_pct(new.get("my_price"), new.get("avg_price", 0))
+        if new != entry:
+            cache[iso] = new
+            changed += 1
+    return changed
+
+
+def final_values(h: HistoryArrays, today: dt.date) -> dict:
+    """today より前の宿泊日の最終値（その宿泊日の最新スナップショット）{iso: {"vacancy", "avg_price"}}"""
+    last, _ = _latest_rows(h)
+    last = last[h.stay[last] < to_day(today)]
+    return {
+        iso: {"vacancy": v, "avg_price": p}
+        for iso, v, p in zip(days_to_iso(h.stay[last]).tolist(), h.vacancy[last].tolist(), h.price[last].tolist())
+    }
+
+
+def recompute_adult(market: Market, adult_num: int, today: dt.date):
+    """(市場, adultNum) ぶんのキャッシュ差分・過去日アーカイブ・キューブ"""
+    files = market.files(adult_num)
+    store = get_store(market)
+    with run_metrics.timer("stage", "recompute"):
+        h = store.load_history_arrays(adult_num, per_run=True)   # 差分は直前の「実行」と比べる（同じ日の実行も含む）
+        cache = store.load_cache(adult_num)
+        changed = recompute_cache(cache, h)
+        if changed:
+            store.save_cache(adult_num, cache)
+        save_json_file(files["cache"], with_events(cache, market))
+        print(f"♻️ {market.id} {adult_num}p: {len(h)} snapshots → {changed} cache entries changed", file=sys.stderr)
+
+        # 過去日の最終値：クロール時と同じ関数に通す（アーカイブ側の修正もそのまま反映される）
+        archive_finalized_past_data(final_values(h, today), files["archive"], today, adult_num, market)
+    with run_metrics.timer("stage", "cube"):
+        update_booking_cube(adult_num=adult_num, market=market)
+
+
+def recompute_spikes(market: Market, today: dt.date, days: int = SPIKE_HISTORY_DAYS):
+    """
+    急騰履歴を作り直す：直近 days 日のうちスナップショットがある各日を「その日の実行」として検知し直す。
+    その日より後のスナップショットは見ない（当日時点で見えていた履歴だけ）。
+    """
+    store = get_store(market)
+    first = today - dt.timedelta(days=days)
+    with run_metrics.timer("stage", "spikes"):
+        histories = {n: store.load_history_arrays(n, stay_from=first.isoformat()) for n in market.adults}
+        snaps = np.concatenate([h.snap for h in histories.values()] + [np.array([], dtype=np.int32)])
+        run_days = np.unique(snaps[(snaps >= to_day(first)) & (snaps <= to_day(today))]).tolist()
+        events = load_event_index(market.event_file)
+
+        # 全実行日を1回で（宿泊日は実行日以降だけなので、イベント日は最初の実行日以降があればよい）
+        spikes = detect_spikes_runs(histories, run_days, events.day_set(since=first))
+        isos = days_to_iso(np.array(run_days, dtype=np.int32)).tolist()
+        updates = {n: {iso: spikes[day].get(n, []) for day, iso in zip(run_days, isos)} for n in market.adults}
+        for n in market.adults:
+            save_demand_spike_history(None, market.files(n)["spikes"], updates=updates[n])
+    print(f"♻️ {market.id}: spikes recomputed for {len(run_days)} run days", file=sys.stderr)
@@ -0,0 +1,71 @@
+"""
+vacancy_pipeline.report
+– 実行レポート（run_report.json）と cProfile の要約
+"""
+
+import sys
+import pstats
+import cProfile
+import datetime as dt
+from pathlib import Path
+
+import run_metrics
+from atomic_write import summary as write_summary
+
+from .settings import CRAWL_RUN_ID, HTTP_MODE, run_timestamp, PROFILE_FILE, REGRESSION_RATIO, RUN_REPORT_FILE
+from .files import load_json_file, save_json_file
+from .markets import MARKETS
+
+
+# ------------------------------------------------------------
+# 実行レポート（last_updated.json の隣）
+#  - run_metrics の計測値：API のレイテンシ分布・ステータス別件数・リトライ・受信バイト・宿泊日ごとのページ数、
+#    段階（stage）と I/O（load / db_write / prune / write）の所要時間、クロールのレート制御
+#  - 前回のレポート（同じサブコマンド）と比べ、REGRESSION_RATIO 倍以上遅くなった段階はログで警告して "regressions" に残す
+# ------------------------------------------------------------
+def _profile_top(profiler: cProfile.Profile, limit: int = 25) -> list:
+    """累積時間の上位 limit 関数"""
+    st = pstats.Stats(profiler)
+    rows = sorted(st.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:limit]
+    return [
+        {"func": f"{Path(fn).name}:{line}({name})", "calls": nc, "tottime_s": round(tt, 3), "cumtime_s": round(ct, 3)}
+        for (fn, line, name), (_, nc, tt, ct, _) in rows
+    ]
+
+
+def write_run_report(today: dt.date, profiler: cProfile.Profile = None, command: str = "run",
+                     path: str = RUN_REPORT_FILE) -> dict:
+    report = {
+        "run_id":     CRAWL_RUN_ID,
+        "command":    command,
+        "today":      today.isoformat(),
+        "run_at":     run_timestamp(),
+        "finished":   dt.datetime.now(dt.timezone(dt.timedelta(hours=9))).isoformat(timespec="seconds"),
+        "http_mode":  HTTP_MODE,
+        "markets":    list(MARKETS),
+        **run_metrics.report(),
+        "files":      write_summary(),
+    }
+    if profiler is not None:
+        report["profile"] = {"file": PROFILE_FILE, "top": _profile_top(profiler)}
+
+    prev = load_json_file(path)
+    if prev.get("command", "run") != command:
+        prev = {}
+    regressions = {}
+    for name, cur in [("total", report["elapsed_s"])] + [(k, v["seconds"]) for k, v in report.get("stage", {}).items()]:
+        before = prev.get("elapsed_s") if name == "total" else prev.get("stage", {}).get(name, {}).get("seconds")
+        if before and before >= 1.0 and cur >= before * REGRESSION_RATIO:
+            regressions[name] = {"seconds": cur, "previous": before}
+            print(f"🐢 regression: {name} {before:.1f}s → {cur:.1f}s", file=sys.stderr)
+    report["previous"] = {"run_id": prev.get("run_id"), "elapsed_s": prev.get("elapsed_s")} if prev else None
+    report["regressions"] = regressions
+
+    req = report["requests"]["total"]
+    lat = report["latency"].get("request:market", {})
+    print(f"🧾 {path}: {report['elapsed_s']:.1f}s"
+          + (f", {req['attempts']} requests ({req['retries']} retries, {req['bytes']:,} bytes), "
+             f"market p50/p90 = {lat.get('p50_ms')}/{lat.get('p90_ms')} ms" if req["attempts"] else ""),
+          file=sys.stderr)
+    save_json_file(path, report, compact=False)
+    return report
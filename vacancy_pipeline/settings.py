@@ -0,0 +1,208 @@
+"""
+vacancy_pipeline.settings
+– 環境変数・出力ファイル名などの設定値（import しても検証・出力・通信はしない）
+
+  楽天APIの認証情報と自社施設番号は、実際に API を使う時に api_config() / my_hotel_no() で検証する
+  （オフラインの再計算・書き出しだけなら Secrets は不要）。
+"""
+
+import os
+import sys
+import functools
+import datetime as dt
+
+# ============================================================
+# HTTPモード（オフライン計測・検証用）
+#  - live   : 通常どおり楽天APIへ（既定）
+#  - record : 実APIへ投げつつ応答を RAKUTEN_HTTP_FIXTURES に保存
+#  - replay : 保存済み応答だけで動かす（ネットワーク・認証情報不要）
+#  RAKUTEN_API_URL を指定するとエンドポイントを差し替え（ローカルの偽サーバ等）
+# ============================================================
+HTTP_MODE         = os.environ.get("RAKUTEN_HTTP_MODE", "live").strip().lower()
+HTTP_FIXTURES_DIR = os.environ.get("RAKUTEN_HTTP_FIXTURES", ".http_fixtures")
+API_URL_OVERRIDE  = os.environ.get("RAKUTEN_API_URL", "").strip()
+OFFLINE           = HTTP_MODE == "replay" or bool(API_URL_OVERRIDE)
+
+
+def base_date() -> dt.date:
+    """基準日。CRAWL_TODAY（ISO日付）で固定できる（リプレイ・再計算用）。無ければ CRAWL_AT の日付。"""
+    fixed = os.environ.get("CRAWL_TODAY", "").strip() or os.environ.get("CRAWL_AT", "").strip()[:10]
+    return dt.date.fromisoformat(fixed) if fixed else dt.date.today()
+
+
+@functools.lru_cache(maxsize=None)
+def run_timestamp() -> str:
+    """
+    この実行のスナップショットキー（YYYY-MM-DDTHH:MM。日付部分は base_date()）。1日に複数回クロールしても
+    実行ごとに別のキーになる。CRAWL_AT（ISO日時）で固定できる。最初に呼んだ時の値を実行中ずっと使う。
+    """
+    fixed = os.environ.get("CRAWL_AT", "").strip()
+    at = dt.datetime.fromisoformat(fixed) if fixed else dt.datetime.now()
+    return f"{base_date().isoformat()}T{at:%H:%M}"
+
+
+# ============================================================
+# Rakuten API credentials (V1 / V2)
+#  - 無事故方針：V2の環境変数が揃っている時だけV2を使い、
+#               無ければ従来どおりV1で動かす
+#  - オフライン時（replay / 偽サーバ）は認証情報なしでもダミー値で動かす
+# ============================================================
+# エンドポイント（V1 / V2）
+RAKUTEN_API_URL_V1 = "https://app.rakuten.co.jp/services/api/Travel/VacantHotelSearch/20170426"
+RAKUTEN_API_URL_V2 = "https://openapi.rakuten.co.jp/engine/api/Travel/VacantHotelSearch/20170426"
+
+
+@functools.lru_cache(maxsize=None)
+def api_config() -> dict:
+    """
+    使う API（V1 / V2）と認証情報・エンドポイント・ヘッダ。最初に呼ばれた時に1回だけ検証してログに出す。
+    戻り値: {"use_v2", "app_id", "access_key", "url", "headers"}
+    """
+    app_id_v1 = os.environ.get("RAKUTEN_APP_ID", "").strip() or ("offline" if OFFLINE else "")
+    app_id_v2 = os.environ.get("RAKUTEN_APP_ID_V2", "").strip()
+    access_key_v2 = os.environ.get("RAKUTEN_ACCESS_KEY_V2", "").strip()
+
+    # 任意：強制モード（auto / v1 / v2） ※未設定なら auto
+    api_mode = os.environ.get("RAKUTEN_API_MODE", "auto").strip().lower()
+    use_v2 = bool((api_mode == "v2") or (api_mode == "auto" and app_id_v2 and access_key_v2))
+
+    if use_v2:
+        if not app_id_v2 or not access_key_v2:
+            raise ValueError("❌ V2モードなのに RAKUTEN_APP_ID_V2 / RAKUTEN_ACCESS_KEY_V2 が未設定です。")
+    else:
+        if not app_id_v1:
+            raise ValueError("❌ RAKUTEN_APP_ID が設定されていません。GitHub Secrets に登録してください。")
+
+    headers = {}
+    if use_v2:
+        # V2は Referer/Origin が必要になるケースがあるため、明示して付ける（SmokeTestで成功済み）
+        # accessKey は query にも入れる（V2の要求に確実に合う） + Bearer も併用
+        headers = {
+            "Authorization": f"Bearer {access_key_v2}",
+            "Referer": os.environ.get("RAKUTEN_HTTP_REFERER", "https://mizutanigrandee.github.io/").strip(),
+            "Origin": os.environ.get("RAKUTEN_HTTP_ORIGIN", "https://mizutanigrandee.github.io").strip(),
+            "User-Agent": "vacancy-dashboard/update_cache",
+        }
+
+    url = API_URL_OVERRIDE or (RAKUTEN_API_URL_V2 if use_v2 else RAKUTEN_API_URL_V1)
+    print(f"🧩 Rakuten API mode: {'V2' if use_v2 else 'V1'} (http={HTTP_MODE}{', url=' + url if API_URL_OVERRIDE else ''})", file=sys.stderr)
+    return {
+        "use_v2":     use_v2,
+        "app_id":     app_id_v2 if use_v2 else app_id_v1,
+        "access_key": access_key_v2 if use_v2 else "",
+        "url":        url,
+        "headers":    headers,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def my_hotel_no() -> str:
+    """★ 自社の楽天施設番号は Secrets 必須（直書きしない）"""
+    value = (os.environ.get("RAKUTEN_MY_HOTEL_NO", "") or ("0" if OFFLINE else "")).strip()
+    if not value or not value.isdigit():
+        raise ValueError("❌ RAKUTEN_MY_HOTEL_NO が未設定 or 不正です。GitHub Secrets に数字のみで登録してください。")
+    return value
+
+
+# ---------- 1名 / 2名 出力ファイル ----------
+CACHE_FILE_1P          = "vacancy_price_cache.json"
+HISTORICAL_FILE_1P     = "historical_data.json"
+
+CACHE_FILE_2P          = "vacancy_price_cache_2p.json"
+HISTORICAL_FILE_2P     = "historical_data_2p.json"
+
+SPIKE_HISTORY_FILE     = "demand_spike_history.json"
+SPIKE_HISTORY_FILE_2P  = "demand_spike_history_2p.json"
+SPIKE_HISTORY_DAYS     = 90   # 急騰履歴に残す更新日の範囲（日）
+LAST_UPDATED_FILE      = "last_updated.json"   # フロントが読む最終更新メタ
+RUN_REPORT_FILE        = os.environ.get("RUN_REPORT_FILE", "run_report.json")  # 実行レポート（計測値・機械可読）
+PROFILE_FILE           = os.environ.get("CRAWL_PROFILE", "").strip()            # 指定時は cProfile の結果をここへ（.prof）
+REGRESSION_RATIO       = 1.5   # 前回の実行レポートよりこの倍率以上遅い段階を警告
+
+# 新規：過去日最終値保存用ファイル（1名 / 2名）
+FINAL_ARCHIVE_FILE_1P  = "finalized_daily_data.json"
+FINAL_ARCHIVE_FILE_2P  = "finalized_daily_data_2p.json"
+
+EVENT_FILE             = "event_data.json"
+
+# adultNum → 各出力ファイル
+MODE_FILES = {
+    1: {"cache": CACHE_FILE_1P, "history": HISTORICAL_FILE_1P, "archive": FINAL_ARCHIVE_FILE_1P, "shards": "history_1p", "cube": "cube_1p", "spikes": SPIKE_HISTORY_FILE},
+    2: {"cache": CACHE_FILE_2P, "history": HISTORICAL_FILE_2P, "archive": FINAL_ARCHIVE_FILE_2P, "shards": "history_2p", "cube": "cube_2p", "spikes": SPIKE_HISTORY_FILE_2P},
+}
+
+
+def mode_files(adult_num: int) -> dict:
+    """adultNum ごとの出力ファイル名（1名・2名は MODE_FILES、それ以外は同じ規則で _Np を付ける）"""
+    if adult_num in MODE_FILES:
+        return MODE_FILES[adult_num]
+    sfx = f"_{adult_num}p"
+    return {
+        "cache": f"vacancy_price_cache{sfx}.json",
+        "history": f"historical_data{sfx}.json", "archive": f"finalized_daily_data{sfx}.json",
+        "shards": f"history{sfx}", "cube": f"cube{sfx}", "spikes": f"demand_spike_history{sfx}.json",
+    }
+
+
+# 対象市場の設定（無ければ従来の大阪市・MY_HOTEL_NO だけ）
+MARKETS_FILE = os.environ.get("MARKETS_FILE", "markets.json")
+
+# フロント向け：履歴の月別シャード（minify、ファイル名に内容ハッシュ）
+EXPORT_DIR               = "data"
+EXPORT_FULL_HISTORY_JSON = os.environ.get("EXPORT_FULL_HISTORY_JSON", "1") != "0"  # 旧形式の historical_data*.json も書くか
+
+# ---------- 保存先（SQLite が正、JSON はそこからの書き出し） ----------
+#  - DB はリポジトリにコミットしない（.gitignore）。日次ワークフローが actions/cache で次の実行へ持ち越す
+#  - キャッシュが消えた時は、書き出し済みの JSON（履歴は各宿泊日の3か月前まで）から取り込み直す。
+#    その場合、JSON に無い古いスナップショット・ホテル別最安値・自社位置は失われる
+SNAPSHOT_STORE_FILE   = os.environ.get("SNAPSHOT_STORE", "vacancy_store.sqlite3")
+HISTORY_RETENTION_MONTHS = int(os.environ.get("HISTORY_RETENTION_MONTHS", "0"))  # DB 側の保持期間（0 = 無期限）
+HISTORY_EXPORT_MONTHS    = 3  # historical_data*.json に書き出す範囲（宿泊日の3か月前まで）
+
+# ホテル別最安値（競合マトリクス）を残す期間：宿泊日から何か月後まで（キャッシュと同じ3か月）
+HOTEL_PRICE_RETENTION_MONTHS = int(os.environ.get("HOTEL_PRICE_RETENTION_MONTHS", "3"))
+
+# 予約ペースキューブ：到着前 0〜CUBE_MAX_LEAD 日（履歴の書き出し範囲 ≒ 3か月に合わせる）
+CUBE_MAX_LEAD = 92
+
+# 途中再開用のチェックポイント（run ID ごとの JSONL ジャーナル。完走したら削除）
+#  - run ID の既定はクロール日（base_date()）。同じ日に落ちた実行を再実行すると、そのまま続きから取る
+#  - CRAWL_AT で実行時刻を固定した時だけ、その時刻（run_timestamp() の ":" を抜いたもの）を run ID にする
+#  - CRAWL_RUN_ID で明示もできる（CI は github.run_id）
+CHECKPOINT_DIR = os.environ.get("CRAWL_CHECKPOINT_DIR", ".crawl_checkpoint")
+CRAWL_RUN_ID   = (os.environ.get("CRAWL_RUN_ID", "").strip()
+                  or (run_timestamp().replace(":", "") if os.environ.get("CRAWL_AT", "").strip() else base_date().isoformat()))
+
+# ---------- 市場ページの取得方針（pagingInfo.pageCount を基準に日付ごとに決める） ----------
+FULL_PAGES_DAYS = int(os.environ.get("RAKUTEN_FULL_PAGES_DAYS", "30"))  # この日数以内は全ページ取得
+MAX_PAGES_NEAR  = int(os.environ.get("RAKUTEN_MAX_PAGES_NEAR", "10"))   # 全ページ取得時の安全上限
+MAX_PAGES       = int(os.environ.get("RAKUTEN_MAX_PAGES", "3"))         # 遠い日付はこのページ数だけ抽出
+
+# ---------- リフレッシュ計画（優先度スケジューラ） ----------
+REFRESH_BUDGET         = int(os.environ.get("CRAWL_REQUEST_BUDGET", "0"))       # 1回のリクエスト予算（0 = 全日付を毎回取得）
+REFRESH_ALWAYS_DAYS    = int(os.environ.get("CRAWL_REFRESH_ALWAYS_DAYS", "14"))  # この日数以内は毎回取得
+REFRESH_MAX_STALE_DAYS = int(os.environ.get("CRAWL_REFRESH_MAX_STALE_DAYS", "7"))  # これより古い値は必ず取り直す
+
+
+# ============================================================
+# 429対策（適応スロットリング＋リトライ）
+# ============================================================
+THROTTLE_SEC = float(os.environ.get("RAKUTEN_THROTTLE_SEC", "0.35"))  # 初期間隔：約2.8req/sec（0以下で無制限）
+MAX_RETRIES  = int(os.environ.get("RAKUTEN_MAX_RETRIES", "5"))
+
+# AIMD：正常応答が続く間は少しずつ上げ、429/5xx で一気に下げる
+MIN_RPS       = float(os.environ.get("RAKUTEN_MIN_RPS", "0.3"))
+MAX_RPS       = float(os.environ.get("RAKUTEN_MAX_RPS", "5.0"))
+AIMD_STEP     = float(os.environ.get("RAKUTEN_AIMD_STEP", "0.05"))    # 正常応答が1秒ぶん続くごとに +step req/sec
+AIMD_BACKOFF  = float(os.environ.get("RAKUTEN_AIMD_BACKOFF", "0.5"))  # 429/5xx で rate × backoff
+AIMD_COOLDOWN = 1.0  # 同じバーストで返ってきた 429 を1回の減速として扱う（秒）
+
+# 応答の軽量化：elements で使う項目だけ返させ、formatVersion=2 で入れ子を浅くする（0 で従来の全項目）
+LEAN_PAYLOAD      = os.environ.get("RAKUTEN_LEAN_PAYLOAD", "1") != "0"
+RESPONSE_ELEMENTS = os.environ.get("RAKUTEN_ELEMENTS", "recordCount,pageCount,page,hotelNo,total")
+
+# 並列クロール：同時リクエスト数（1 なら従来どおり直列）
+CRAWL_WORKERS = max(1, int(os.environ.get("RAKUTEN_CRAWL_WORKERS", "4")))
+
+# クロール後の処理（市場 × adultNum ごとのキャッシュ・履歴・キューブ）の同時実行数（1 なら直列）
+PIPELINE_WORKERS = max(1, int(os.environ.get("PIPELINE_WORKERS", "2")))
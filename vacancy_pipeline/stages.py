@@ -0,0 +1,485 @@
+"""
+vacancy_pipeline.stages
+– クロール結果・ストアから出力を作る段階（アーカイブ・キャッシュ・競合・履歴・キューブ・急騰・更新メタ）
+
+  どの段階もネットワークを使わない（update_cache_mode に prefetched を渡さなかった時だけその場でクロールする）。
+  requests の読み込みも最初の通信まで遅らせてあるので、再計算・書き出しだけなら import も軽い。
+"""
+
+import os
+import sys
+import json
+import hashlib
+import functools
+import datetime as dt
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dateutil.relativedelta import relativedelta
+
+import run_metrics
+from atomic_write import dumps_json
+from history_arrays import to_day
+from demand_spikes import detect_spikes_batch, SPIKE_Z
+from booking_cube import build_cube, pack_columns
+from competitor_matrix import PriceMatrix
+from event_index import load_event_index
+
+from .settings import (
+    SPIKE_HISTORY_FILE, LAST_UPDATED_FILE, EXPORT_FULL_HISTORY_JSON, HISTORY_RETENTION_MONTHS,
+    HISTORY_EXPORT_MONTHS, HOTEL_PRICE_RETENTION_MONTHS, CUBE_MAX_LEAD, PIPELINE_WORKERS, SPIKE_HISTORY_DAYS, base_date,
+    run_timestamp,
+)
+from .files import (
+    save_json_file, write_export, export_history_shards, parse_iso_date,
+)
+from .markets import Market, default_market, get_store
+from .crawl import iter_target_dates, crawl_dates
+
+
+# ------------------------------------------------------------
+# 過去日最終値を長期保存用アーカイブに退避する
+# ------------------------------------------------------------
+def archive_finalized_past_data(cache: dict, archive_file: str, today: dt.date, adult_num: int, market: Market = None):
+    """
+    cache に含まれる宿泊日が today より前のものを、過去日の最終値として
+    ストアの finalized に保存し、archive_file (JSON) に書き出す。保存するキーは iso日付文字列で、値は
+    {"vacancy": int, "avg_price": int} だけ。複数回呼び出す中で新しい日付が追加される場合もある。
+    """
+    store = get_store(market)
+    archive = {}
+
+    for iso, v in cache.items():
+        stay_date = parse_iso_date(iso)
+        if stay_date is None or stay_date >= today:
+            continue
+
+        # 保存するのは vacancy と avg_price のみ
+        vac = v.get("vacancy", 0) or 0
+        price = v.get("avg_price", 0) or 0
+
+        archive[iso] = {
+            "vacancy": int(vac),
+            "avg_price": int(price),
+        }
+
+    # 新しく確定した日・値が変わった日が無ければ、アーカイブ全体を読み直して書き出すこともしない
+    changed = store.upsert_finalized(adult_num, archive)
+    if not changed and Path(archive_file).exists():
+        print(f"🗂 archive unchanged: {archive_file}", file=sys.stderr)
+        return
+    save_json_file(archive_file, store.load_finalized(adult_num))
+    print(f"🗂 archived finalized past data: {archive_file} (+{changed})", file=sys.stderr)
+
+
+# ------------------------------------------------------------
+# 当日以降の未来日を更新（モード別：1名/2名）
+#  - prefetched を渡すと取得済み結果から組み立てる（出力は直列時と同一）
+#  - prefetched に無い日付（リフレッシュ計画で見送り）は前回値を持ち越す
+# ------------------------------------------------------------
+def price_diffs(vacancy, avg_price, last_vac, last_price) -> dict:
+    """前回値と差分（クロール時も再計算時も同じ式）"""
+    return {
+        "last_vacancy":   last_vac,
+        "last_avg_price": last_price,
+        "vacancy_diff":   vacancy - last_vac,
+        "avg_price_diff": avg_price - last_price,
+    }
+
+
+def my_vs_avg_pct(my_price, avg_price):
+    """自社価格の市場平均比（%）。どちらかが無ければ None"""
+    return round((my_price - avg_price) / avg_price * 100, 1) if (my_price and avg_price) else None
+
+
+def _carry_forward(entry: dict) -> dict:
+    """今回取得しなかった日付：値はそのまま、差分は0、updated_at（鮮度）は前回取得日のまま。"""
+    entry = dict(entry)
+    entry["last_vacancy"]   = entry.get("vacancy", 0)
+    entry["last_avg_price"] = entry.get("avg_price", 0)
+    entry["vacancy_diff"]   = 0
+    entry["avg_price_diff"] = 0.0
+    return entry
+
+
+def with_events(cache: dict, market: Market = None) -> dict:
+    """
+    書き出し用：イベントのある宿泊日に "events": [{"icon", "name"}, ...] を付けたキャッシュ
+    （ダッシュボードは日付ごとにこれを読むだけ。ストアの cache には入れない）
+    """
+    index = load_event_index((market or default_market()).event_file)
+    out = {}
+    for iso, v in cache.items():
+        evs = index.events(iso)
+        if evs:
+            v = {**v, "events": evs}
+        elif "events" in v:
+            v = {k: x for k, x in v.items() if k != "events"}
+        out[iso] = v
+    return out
+
+
+def update_competitor_matrix(adult_num: int, fresh: dict, today: dt.date, market: Market = None) -> dict:
+    """
+    今回取得した日のホテル別最安値をストアへ差分保存し、競合セットの指標を宿泊日ごとにまとめて計算。
+    fresh : {iso: (market, my_price)}
+    戻り値: {iso: {"median_price", "hotel_count", "my_rank", "my_price_pct"}}
+    """
+    store    = get_store(market)
+    by_stay  = {iso: m["hotels"] for iso, (m, _) in fresh.items() if m.get("hotels")}
+    complete = {iso for iso, (m, _) in fresh.items() if m.get("complete")}
+    written  = store.append_hotel_prices(adult_num, run_timestamp(), by_stay, complete)
+    pruned   = store.prune_hotel_prices(
+        adult_num, (today - relativedelta(months=HOTEL_PRICE_RETENTION_MONTHS)).isoformat())
+
+    mat    = PriceMatrix.from_snapshot(by_stay)
+    stays  = mat.stay_labels()
+    my     = np.array([fresh[iso][1] or np.nan for iso in stays], dtype=float)
+    median = mat.median()
+    count  = mat.count()
+    rank   = mat.rank_of(my)
+    pct    = mat.percentile_of(my)
+    print(f"🏨 competitors[{(market or default_market()).id}]({adult_num}p): {mat.shape[0]} hotels × {mat.shape[1]} dates "
+          f"(+{written} changed rows, pruned {pruned})", file=sys.stderr)
+    return {
+        iso: {
+            "median_price": float(round(median[i])) if count[i] else None,
+            "hotel_count":  int(count[i]),
+            "my_rank":      int(rank[i]) or None,
+            "my_price_pct": None if np.isnan(pct[i]) else round(float(pct[i]), 1),
+        }
+        for i, iso in enumerate(stays)
+    }
+
+
+def update_cache_mode(start_date: dt.date, months: int, adult_num: int, cache_file: str, final_archive_file: str, prefetched: dict = None, market: Market = None) -> dict:
+    today            = base_date()
+    three_months_ago = today - relativedelta(months=3)
+    market           = market or default_market()
+
+    store = get_store(market)
+    cache = store.load_cache(adult_num)
+    old_cache = cache  # 前回保存値（差分の基準）。下では cache を作り直すだけで、この dict は書き換えない
+
+    # 先に過去日のデータをアーカイブへ退避
+    archive_finalized_past_data(cache, final_archive_file, today, adult_num, market)
+
+    # 過去3か月より前は削除
+    cache = {k: v for k, v in cache.items() if (parse_iso_date(k) or dt.date.min) >= three_months_ago}
+
+    target_dates = iter_target_dates(start_date, months, today)
+    if prefetched is None:
+        prefetched = crawl_dates([(market.id, adult_num, d) for d in target_dates])
+
+    competitors = update_competitor_matrix(
+        adult_num,
+        {d.isoformat(): prefetched[(market.id, adult_num, d)] for d in target_dates if (market.id, adult_num, d) in prefetched},
+        today,
+        market,
+    )
+
+    for day in target_dates:
+        iso = day.isoformat()
+        if (market.id, adult_num, day) not in prefetched:
+            if iso in cache:
+                cache[iso] = _carry_forward(cache[iso])
+            continue
+        res, my_p = prefetched[(market.id, adult_num, day)]
+
+        # API失敗日はスキップし既存値保持（0/0は更新しない）
+        if res["vacancy"] == 0 and res["avg_price"] == 0.0:
+            print(f"⏩ skip {iso} ({adult_num}p) (empty)", file=sys.stderr)
+            continue
+
+        prev       = old_cache.get(iso, {})
+        last_vac   = prev.get("vacancy",   res["vacancy"])
+        last_price = prev.get("avg_price", res["avg_price"])
+        comp = competitors.get(iso, {})
+
+        cache[iso] = {
+            "vacancy":        res["vacancy"],
+            "avg_price":      res["avg_price"],
+            **price_diffs(res["vacancy"], res["avg_price"], last_vac, last_price),
+            # 自社情報（1名/2名どちらも同じキー名で保存）
+            "my_price":       my_p if my_p else 0.0,
+            "my_vs_avg_pct":  my_vs_avg_pct(my_p, res["avg_price"]),
+            # 競合セット（ホテル別最安値から）：中央値・件数・自社の安い順順位・市場内パーセンタイル
+            "median_price":   comp.get("median_price"),
+            "hotel_count":    comp.get("hotel_count", 0),
+            "my_rank":        comp.get("my_rank"),
+            "my_price_pct":   comp.get("my_price_pct"),
+            # 鮮度：この値を実際に取得した日
+            "updated_at":     today.isoformat(),
+        }
+        if len(market.my_hotels) > 1:
+            cache[iso]["my_prices"] = res.get("my_prices") or {}
+
+    store.save_cache(adult_num, cache)
+    save_json_file(cache_file, with_events(cache, market))
+    print(f"✅ cache updated: {cache_file}", file=sys.stderr)
+    return cache
+
+
+# ------------------------------------------------------------
+# 過去3か月のスナップショット履歴（モード別）
+#  - キーは実行時刻（run_timestamp）。同じ日の2回目以降の実行も別のスナップショットとして残る
+#  - ストアには値が変わった宿泊日だけ書く。書き出す JSON は1日1スナップショット（その日の最後の実行）
+# ------------------------------------------------------------
+def update_history_mode(cache: dict, historical_file: str, adult_num: int, market: Market = None):
+    today     = base_date()
+    run_at    = run_timestamp()
+    market    = market or default_market()
+    store     = get_store(market)
+
+    # 未来日の今回時点の値（前回から変わった分だけ INSERT）
+    rows = {
+        iso: {"vacancy": v.get("vacancy", 0), "avg_price": v.get("avg_price", 0)}
+        for iso, v in cache.items()
+        if (parse_iso_date(iso) or dt.date.min) >= today
+    }
+    changed = store.append_snapshots(adult_num, run_at, rows)
+    store.append_positions(adult_num, run_at, {
+        iso: {"my_price": cache[iso].get("my_price"), "my_pct": cache[iso].get("my_price_pct")} for iso in rows
+    })
+
+    # DB 側の保持期間（宿泊日ごとの範囲 DELETE）
+    pruned = store.prune_snapshots(adult_num, HISTORY_RETENTION_MONTHS)
+
+    export_history(adult_num, historical_file, market)
+    print(f"📁 {historical_file} updated ({run_at}: {changed}/{len(rows)} stays changed, pruned {pruned})", file=sys.stderr)
+
+
+def export_history(adult_num: int, historical_file: str = None, market: Market = None):
+    """ダッシュボード用の JSON は各宿泊日の3か月前までを書き出す（月別シャード＋必要なら旧形式の単一ファイル）"""
+    market = market or default_market()
+    hist = get_store(market).load_history(adult_num, window_months=HISTORY_EXPORT_MONTHS)
+    export_history_shards(hist, market.files(adult_num)["shards"], out_dir=market.export_dir)
+    if EXPORT_FULL_HISTORY_JSON:
+        save_json_file(historical_file or market.files(adult_num)["history"], hist)
+
+
+# ------------------------------------------------------------
+# 予約ペースキューブ（宿泊日 × 到着までの日数）を型付き列形式で書き出す
+#  - data/<cube>.<hash>.bin（生配列）と data/<cube>.json（レイアウト・宿泊日一覧・参照曲線名）
+#  - ダッシュボードは推移グラフをこれから直接描く（履歴JSONを読んで組み立て直さない）
+# ------------------------------------------------------------
+def update_booking_cube(adult_num: int, out_dir: str = None, market: Market = None) -> dict:
+    today   = base_date()
+    market  = market or default_market()
+    out_dir = out_dir or market.export_dir
+    store   = get_store(market)
+    name    = market.files(adult_num)["cube"]
+    arrays = store.load_history_arrays(adult_num).window(HISTORY_EXPORT_MONTHS)
+    cube = build_cube(
+        arrays,
+        store.load_positions(adult_num),
+        store.load_finalized(adult_num),
+        load_event_index(market.event_file).by_date,
+        to_day(today),
+        leads=CUBE_MAX_LEAD + 1,
+        stay_from_day=to_day(today - relativedelta(months=HISTORY_EXPORT_MONTHS)),
+    )
+    raw, layout = pack_columns(cube["columns"])
+    digest = hashlib.sha256(raw).hexdigest()
+    fname  = f"{name}.{digest[:12]}.bin"
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    if not (out / fname).exists():
+        write_export(out / fname, raw)
+    for p in out.glob(f"{name}.*.bin*"):
+        if p.name != fname:
+            p.unlink()
+
+    meta = {
+        "version":    1,
+        "adult_num":  adult_num,
+        "file":       fname,
+        "sha256":     digest,
+        "bytes":      len(raw),
+        "leads":      CUBE_MAX_LEAD + 1,
+        "stays":      cube["stays"],
+        "ref_labels": cube["ref_labels"],
+        "columns":    layout,
+    }
+    write_export(out / f"{name}.json", dumps_json(meta))
+    print(f"🧊 {name}: {len(cube['stays'])} stays × {CUBE_MAX_LEAD + 1} leads, {len(raw)} bytes", file=sys.stderr)
+    return meta
+
+
+# ------------------------------------------------------------
+# 急騰検知（方向固定：客室↓ × 単価↑）：履歴から 1/3/7日 × z スコアで一括検知
+# ------------------------------------------------------------
+def detect_demand_spikes_all(today: dt.date = None, market: Market = None) -> dict:
+    """
+    履歴スナップショット（市場の全 adultNum）から 1/3/7日ウィンドウ × リードタイム別 z スコアで急騰を一括検知。
+    戻り値: {adult_num: [レコード, ...]}（スコア降順。従来の前回値比較版と同じ項目も含む）
+    """
+    today  = today or base_date()
+    market = market or default_market()
+    store  = get_store(market)
+    stay_from = today.isoformat()
+    histories = {n: store.load_history_arrays(n, stay_from=stay_from) for n in market.adults}
+    event_days = load_event_index(market.event_file).day_set(since=today)
+
+    spikes = detect_spikes_batch(histories, to_day(today), event_days)
+    for n, items in spikes.items():
+        print(f"📊 Demand Spikes Detected [{market.id}] {n}p (1/3/7d, z≥{SPIKE_Z}): {len(items)} 件", file=sys.stderr)
+    return spikes
+
+
+def load_demand_spike_history(history_file: str) -> dict:
+    if os.path.exists(history_file):
+        try:
+            with open(history_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ error loading {history_file}: {e}", file=sys.stderr)
+    return {}
+
+
+def save_demand_spike_history(demand_spikes, history_file=SPIKE_HISTORY_FILE, updates: dict = None):
+    """
+    今日の検知結果を追記して、古い更新日・過去日の急騰・方向違いのレコードを落として書き出す。
+    updates={更新日: [レコード, ...]} を渡すとその日付ぶんをまとめて差し替える（再計算用）。
+    """
+    today_dt = base_date()
+    today_iso = today_dt.isoformat()
+
+    history = load_demand_spike_history(history_file)
+    if updates is None:
+        history[today_iso] = demand_spikes or []
+    else:
+        history = dict(sorted({**history, **updates}.items()))
+
+    limit = (today_dt - dt.timedelta(days=SPIKE_HISTORY_DAYS)).isoformat()
+    history = {d: v for d, v in history.items() if d >= limit}
+
+    cleaned = {}
+    for up_date, items in history.items():
+        new_items = []
+        for it in items or []:
+            sd = it.get("spike_date")
+            try:
+                if sd and dt.date.fromisoformat(sd) < today_dt:
+                    continue
+            except Exception:
+                pass
+
+            p_diff = it.get("price_diff", 0)
+            v_diff = it.get("vacancy_diff", 0)
+            if not (isinstance(p_diff, (int, float)) and isinstance(v_diff, (int, float))):
+                continue
+            if not (p_diff > 0 and v_diff < 0):
+                continue
+
+            new_items.append(it)
+        cleaned[up_date] = new_items
+
+    if save_json_file(history_file, cleaned, compact=False):
+        print(f"📁 {history_file} cleaned & updated", file=sys.stderr)
+    else:
+        print(f"📁 {history_file} unchanged", file=sys.stderr)
+
+
+# ------------------------------------------------------------
+# 最終更新メタの書き出し（JST）
+# ------------------------------------------------------------
+def write_last_updated():
+    JST = dt.timezone(dt.timedelta(hours=9))
+    now = dt.datetime.now(JST)
+    payload = {
+        "last_updated_iso": now.isoformat(timespec="seconds"),
+        "last_updated_jst": now.strftime("%Y-%m-%d %H:%M:%S JST"),
+        "source": "github-actions",
+        "git_sha": os.environ.get("GITHUB_SHA", "")[:7],
+        "note": "vacancy/price crawl finished",
+    }
+    try:
+        save_json_file(LAST_UPDATED_FILE, payload, compact=False)
+        print(f"🕒 {LAST_UPDATED_FILE} written: {payload['last_updated_jst']}", file=sys.stderr)
+    except Exception as e:
+        print(f"⚠️ failed to write {LAST_UPDATED_FILE}: {e}", file=sys.stderr)
+
+
+# ------------------------------------------------------------
+# ストアからの書き出しだけ（取得・追記・削除をしない。出力形式を変えた時や手で直した後に）
+# ------------------------------------------------------------
+def export_outputs(market: Market, adult_num: int):
+    files = market.files(adult_num)
+    store = get_store(market)
+    with run_metrics.timer("stage", "export"):
+        save_json_file(files["cache"], with_events(store.load_cache(adult_num), market))
+        save_json_file(files["archive"], store.load_finalized(adult_num))
+        export_history(adult_num, files["history"], market)
+        update_booking_cube(adult_num=adult_num, market=market)
+    print(f"📤 exported {market.id} {adult_num}p from store", file=sys.stderr)
+
+
+# ------------------------------------------------------------
+# クロール後の処理
+#  - (市場, adultNum) ごとのキャッシュ → 履歴 → キューブは互いに独立なので PIPELINE_WORKERS 本で並列
+#    スレッドで回す（中身は SQLite・ファイル I/O と NumPy が大半。SQLite の接続はスレッドごと、
+#    書き出し先のファイルも (市場, adultNum) ごとに別）。ストアの取り込み・形式変換は cli が先に済ませておく
+#  - 急騰検知は市場の全 adultNum の履歴が揃ってから市場ごとに
+# ------------------------------------------------------------
+def run_parallel(jobs: list, workers: int = PIPELINE_WORKERS) -> list:
+    """引数なしの関数のリストを workers 本のスレッドで実行し、結果を同じ順で返す（例外はそのまま上げる）"""
+    if workers <= 1 or len(jobs) <= 1:
+        return [job() for job in jobs]
+    with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(lambda job: job(), jobs))
+
+
+def update_adult_cache(market: Market, adult_num: int, today: dt.date, prefetched: dict) -> dict:
+    """(市場, adultNum) ぶんのキャッシュ（アーカイブ・競合指標を含む）。prefetched は全タスク分のままでよい"""
+    files = market.files(adult_num)
+    with run_metrics.timer("stage", "cache"):
+        return update_cache_mode(
+            start_date=today,
+            months=9,
+            adult_num=adult_num,
+            cache_file=files["cache"],
+            final_archive_file=files["archive"],
+            prefetched={k: v for k, v in prefetched.items() if k[:2] == (market.id, adult_num)},
+            market=market,
+        )
+
+
+def update_adult_history(market: Market, adult_num: int, cache: dict = None):
+    """(市場, adultNum) ぶんの履歴・キューブ（cache を省くとストアのキャッシュから）"""
+    with run_metrics.timer("stage", "history"):
+        if cache is None:
+            cache = get_store(market).load_cache(adult_num)
+        update_history_mode(cache, market.files(adult_num)["history"], adult_num=adult_num, market=market)
+    with run_metrics.timer("stage", "cube"):
+        update_booking_cube(adult_num=adult_num, market=market)
+
+
+def update_adult_outputs(market: Market, adult_num: int, today: dt.date, prefetched: dict):
+    """(市場, adultNum) ぶんのキャッシュ・履歴・キューブ"""
+    update_adult_history(market, adult_num, update_adult_cache(market, adult_num, today, prefetched))
+
+
+def update_archive(market: Market, adult_num: int, today: dt.date):
+    """(市場, adultNum) ぶんの過去日の最終値（ストアのキャッシュから）"""
+    with run_metrics.timer("stage", "archive"):
+        archive_finalized_past_data(get_store(market).load_cache(adult_num), market.files(adult_num)["archive"],
+                                    today, adult_num, market)
+
+
+def update_spikes(market: Market, today: dt.date):
+    """急騰（市場の全 adultNum を履歴からまとめて検知）"""
+    with run_metrics.timer("stage", "spikes"):
+        demand_spikes = detect_demand_spikes_all(today, market=market)
+        for n in market.adults:
+            save_demand_spike_history(demand_spikes.get(n, []), market.files(n)["spikes"])
+
+
+def update_market_outputs(targets: list, today: dt.date, prefetched: dict, workers: int = PIPELINE_WORKERS):
+    """
+    targets: [(market, [adult_num, ...]), ...]
+    (市場, adultNum) ごとのキャッシュ・履歴・キューブ → 市場ごとの急騰
+    """
+    run_parallel([functools.partial(update_adult_outputs, m, n, today, prefetched) for m, adults in targets for n in adults], workers)
+    run_parallel([functools.partial(update_spikes, m, today) for m, _ in targets], workers)
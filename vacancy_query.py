@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+vacancy_query.py
+– キャッシュ・履歴・過去日アーカイブを日付で引く読み取り専用の問い合わせ層
+
+  vacancy_price_cache*.json / finalized_daily_data*.json → DateTable（宿泊日 → 1件）
+  historical_data*.json                                  → HistoryTable（宿泊日 × 取得日）
+
+  ・ファイルごとに読み込みは1回。mtime・サイズが変わった時だけ読み直す（同じ実行の中で何度呼んでもよい）
+  ・日付は 1970-01-01 からの日数（int32）の昇順配列で持ち、範囲・曜日・前年同日・リードタイムは
+    searchsorted とマスクで引く（dict を頭から舐め直さない）。数値列は初回に配列にして使い回す
+  ・パイプラインはストアから読んだ dict / HistoryArrays を from_dict / HistoryTable(...) で同じ形にして使う
+
+  ノートブック・スクリプトから:
+      from vacancy_query import Dataset
+      q = Dataset(".")                                   # 1名/2名のファイルを output_dir から
+      q.cache(2).range("2026-08-01", "2026-08-31")       # {iso: キャッシュ1件}
+      q.cache(1).weekday(5, "2026-08-01")                 # 土曜（0 = 月曜）
+      q.archive(1).last_year("2026-08-15")                # 前年同日の最終値
+      q.history(2).at_lead(30, "2026-08-01")             # 30日前時点の {宿泊日: {"vacancy", "avg_price"}}
+      q.compare("2026-08-01", "2026-08-31")              # {iso: {"1p": 平均価格, "2p": 平均価格}}
+"""
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from history_arrays import HistoryArrays, iso_to_days, days_to_iso, months_before, to_day, is_date_string
+
+_lock  = threading.Lock()
+_cache = {}   # (種類, path) → ((mtime_ns, size), テーブル)
+
+
+def _day(d) -> int:
+    """date / ISO文字列 / 日数 → 日数"""
+    return int(d) if isinstance(d, (int, np.integer)) else to_day(d)
+
+
+def _weekdays(days: np.ndarray) -> np.ndarray:
+    """日数 → 曜日（0 = 月曜。1970-01-01 は木曜）"""
+    return (np.asarray(days, dtype=np.int64) + 3) % 7
+
+
+def _bounds(days: np.ndarray, start=None, end=None) -> tuple:
+    """昇順の days のうち start 〜 end（両端含む。None は端まで）の添字範囲"""
+    lo = 0 if start is None else int(np.searchsorted(days, _day(start), side="left"))
+    hi = len(days) if end is None else int(np.searchsorted(days, _day(end), side="right"))
+    return lo, max(lo, hi)
+
+
+class DateTable:
+    """宿泊日（iso）→ 1件（dict）。days は昇順の日数、rows は同じ並びの元の dict（書き換えない）。"""
+
+    __slots__ = ("days", "isos", "rows", "_pos", "_columns")
+
+    def __init__(self, isos: list, rows: list):
+        self.isos = isos
+        self.rows = rows
+        self.days = iso_to_days(isos) if isos else np.array([], dtype=np.int32)
+        self._pos = {iso: i for i, iso in enumerate(isos)}
+        self._columns = {}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DateTable":
+        """{iso: dict}（日付でないキー・dict でない値は読み飛ばす）"""
+        isos = sorted(k for k, v in (data or {}).items() if is_date_string(k) and isinstance(v, dict))
+        return cls(isos, [data[k] for k in isos])
+
+    def __len__(self):
+        return len(self.isos)
+
+    def __contains__(self, iso) -> bool:
+        return iso in self._pos
+
+    def get(self, iso: str, default=None):
+        i = self._pos.get(iso)
+        return default if i is None else self.rows[i]
+
+    def column(self, name: str) -> np.ndarray:
+        """数値列（無い・数値でない値は NaN）。1回作ったら使い回す"""
+        col = self._columns.get(name)
+        if col is None:
+            col = self._columns[name] = np.array(
+                [r.get(name) if isinstance(r.get(name), (int, float)) else np.nan for r in self.rows], dtype=np.float64)
+        return col
+
+    def _pick(self, idx) -> dict:
+        return {self.isos[i]: self.rows[i] for i in idx}
+
+    # ---------- 問い合わせ ----------
+    def range(self, start=None, end=None) -> dict:
+        """start 〜 end（両端含む）の {iso: 1件}（日付昇順）"""
+        lo, hi = _bounds(self.days, start, end)
+        return self._pick(range(lo, hi))
+
+    def values(self, name: str, start=None, end=None) -> tuple:
+        """start 〜 end の (日数の配列, 数値列の配列)。集計用（コピーしないビュー）"""
+        lo, hi = _bounds(self.days, start, end)
+        return self.days[lo:hi], self.column(name)[lo:hi]
+
+    def weekday(self, weekday: int, start=None, end=None) -> dict:
+        """start 〜 end のうち曜日が weekday（0 = 月曜 … 6 = 日曜）の日"""
+        lo, hi = _bounds(self.days, start, end)
+        hit = np.nonzero(_weekdays(self.days[lo:hi]) == weekday)[0] + lo
+        return self._pick(hit.tolist())
+
+    def last_year(self, iso: str, default=None):
+        """前年同日の1件（2/29 は前年の 2/28）"""
+        return self.get(days_to_iso(months_before([to_day(iso)], 12))[0], default)
+
+
+class HistoryTable:
+    """宿泊日 × 取得日の履歴。宿泊日ごとの行範囲と、リードタイム（宿泊日 − 取得日）の列を持つ。"""
+
+    __slots__ = ("arrays", "stays", "_start", "_end", "_lead")
+
+    def __init__(self, arrays: HistoryArrays):
+        self.arrays = arrays
+        self.stays, self._start, counts = np.unique(arrays.stay, return_index=True, return_counts=True)
+        self._end = self._start + counts
+        self._lead = arrays.stay.astype(np.int64) - arrays.snap
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HistoryTable":
+        """{stay: {snap: {"vacancy", "avg_price"}}}（historical_data*.json と同じ形）"""
+        return cls(HistoryArrays.from_nested(data or {}))
+
+    def __len__(self):
+        return len(self.stays)
+
+    def __contains__(self, iso) -> bool:
+        return self._row(iso) >= 0
+
+    def _row(self, iso) -> int:
+        d = _day(iso)
+        i = int(np.searchsorted(self.stays, d))
+        return i if i < len(self.stays) and self.stays[i] == d else -1
+
+    # ---------- 問い合わせ ----------
+    def series(self, iso) -> HistoryArrays:
+        """宿泊日 iso のスナップショット（取得日昇順。コピーしないビュー。無ければ空）"""
+        i = self._row(iso)
+        if i < 0:
+            return HistoryArrays.empty()
+        s = slice(self._start[i], self._end[i])
+        a = self.arrays
+        return HistoryArrays(a.stay[s], a.snap[s], a.vacancy[s], a.price[s], a.at[s])
+
+    def snapshots(self, iso) -> dict:
+        """宿泊日 iso の {snap_iso: {"vacancy", "avg_price"}}（historical_data*.json の1日分と同じ形）"""
+        return self.series(iso).to_nested().get(iso if isinstance(iso, str) else days_to_iso([iso])[0], {})
+
+    def at_lead(self, lead: int, start=None, end=None) -> dict:
+        """start 〜 end の各宿泊日の、到着 lead 日前のスナップショット {stay_iso: {"vacancy", "avg_price"}}"""
+        lo, hi = _bounds(self.stays, start, end)
+        if lo >= hi:
+            return {}
+        rows = slice(self._start[lo], self._end[hi - 1])
+        hit = np.nonzero(self._lead[rows] == lead)[0] + rows.start
+        a = self.arrays
+        return {
+            iso: {"vacancy": v, "avg_price": p}
+            for iso, v, p in zip(days_to_iso(a.stay[hit]).tolist(), a.vacancy[hit].tolist(), a.price[hit].tolist())
+        }
+
+    def lead_curve(self, iso) -> dict:
+        """宿泊日 iso の {リードタイム: {"vacancy", "avg_price"}}（リードタイム降順 = 取得日昇順）"""
+        s = self.series(iso)
+        lead = s.stay.astype(np.int64) - s.snap
+        return {
+            int(k): {"vacancy": v, "avg_price": p}
+            for k, v, p in zip(lead.tolist(), s.vacancy.tolist(), s.price.tolist())
+        }
+
+
+# ------------------------------------------------------------
+# ファイルからの読み込み（mtime・サイズで無効化）
+# ------------------------------------------------------------
+def _load(kind: str, path, build):
+    p = Path(path)
+    try:
+        st = p.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = None
+    key = (kind, str(p))
+    with _lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == stamp:
+            return hit[1]
+    try:
+        data = json.loads(p.read_text(encoding="utf-8")) if stamp else {}
+    except Exception:
+        data = {}
+    table = build(data)
+    with _lock:
+        _cache[key] = (stamp, table)
+    return table
+
+
+def load_table(path) -> DateTable:
+    """vacancy_price_cache*.json / finalized_daily_data*.json"""
+    return _load("table", path, DateTable.from_dict)
+
+
+def load_history_table(path) -> HistoryTable:
+    """historical_data*.json"""
+    return _load("history", path, HistoryTable.from_dict)
+
+
+class Dataset:
+    """1名/2名のファイル一式（output_dir 配下。ファイル名は vacancy_pipeline.settings.mode_files と同じ）"""
+
+    def __init__(self, output_dir: str = "."):
+        self.output_dir = Path(output_dir)
+
+    def _path(self, adult_num: int, kind: str) -> Path:
+        from vacancy_pipeline.settings import mode_files  # 設定値だけ（通信・検証はしない）
+        return self.output_dir / mode_files(adult_num)[kind]
+
+    def cache(self, adult_num: int = 1) -> DateTable:
+        return load_table(self._path(adult_num, "cache"))
+
+    def archive(self, adult_num: int = 1) -> DateTable:
+        return load_table(self._path(adult_num, "archive"))
+
+    def history(self, adult_num: int = 1) -> HistoryTable:
+        return load_history_table(self._path(adult_num, "history"))
+
+    def compare(self, start=None, end=None, column: str = "avg_price", kind: str = "cache") -> dict:
+        """start 〜 end の 1名/2名 の値を並べる {iso: {"1p", "2p"}}（片方に無い日は None）"""
+        one, two = getattr(self, kind)(1), getattr(self, kind)(2)
+        d1, v1 = one.values(column, start, end)
+        d2, v2 = two.values(column, start, end)
+        days = np.union1d(d1, d2)
+
+        def _align(d, v):
+            out = np.full(len(days), np.nan)
+            out[np.searchsorted(days, d)] = v
+            return [None if np.isnan(x) else x for x in out.tolist()]
+
+        return {iso: {"1p": a, "2p": b} for iso, a, b in zip(days_to_iso(days).tolist(), _align(d1, v1), _align(d2, v2))}